@@ -11,6 +11,13 @@ MONGO_DB_AUTH_SOURCE = 'cpsc313'
 MONGO_DB_CLASS_DB = 'cpsc313'
 MONGO_DB_CLASS_ROOM_LIST = 'rooms'
 MONGO_DB_CLASS_USERS = 'lab5users'
+MONGO_DB_CLASS_MODERATION = 'moderation'
+MONGO_DB_CLASS_SEARCH_INDEX = 'search_index'
+MONGO_DB_CLASS_MESSAGES = 'messages'
+MONGO_DB_CLASS_ROOM_METADATA = 'room_metadata'
+MONGO_DB_CLASS_MIGRATIONS = 'migrations'
+MONGO_DB_CLASS_SEQUENCE = 'sequence'
+MONGO_DB_CLASS_SEQUENCE_COUNTERS = 'sequence_counters'
 MONGO_DB_AUTH_MECHANISM = 'SCRAM-SHA-256'
 DEFAULT_PUBLIC_ROOM = 'general'
 DEFAULT_PRIVATE_ROOM = 'kevin_private'
@@ -31,8 +38,6 @@ ROOM_TYPE_PUBLIC = 1
 ROOM_TYPE_PRIVATE = 2
 GET_ALL_MESSAGES = -1
 CHAT_ROOM_INDEX_NOT_FOUND = -1
-RIGHT_SIDE_OF_DEQUE = -1
-RANGE_STEP = -1
 PUBLIC_MESSAGE = 10
 PRIVATE_MESSAGE = 20
 DIRECT_MESSAGE = 30
@@ -44,6 +49,81 @@ UNABLE_TO_ADD_MEMBER = 2
 SEQUENCE_NUMBER_NOT_FOUND = -1
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# mongo connection pool constants
+MONGO_DB_MAX_POOL_SIZE = 100
+MONGO_DB_MIN_POOL_SIZE = 0
+MONGO_DB_CONNECT_TIMEOUT_MS = 5000
+MONGO_DB_SERVER_SELECTION_TIMEOUT_MS = 5000
+MONGO_DB_SOCKET_TIMEOUT_MS = 10000
+
+# room list cache constants
+ROOM_CACHE_MAX_ROOMS = 256
+ROOM_CACHE_MAX_BYTES = 256 * 1024 * 1024
+ROOM_CACHE_MAX_IDLE_SECONDS = 30 * 60
+# a message with its properties and its place in the store is about 350 bytes (see memory_benchmark.py), the rest is the indexes and views
+ESTIMATED_MESSAGE_BYTES = 512
+
+# sequence number constants
+SEQUENCE_COUNTER_ID = 'userid'
+SEQUENCE_BLOCK_SIZE = 1000
+
+# database executor constants
+DB_EXECUTOR_MAX_WORKERS = 32
+DB_EXECUTOR_MAX_PENDING = 512
+DB_EXECUTOR_RETRY_AFTER_SECONDS = 1
+
+# room actor constants
+ROOM_ACTOR_MAILBOX_SIZE = 1024
+ROOM_ACTOR_MAX_BATCH = 256
+
+# write-behind constants
+ACK_AFTER_FLUSH = 'ack_after_flush'
+ACK_ON_ENQUEUE = 'ack_on_enqueue'
+WRITE_BEHIND_DURABILITY = ACK_AFTER_FLUSH
+SEND_NOT_DURABLE = 'send_not_durable'
+WRITE_BEHIND_FLUSH_INTERVAL_MS = 50
+WRITE_BEHIND_MAX_BATCH = 500
+
+# long poll constants (seconds)
+LONG_POLL_DEFAULT_TIMEOUT = 30
+LONG_POLL_MAX_TIMEOUT = 120
+
+# push subscription constants
+ROOM_SUBSCRIPTION_QUEUE_SIZE = 256
+ROOM_SUBSCRIPTION_HEARTBEAT_SECONDS = 15
+
+# message store constants
+MESSAGE_STORE_CHUNK_SIZE = 512
+MESSAGE_STORE_SEGMENT_SIZE = 64
+
+# moderation constants
+MODERATION_SETTINGS_ID = 'banned_terms'
+MODERATION_ACTION_FLAG = 'flag'
+MODERATION_ACTION_REMOVE = 'remove'
+MODERATION_ACTION = MODERATION_ACTION_FLAG
+
+# search constants
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+SEARCH_POSTING_BUCKET_SIZE = 1024
+SEARCH_RESTORE_BATCH_SIZE = 1000
+
+# restore constants
+RESTORE_BATCH_SIZE = 2000
+RESTORE_PROGRESS_INTERVAL = 50000
+RESTORE_MESSAGE_PROJECTION = {'message': True, 'sequence_num': True, 'mess_props': True, 'removed': True, 'flagged': True, 'revisions': True}
+
+# migration constants
+MIGRATION_BATCH_SIZE = 1000
+DUPLICATE_KEY_ERROR_CODE = 11000
+
+# read view constants
+READ_VIEW_MIN_READS = 3
+READ_VIEW_MAX_VIEWS = 32
+
+# snapshot read constants
+SNAPSHOT_READ_RETRIES = 3
+
 # boolean constants
 REMOVED_ROOM = True
 
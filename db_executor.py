@@ -0,0 +1,75 @@
+import asyncio
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from constants import *
+
+''' This file holds the executor that the async API handlers run their blocking mongo work on.
+    NOTE: pymongo is synchronous, so a handler that persists on the event loop stops every other request until mongo answers.
+            The handlers hand that work to a small pool of threads instead and await it, so the loop keeps serving requests.
+    NOTE: the number of calls that are running or waiting for a thread is bounded (backpressure). Past max_pending, run() raises
+            DatabaseBusyError right away, the API answers 503 and the client retries, instead of the queue growing without end.
+    NOTE: the pool is sized below the mongo connection pool, so a thread never waits on a connection.
+'''
+
+logging.basicConfig(filename='message_chat.log', level=logging.DEBUG, format = LOG_FORMAT)
+
+class DatabaseBusyError(Exception):
+    """ Raised by DatabaseExecutor.run() when too many calls are already running or waiting
+    """
+    pass
+
+class DatabaseExecutor():
+    """ Bounded thread pool for the blocking database calls of the API.
+        NOTE: the pool threads are only started when the first call comes in
+    """
+    def __init__(self, max_workers: int = DB_EXECUTOR_MAX_WORKERS, max_pending: int = DB_EXECUTOR_MAX_PENDING) -> None:
+        self.__executor = ThreadPoolExecutor(max_workers = max_workers, thread_name_prefix = 'db-executor')
+        self.__max_workers = max_workers
+        self.__max_pending = max_pending
+        self.__lock = threading.Lock()
+        self.__num_pending = 0
+        self.__num_completed = 0
+        self.__num_rejected = 0
+
+    # property to get the number of calls that are running or waiting for a thread
+    @property
+    def num_pending(self):
+        return self.__num_pending
+
+    # property to get the most calls that can be running or waiting at once
+    @property
+    def max_pending(self):
+        return self.__max_pending
+
+    async def run(self, function, *args, **kwargs):
+        ''' This method will run the function on a pool thread and return its result without blocking the event loop
+            NOTE: raises DatabaseBusyError if max_pending calls are already running or waiting
+        '''
+        with self.__lock:
+            if self.__num_pending >= self.__max_pending:
+                self.__num_rejected += 1
+                logging.warning(f'Database executor is full with {self.__num_pending} calls, rejecting {getattr(function, "__name__", function)}.')
+                raise DatabaseBusyError(f'{self.__num_pending} database calls are already pending.')
+            self.__num_pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.__executor, functools.partial(function, *args, **kwargs))
+        finally:
+            with self.__lock:
+                self.__num_pending -= 1
+                self.__num_completed += 1
+
+    def stats(self) -> dict:
+        ''' This method will return the size and the counters of the executor
+        '''
+        with self.__lock:
+            return { 'max_workers': self.__max_workers, 'max_pending': self.__max_pending, 'pending': self.__num_pending,
+                    'completed': self.__num_completed, 'rejected': self.__num_rejected }
+
+    def shutdown(self) -> None:
+        ''' This method will wait for the calls that are running and stop the threads, used when the app is shutting down
+        '''
+        self.__executor.shutdown(wait = True)
+
+DB_EXECUTOR = DatabaseExecutor()
@@ -0,0 +1,41 @@
+import asyncio
+import threading
+import unittest
+from constants import *
+from db_executor import DatabaseExecutor, DatabaseBusyError
+
+class DatabaseExecutorTest(unittest.TestCase):
+    """ This test environment will test that the executor runs calls off the event loop and turns calls away once it is full
+    """
+    def setUp(self) -> None:
+        self.__executor = DatabaseExecutor(max_workers = 1, max_pending = 2)
+
+    def tearDown(self) -> None:
+        self.__executor.shutdown()
+
+    def test_result_and_error(self):
+        ''' The result of the call is returned and its error is raised, on a thread that is not the one of the loop
+        '''
+        async def run_calls():
+            thread_name = await self.__executor.run(lambda: threading.current_thread().name)
+            with self.assertRaises(ZeroDivisionError):
+                await self.__executor.run(divmod, 1, 0)
+            return thread_name
+        self.assertTrue(asyncio.run(run_calls()).startswith('db-executor'))
+        self.assertEqual(self.__executor.stats()['completed'], 2)
+
+    def test_busy(self):
+        ''' Past max_pending calls that are running or waiting, the next call is turned away right away
+        '''
+        release = threading.Event()
+        async def run_calls():
+            blocked_calls = [asyncio.ensure_future(self.__executor.run(release.wait)) for _ in range(2)]
+            await asyncio.sleep(0)
+            self.assertEqual(self.__executor.num_pending, 2)
+            with self.assertRaises(DatabaseBusyError):
+                await self.__executor.run(release.wait)
+            release.set()
+            return await asyncio.gather(*blocked_calls)
+        self.assertEqual(asyncio.run(run_calls()), [True, True])
+        self.assertEqual(self.__executor.stats()['rejected'], 1)
+        self.assertEqual(self.__executor.num_pending, 0)
@@ -0,0 +1,93 @@
+import argparse
+import gc
+import tracemalloc
+from datetime import datetime, timedelta
+from constants import *
+from message_store import MessageStore
+from room import ChatMessage, MessageProperties
+
+''' This file holds a benchmark of the memory one message takes in a room, before and after the messages were made compact.
+    NOTE: the messages are built the way ChatRoom.restore() builds them: every string and every time is a new object, like the ones
+            that come out of a mongo document, and they are put in a MessageStore with bulk_load(). The memory that is still allocated
+            after the build (tracemalloc) is divided by the number of messages, so the text of the message and the store are counted too.
+    NOTE: "before" is a copy of the layout the messages had before (a __dict__ on both objects, datetimes, a list of revisions on every
+            message and a copy of every alias), "after" is ChatMessage and MessageProperties as they are now.
+    NOTE: run with `python memory_benchmark.py`, it does not need mongo.
+'''
+
+class DictMessageProperties():
+    """ The properties of a message as they were kept before: a __dict__, datetimes and the strings as they were given
+    """
+    def __init__(self, room_name: str, to_user: str, from_user: str, mess_type: int, sent_time: datetime, rec_time: datetime) -> None:
+        self.__mess_type = mess_type
+        self.__room_name = room_name
+        self.__to_user = to_user
+        self.__from_user = from_user
+        self.__sent_time = sent_time
+        self.__rec_time = rec_time
+
+class DictChatMessage():
+    """ A message as it was kept before: a __dict__ and a list of revisions even when the message was never edited
+    """
+    def __init__(self, message: str, mess_id = None, mess_props: DictMessageProperties = None, sequence_number: int = -1, removed: bool = False,
+                flagged: bool = False, revisions: list = None) -> None:
+        self.__message = message
+        self.__mess_props = mess_props
+        self.__mess_id = mess_id
+        self.__sequence_num = sequence_number
+        self.__removed = removed
+        self.__flagged = flagged
+        self.__revisions = revisions if revisions is not None else list()
+        self.__dirty = True
+
+    @property
+    def sequence_num(self):
+        return self.__sequence_num
+
+def decoded(text: str) -> str:
+    ''' This function will return a new copy of the string, like the one every mongo document decodes to
+    '''
+    return text.encode('utf-8').decode('utf-8')
+
+def build_room(message_class, properties_class, num_messages: int, num_aliases: int, text_length: int) -> MessageStore:
+    ''' This function will build a store of num_messages messages of the classes, sent between num_aliases users
+    '''
+    message_store = MessageStore()
+    sent_time = datetime.now()
+    def messages():
+        for sequence_num in range(num_messages):
+            message_properties = properties_class(room_name = decoded('memory_benchmark'),
+                                                to_user = decoded(f'user{sequence_num % num_aliases}'),
+                                                from_user = decoded(f'user{(sequence_num + 1) % num_aliases}'),
+                                                mess_type = PRIVATE_MESSAGE,
+                                                sent_time = sent_time + timedelta(microseconds = sequence_num),
+                                                rec_time = None)
+            yield message_class(message = f'{sequence_num:0{text_length}d}', mess_props = message_properties, sequence_number = sequence_num)
+    message_store.bulk_load(messages())
+    return message_store
+
+def bytes_per_message(message_class, properties_class, num_messages: int, num_aliases: int, text_length: int) -> float:
+    ''' This function will return the memory taken by a room of num_messages messages of the classes, divided by num_messages
+    '''
+    gc.collect()
+    tracemalloc.start()
+    start_bytes, _ = tracemalloc.get_traced_memory()
+    message_store = build_room(message_class, properties_class, num_messages, num_aliases, text_length)
+    gc.collect()
+    end_bytes, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert len(message_store) == num_messages
+    return (end_bytes - start_bytes) / num_messages
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Measure the memory one message takes in a room, before and after the compact messages.')
+    parser.add_argument('--messages', type = int, default = 200000, help = 'the number of messages in the room')
+    parser.add_argument('--aliases', type = int, default = 50, help = 'the number of users sending the messages')
+    parser.add_argument('--text-length', type = int, default = 40, help = 'the number of characters in every message')
+    arguments = parser.parse_args()
+    before_bytes = bytes_per_message(DictChatMessage, DictMessageProperties, arguments.messages, arguments.aliases, arguments.text_length)
+    after_bytes = bytes_per_message(ChatMessage, MessageProperties, arguments.messages, arguments.aliases, arguments.text_length)
+    print(f'{arguments.messages} messages, {arguments.aliases} aliases, {arguments.text_length} characters per message')
+    print(f'{"before":>8}: {before_bytes:7.1f} bytes per message, {before_bytes * 1000000 / 2 ** 20:7.1f} MB per million messages')
+    print(f'{"after":>8}: {after_bytes:7.1f} bytes per message, {after_bytes * 1000000 / 2 ** 20:7.1f} MB per million messages')
+    print(f'{"saved":>8}: {100 * (1 - after_bytes / before_bytes):7.1f} %')
@@ -0,0 +1,331 @@
+import logging
+from bisect import bisect_left, bisect_right
+from constants import *
+
+''' This file holds the ordered container that a ChatRoom keeps its messages in.
+    NOTE: messages are kept in chunks of at most 2 * chunk_size, sorted by their sequence number, and the chunks are kept in segments of
+            at most 2 * segment_size chunks. Every segment keeps the max sequence number of each of its chunks, and the store keeps the
+            max sequence number of each segment. Finding the message is a binary search over the segments, then over the chunks of the
+            segment, then in the chunk, so nothing ever has to shift more than one chunk worth of messages.
+    NOTE: readers on other threads take a snapshot() instead of reading the store while it is written. The writer never changes a chunk
+            (or a segment, or the lists of segments) that a snapshot can see: appending to the last chunk only adds past the end a snapshot
+            knows about, and an insert in the middle or a split builds a new chunk, a new segment and new lists of segments (copy on write)
+            instead of changing the old ones. Only the chunk and the segment that changed are copied, every other chunk and segment is shared.
+            After every write the store publishes its state as one tuple, so a snapshot is always a state the store was in between two writes.
+'''
+
+logging.basicConfig(filename='message_chat.log', level=logging.DEBUG, format = LOG_FORMAT)
+
+class MessageStore():
+    """ Container of messages ordered by their sequence_num.
+        NOTE: appending a message with a higher sequence number than everything in the store is O(1) (a split of the last chunk is paid
+                for by the chunk_size appends before it), finding by sequence number is O(log n)
+        NOTE: inserting out of order is O(log n) to find the place, plus copying the chunk, the segment and the list of segments that
+                hold it: O(chunk_size + segment_size + n / (chunk_size * segment_size)). With the default sizes the list of segments
+                stays shorter than a segment until a room has millions of messages, see store_benchmark.py
+        NOTE: sequence numbers are unique, a second message with the same sequence number is rejected
+    """
+    def __init__(self, chunk_size: int = MESSAGE_STORE_CHUNK_SIZE, segment_size: int = MESSAGE_STORE_SEGMENT_SIZE) -> None:
+        self.__chunk_size = chunk_size
+        self.__segment_size = segment_size
+        self.__key_segments = list()
+        self.__message_segments = list()
+        self.__max_segments = list()
+        self.__segment_maxes = list()
+        self.__length = 0
+        self.__publish()
+
+    def __len__(self):
+        return self.__length
+
+    def __bool__(self):
+        return self.__length > 0
+
+    def __iter__(self):
+        for message_segment in self.__message_segments:
+            for message_chunk in message_segment:
+                yield from message_chunk
+
+    def __reversed__(self):
+        for message_segment in reversed(self.__message_segments):
+            for message_chunk in reversed(message_segment):
+                yield from reversed(message_chunk)
+
+    def __contains__(self, sequence_num):
+        return self.find(sequence_num) is not None
+
+    def __getitem__(self, index: int):
+        ''' This method will return the message at a position in the store, negative positions count from the end
+            NOTE: this walks the chunks, prefer find() when the sequence number is known
+        '''
+        if index < 0:
+            index += self.__length
+        if index < 0 or index >= self.__length:
+            raise IndexError('message store index out of range')
+        for message_segment in self.__message_segments:
+            for message_chunk in message_segment:
+                if index < len(message_chunk):
+                    return message_chunk[index]
+                index -= len(message_chunk)
+
+    def insert(self, message) -> bool:
+        ''' This method will place the message in the store by its sequence number
+            NOTE: returns False if a message with the same sequence number is already in the store
+        '''
+        sequence_num = message.sequence_num
+        if not self.__segment_maxes:
+            self.__key_segments.append([[sequence_num]])
+            self.__message_segments.append([[message]])
+            self.__max_segments.append([sequence_num])
+            self.__segment_maxes.append(sequence_num)
+            self.__length = 1
+            self.__publish()
+            return True
+        if sequence_num > self.__segment_maxes[-1]:
+            segment_index = len(self.__segment_maxes) - 1
+            chunk_index = len(self.__max_segments[segment_index]) - 1
+            self.__key_segments[segment_index][chunk_index].append(sequence_num)
+            self.__message_segments[segment_index][chunk_index].append(message)
+            self.__max_segments[segment_index][chunk_index] = sequence_num
+            self.__segment_maxes[segment_index] = sequence_num
+        else:
+            segment_index = bisect_left(self.__segment_maxes, sequence_num)
+            chunk_maxes = self.__max_segments[segment_index]
+            chunk_index = bisect_left(chunk_maxes, sequence_num)
+            key_chunk = self.__key_segments[segment_index][chunk_index]
+            position = bisect_left(key_chunk, sequence_num)
+            if position < len(key_chunk) and key_chunk[position] == sequence_num:
+                logging.error(f'A message with sequence number {sequence_num} is already in the message store.')
+                return False
+            message_chunk = self.__message_segments[segment_index][chunk_index]
+            self.__replace_chunks(segment_index, chunk_index, [key_chunk[:position] + [sequence_num] + key_chunk[position:]],
+                                [message_chunk[:position] + [message] + message_chunk[position:]], [chunk_maxes[chunk_index]])
+        self.__length += 1
+        if len(self.__key_segments[segment_index][chunk_index]) > 2 * self.__chunk_size:
+            self.__split_chunk(segment_index, chunk_index)
+        self.__publish()
+        return True
+
+    def append(self, message) -> bool:
+        ''' This method is the same as insert(), it is kept so the store can be used like a list
+        '''
+        return self.insert(message)
+
+    def bulk_load(self, messages) -> int:
+        ''' This method will add messages that come sorted by sequence number, filling the chunks directly
+            NOTE: this is O(n) for the whole load with no bisect and no chunk splits, used to build the store on restore
+            NOTE: a message that is not after the current last message is put with insert() instead
+            NOTE: returns the number of messages that were added
+        '''
+        num_added = 0
+        for message in messages:
+            sequence_num = message.sequence_num
+            if self.__segment_maxes and sequence_num <= self.__segment_maxes[-1]:
+                if self.insert(message) is True:
+                    num_added += 1
+                continue
+            if not self.__key_segments or len(self.__key_segments[-1][-1]) >= self.__chunk_size:
+                if not self.__key_segments or len(self.__key_segments[-1]) >= self.__segment_size:
+                    self.__key_segments.append(list())
+                    self.__message_segments.append(list())
+                    self.__max_segments.append(list())
+                    self.__segment_maxes.append(sequence_num)
+                self.__key_segments[-1].append(list())
+                self.__message_segments[-1].append(list())
+                self.__max_segments[-1].append(sequence_num)
+            self.__key_segments[-1][-1].append(sequence_num)
+            self.__message_segments[-1][-1].append(message)
+            self.__max_segments[-1][-1] = sequence_num
+            self.__segment_maxes[-1] = sequence_num
+            self.__length += 1
+            num_added += 1
+        self.__publish()
+        return num_added
+
+    def find(self, sequence_num: int):
+        ''' This method will return the message with the sequence number or None if it is not in the store
+        '''
+        segment_index = bisect_left(self.__segment_maxes, sequence_num)
+        if segment_index == len(self.__segment_maxes):
+            return None
+        chunk_index = bisect_left(self.__max_segments[segment_index], sequence_num)
+        key_chunk = self.__key_segments[segment_index][chunk_index]
+        position = bisect_left(key_chunk, sequence_num)
+        if position < len(key_chunk) and key_chunk[position] == sequence_num:
+            return self.__message_segments[segment_index][chunk_index][position]
+        return None
+
+    def first(self):
+        ''' This method will return the message with the lowest sequence number or None if the store is empty
+        '''
+        return self.__message_segments[0][0][0] if self.__length > 0 else None
+
+    def last(self):
+        ''' This method will return the message with the highest sequence number or None if the store is empty
+        '''
+        return self.__message_segments[-1][-1][-1] if self.__length > 0 else None
+
+    def tail(self, count: int) -> list:
+        ''' This method will return the count messages with the highest sequence numbers, lowest first
+        '''
+        tail_messages = list()
+        if not self.__message_segments:
+            return tail_messages
+        for message_chunk in self.__chunks_before(len(self.__message_segments) - 1, None):
+            if len(tail_messages) >= count:
+                break
+            tail_messages.extend(reversed(message_chunk[-(count - len(tail_messages)):]))
+        tail_messages.reverse()
+        return tail_messages
+
+    def iter_after(self, sequence_num: int, stop_sequence_num: int = None):
+        ''' This method will go through the messages with a sequence number higher than sequence_num, lowest first
+            NOTE: if stop_sequence_num is given, it stops before the first message with that sequence number or higher
+            NOTE: finding the first message is O(log n), every message after that is O(1)
+        '''
+        segment_index = bisect_right(self.__segment_maxes, sequence_num)
+        if segment_index == len(self.__segment_maxes):
+            return
+        chunk_index = bisect_right(self.__max_segments[segment_index], sequence_num)
+        position = bisect_right(self.__key_segments[segment_index][chunk_index], sequence_num)
+        for key_chunk, message_chunk in self.__chunks_after(segment_index, chunk_index):
+            for current_position in range(position, len(key_chunk)):
+                if stop_sequence_num is not None and key_chunk[current_position] >= stop_sequence_num:
+                    return
+                yield message_chunk[current_position]
+            position = 0
+
+    def iter_before(self, sequence_num: int = None):
+        ''' This method will go through the messages with a sequence number lower than sequence_num, highest first
+            NOTE: if sequence_num is None, it starts at the newest message
+        '''
+        if not self.__segment_maxes:
+            return
+        if sequence_num is None or sequence_num > self.__segment_maxes[-1]:
+            segment_index = len(self.__segment_maxes) - 1
+            chunk_index = len(self.__max_segments[segment_index]) - 1
+            position = len(self.__key_segments[segment_index][chunk_index])
+        else:
+            segment_index = bisect_left(self.__segment_maxes, sequence_num)
+            chunk_index = bisect_left(self.__max_segments[segment_index], sequence_num)
+            position = bisect_left(self.__key_segments[segment_index][chunk_index], sequence_num)
+        for message_chunk in self.__chunks_before(segment_index, chunk_index):
+            if position is None:
+                position = len(message_chunk)
+            for current_position in range(position - 1, -1, -1):
+                yield message_chunk[current_position]
+            position = None
+
+    def clear(self) -> None:
+        ''' This method will remove every message from the store
+        '''
+        self.__key_segments = list()
+        self.__message_segments = list()
+        self.__max_segments = list()
+        self.__segment_maxes = list()
+        self.__length = 0
+        self.__publish()
+
+    def snapshot(self) -> 'MessageSnapshot':
+        ''' This method will return a read only copy of the store as it was after the last write, it is safe to call while another thread writes
+            NOTE: the messages, the chunks and the segments are not copied, only the list of segments, the last segment and the part of
+                    the last chunk the snapshot sees, so this is O(n / (chunk_size * segment_size) + segment_size + chunk_size) and not O(n)
+            NOTE: the messages in the snapshot are the same objects as the ones in the store
+        '''
+        key_segments, message_segments, max_segments, segment_maxes, num_segments, num_chunks, tail_length, length = self.__published
+        message_snapshot = MessageSnapshot(chunk_size = self.__chunk_size, segment_size = self.__segment_size)
+        if num_segments > 0:
+            # the last chunk can still be appended to and the last segment can still get new chunks, every other chunk and segment
+            # the snapshot sees is never changed again
+            last_key_segment = key_segments[num_segments - 1][:num_chunks]
+            last_key_segment[-1] = last_key_segment[-1][:tail_length]
+            last_message_segment = message_segments[num_segments - 1][:num_chunks]
+            last_message_segment[-1] = last_message_segment[-1][:tail_length]
+            last_max_segment = max_segments[num_segments - 1][:num_chunks]
+            last_max_segment[-1] = last_key_segment[-1][-1]
+            message_snapshot.__key_segments = key_segments[:num_segments - 1] + [last_key_segment]
+            message_snapshot.__message_segments = message_segments[:num_segments - 1] + [last_message_segment]
+            message_snapshot.__max_segments = max_segments[:num_segments - 1] + [last_max_segment]
+            message_snapshot.__segment_maxes = segment_maxes[:num_segments - 1] + [last_max_segment[-1]]
+            message_snapshot.__length = length
+            message_snapshot.__publish()
+        return message_snapshot
+
+    def __publish(self) -> None:
+        ''' This is a helper method to publish the state of the store for snapshot(), it is called at the end of every write
+            NOTE: this is one assignment of a tuple, so a snapshot never sees half of a write
+        '''
+        num_chunks = len(self.__key_segments[-1]) if self.__key_segments else 0
+        self.__published = (self.__key_segments, self.__message_segments, self.__max_segments, self.__segment_maxes, len(self.__key_segments),
+                            num_chunks, len(self.__key_segments[-1][-1]) if num_chunks > 0 else 0, self.__length)
+
+    def __chunks_after(self, segment_index: int, chunk_index: int):
+        ''' This is a helper method to go through the chunks from the chunk at chunk_index of the segment to the last one
+            NOTE: yields the key chunk and the message chunk together
+        '''
+        for current_segment_index in range(segment_index, len(self.__key_segments)):
+            key_segment = self.__key_segments[current_segment_index]
+            message_segment = self.__message_segments[current_segment_index]
+            for current_chunk_index in range(chunk_index, len(key_segment)):
+                yield key_segment[current_chunk_index], message_segment[current_chunk_index]
+            chunk_index = 0
+
+    def __chunks_before(self, segment_index: int, chunk_index: int):
+        ''' This is a helper method to go through the message chunks from the chunk at chunk_index of the segment back to the first one
+            NOTE: if chunk_index is None, it starts at the last chunk of the segment
+        '''
+        for current_segment_index in range(segment_index, -1, -1):
+            message_segment = self.__message_segments[current_segment_index]
+            if chunk_index is None:
+                chunk_index = len(message_segment) - 1
+            for current_chunk_index in range(chunk_index, -1, -1):
+                yield message_segment[current_chunk_index]
+            chunk_index = None
+
+    def __replace_chunks(self, segment_index: int, chunk_index: int, key_chunks: list, message_chunks: list, chunk_maxes: list) -> None:
+        ''' This is a helper method to put new chunks in place of the chunk at chunk_index of the segment
+            NOTE: the segment and the lists of segments are built again instead of changed, a snapshot can still be reading the old ones
+            NOTE: a segment that has grown past 2 * segment_size chunks is split in half
+        '''
+        key_segment = self.__key_segments[segment_index]
+        message_segment = self.__message_segments[segment_index]
+        max_segment = self.__max_segments[segment_index]
+        key_segment = key_segment[:chunk_index] + key_chunks + key_segment[chunk_index + 1:]
+        message_segment = message_segment[:chunk_index] + message_chunks + message_segment[chunk_index + 1:]
+        max_segment = max_segment[:chunk_index] + chunk_maxes + max_segment[chunk_index + 1:]
+        if len(key_segment) > 2 * self.__segment_size:
+            half = len(key_segment) // 2
+            key_segments = [key_segment[:half], key_segment[half:]]
+            message_segments = [message_segment[:half], message_segment[half:]]
+            max_segments = [max_segment[:half], max_segment[half:]]
+        else:
+            key_segments, message_segments, max_segments = [key_segment], [message_segment], [max_segment]
+        self.__key_segments = self.__key_segments[:segment_index] + key_segments + self.__key_segments[segment_index + 1:]
+        self.__message_segments = self.__message_segments[:segment_index] + message_segments + self.__message_segments[segment_index + 1:]
+        self.__max_segments = self.__max_segments[:segment_index] + max_segments + self.__max_segments[segment_index + 1:]
+        self.__segment_maxes = (self.__segment_maxes[:segment_index] + [max_segment[-1] for max_segment in max_segments]
+                                + self.__segment_maxes[segment_index + 1:])
+
+    def __split_chunk(self, segment_index: int, chunk_index: int) -> None:
+        ''' This is a helper method to split a chunk that has grown too big in half
+        '''
+        key_chunk = self.__key_segments[segment_index][chunk_index]
+        message_chunk = self.__message_segments[segment_index][chunk_index]
+        half = len(key_chunk) // 2
+        self.__replace_chunks(segment_index, chunk_index, [key_chunk[:half], key_chunk[half:]], [message_chunk[:half], message_chunk[half:]],
+                            [key_chunk[half - 1], key_chunk[-1]])
+
+class MessageSnapshot(MessageStore):
+    """ A read only copy of a MessageStore, returned by MessageStore.snapshot()
+        NOTE: every read method of the store works on a snapshot, a write is refused
+    """
+    def insert(self, message) -> bool:
+        logging.error(f'Message {message.sequence_num} cannot be put in a snapshot of the message store.')
+        return False
+
+    def bulk_load(self, messages) -> int:
+        logging.error('Messages cannot be loaded in a snapshot of the message store.')
+        return 0
+
+    def clear(self) -> None:
+        logging.error('A snapshot of the message store cannot be cleared.')
@@ -0,0 +1,118 @@
+import random
+import unittest
+from collections import namedtuple
+from constants import *
+from message_store import MessageStore
+
+StoredMessage = namedtuple('StoredMessage', ['sequence_num', 'message'])
+
+class MessageStoreTest(unittest.TestCase):
+    """ This test environment will test that the message store keeps messages ordered by sequence number
+        NOTE: a small chunk size and segment size are used so that the chunks and the segments get split during the tests
+    """
+    def setUp(self) -> None:
+        self.__message_store = MessageStore(chunk_size = 4, segment_size = 2)
+
+    def test_in_order(self):
+        ''' Messages put in order should come back in order and be found by sequence number
+        '''
+        for sequence_num in range(100):
+            self.assertTrue(self.__message_store.insert(StoredMessage(sequence_num, f'message {sequence_num}')))
+        self.assertEqual(len(self.__message_store), 100)
+        self.assertEqual([message.sequence_num for message in self.__message_store], list(range(100)))
+        self.assertEqual(self.__message_store.find(42).message, 'message 42')
+        self.assertEqual(self.__message_store.last().sequence_num, 99)
+        self.assertEqual(self.__message_store[-2].sequence_num, 98)
+
+    def test_out_of_order(self):
+        ''' Messages put in any order should still be ordered, and a duplicate sequence number is rejected
+        '''
+        sequence_nums = list(range(0, 200, 2))
+        random.shuffle(sequence_nums)
+        for sequence_num in sequence_nums:
+            self.__message_store.insert(StoredMessage(sequence_num, ''))
+        self.assertEqual([message.sequence_num for message in self.__message_store], sorted(sequence_nums))
+        self.assertFalse(self.__message_store.insert(StoredMessage(10, 'duplicate')))
+        self.assertIsNone(self.__message_store.find(11))
+        self.assertIsNone(self.__message_store.find(500))
+        self.assertEqual([message.sequence_num for message in reversed(self.__message_store)], sorted(sequence_nums, reverse = True))
+
+    def test_tail(self):
+        ''' Getting the newest messages should return them oldest first
+        '''
+        self.assertEqual(self.__message_store.tail(3), [])
+        for sequence_num in range(20):
+            self.__message_store.insert(StoredMessage(sequence_num, ''))
+        self.assertEqual([message.sequence_num for message in self.__message_store.tail(7)], list(range(13, 20)))
+        self.assertEqual(len(self.__message_store.tail(50)), 20)
+
+    def test_iterate_from_sequence_num(self):
+        ''' Iterating after or before a sequence number should only return the messages past it, in the right direction
+        '''
+        for sequence_num in range(0, 100, 3):
+            self.__message_store.insert(StoredMessage(sequence_num, ''))
+        self.assertEqual([message.sequence_num for message in self.__message_store.iter_after(10)][:3], [12, 15, 18])
+        self.assertEqual([message.sequence_num for message in self.__message_store.iter_after(10, 21)], [12, 15, 18])
+        self.assertEqual([message.sequence_num for message in self.__message_store.iter_after(99)], [])
+        self.assertEqual([message.sequence_num for message in self.__message_store.iter_after(-5)][0], 0)
+        self.assertEqual([message.sequence_num for message in self.__message_store.iter_before(10)], [9, 6, 3, 0])
+        self.assertEqual([message.sequence_num for message in self.__message_store.iter_before(9)], [6, 3, 0])
+        self.assertEqual([message.sequence_num for message in self.__message_store.iter_before(500)][:2], [99, 96])
+        self.assertEqual(len(list(self.__message_store.iter_before())), len(self.__message_store))
+
+    def test_bulk_load(self):
+        ''' Sorted messages are loaded in order, and a message out of order still ends up in its place
+        '''
+        self.assertEqual(self.__message_store.bulk_load(StoredMessage(sequence_num, '') for sequence_num in range(0, 50, 2)), 25)
+        self.assertEqual(self.__message_store.bulk_load([StoredMessage(7, ''), StoredMessage(60, ''), StoredMessage(60, 'duplicate')]), 2)
+        self.assertEqual([message.sequence_num for message in self.__message_store], sorted(list(range(0, 50, 2)) + [7, 60]))
+        self.assertEqual(self.__message_store.find(48).sequence_num, 48)
+        self.assertEqual([message.sequence_num for message in self.__message_store.iter_after(44)], [46, 48, 60])
+
+    def test_snapshot(self):
+        ''' A snapshot keeps the messages the store had when it was taken, whatever is appended, inserted or split after it
+        '''
+        for sequence_num in range(0, 40, 2):
+            self.__message_store.insert(StoredMessage(sequence_num, ''))
+        message_snapshot = self.__message_store.snapshot()
+        for sequence_num in list(range(40, 60)) + list(range(1, 40, 2)):
+            self.__message_store.insert(StoredMessage(sequence_num, ''))
+        self.assertEqual(len(self.__message_store), 60)
+        self.assertEqual(len(message_snapshot), 20)
+        self.assertEqual([message.sequence_num for message in message_snapshot], list(range(0, 40, 2)))
+        self.assertEqual(message_snapshot.last().sequence_num, 38)
+        self.assertIsNone(message_snapshot.find(41))
+        self.assertEqual([message.sequence_num for message in message_snapshot.iter_after(30)], [32, 34, 36, 38])
+        self.assertFalse(message_snapshot.insert(StoredMessage(100, '')))
+        self.assertEqual([message.sequence_num for message in self.__message_store.snapshot()], list(range(60)))
+
+    def test_against_sorted_list(self):
+        ''' Random inserts, loads and snapshots should always agree with a sorted list of the same sequence numbers
+        '''
+        random_generator = random.Random(7)
+        sequence_nums = list()
+        snapshots = list()
+        for round_num in range(40):
+            if round_num % 3 == 0:
+                load_start = (sequence_nums[-1] + 1) if sequence_nums else 0
+                load_nums = list(range(load_start, load_start + random_generator.randint(1, 30)))
+                self.__message_store.bulk_load(StoredMessage(sequence_num, '') for sequence_num in load_nums)
+                sequence_nums.extend(load_nums)
+            for _ in range(random_generator.randint(1, 30)):
+                sequence_num = random_generator.randint(-100, 2000)
+                self.assertEqual(self.__message_store.insert(StoredMessage(sequence_num, '')), sequence_num not in sequence_nums)
+                if sequence_num not in sequence_nums:
+                    sequence_nums.append(sequence_num)
+            sequence_nums.sort()
+            snapshots.append((self.__message_store.snapshot(), list(sequence_nums)))
+        for message_snapshot, snapshot_nums in snapshots:
+            self.assertEqual([message.sequence_num for message in message_snapshot], snapshot_nums)
+            self.assertEqual([message.sequence_num for message in reversed(message_snapshot)], snapshot_nums[::-1])
+            self.assertEqual(len(message_snapshot), len(snapshot_nums))
+            middle_num = snapshot_nums[len(snapshot_nums) // 2]
+            self.assertEqual([message.sequence_num for message in message_snapshot.iter_after(middle_num)], snapshot_nums[len(snapshot_nums) // 2 + 1:])
+            self.assertEqual([message.sequence_num for message in message_snapshot.iter_before(middle_num)], snapshot_nums[:len(snapshot_nums) // 2][::-1])
+            self.assertEqual([message.sequence_num for message in message_snapshot.tail(9)], snapshot_nums[-9:])
+            self.assertEqual(message_snapshot[len(snapshot_nums) // 3].sequence_num, snapshot_nums[len(snapshot_nums) // 3])
+            for sequence_num in snapshot_nums[::7]:
+                self.assertEqual(message_snapshot.find(sequence_num).sequence_num, sequence_num)
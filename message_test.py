@@ -0,0 +1,21 @@
+import unittest
+from datetime import datetime
+from constants import *
+from room import MessageProperties
+
+class MessageTest(unittest.TestCase):
+    """ This test environment will test the ChatMessage and MessageProperties classes on their own
+        NOTE: nothing here is written to the database, so no room or room list is needed
+    """
+    def test_compact_message(self):
+        """ The properties keep their times as epoch microseconds and share the alias strings, but give back what they were given
+        """
+        sent_time = datetime.now()
+        mess_props = MessageProperties(room_name = DEFAULT_TEST_ROOM, to_user = ''.join(['test', 'ing']), from_user = TEST_OWNER_ALIAS,
+                                    mess_type = PRIVATE_MESSAGE, sent_time = sent_time, rec_time = None)
+        self.assertEqual(mess_props.sent_time, sent_time)
+        self.assertIsNone(mess_props.rec_time)
+        self.assertIs(mess_props.to_user, MessageProperties(room_name = DEFAULT_TEST_ROOM, to_user = 'testing', from_user = TEST_OWNER_ALIAS,
+                                                            mess_type = PRIVATE_MESSAGE).to_user)
+        self.assertEqual(mess_props.to_dict()['sent_time'], sent_time.isoformat())
+
@@ -0,0 +1,38 @@
+import logging
+import threading
+from constants import *
+from statsd import StatsClient
+
+''' This file holds the metrics clients that the rest of the files share.
+    NOTE: STATS_CLIENT sends to statsd, FLUSH_METRICS also keeps the numbers in the process so the API can return them
+'''
+
+logging.basicConfig(filename='message_chat.log', level=logging.DEBUG, format = LOG_FORMAT)
+
+STATS_CLIENT = StatsClient(host = LOCAL_HOST, port=8125, prefix='messaging')
+
+class FlushMetrics():
+    """ Keeps track of how many entries every kind of flush (messages, users) wrote
+    """
+    def __init__(self) -> None:
+        self.__lock = threading.Lock()
+        self.__flushes = dict()
+
+    def record(self, flush_name: str, entries_written: int) -> None:
+        ''' This method will record one flush that wrote entries_written entries
+        '''
+        with self.__lock:
+            flush_stats = self.__flushes.setdefault(flush_name, { 'flushes': 0, 'entries_written': 0, 'last_flush_entries': 0 })
+            flush_stats['flushes'] += 1
+            flush_stats['entries_written'] += entries_written
+            flush_stats['last_flush_entries'] = entries_written
+        STATS_CLIENT.gauge(f'{flush_name}.last_flush_entries', entries_written)
+        STATS_CLIENT.incr(f'{flush_name}.entries_written', entries_written)
+
+    def stats(self) -> dict:
+        ''' This method will return a copy of the numbers for every kind of flush
+        '''
+        with self.__lock:
+            return { flush_name: dict(flush_stats) for flush_name, flush_stats in self.__flushes.items() }
+
+FLUSH_METRICS = FlushMetrics()
@@ -0,0 +1,155 @@
+import argparse
+import logging
+from datetime import datetime
+from constants import *
+from mongo_connection import CONNECTION_MANAGER
+from sequence import SequenceBlockAllocator, migrate_sequence_counters
+from pymongo import ASCENDING, DESCENDING, ReplaceOne
+from pymongo.errors import BulkWriteError
+
+''' This file holds the migration from one collection per room to the messages and room_metadata collections.
+    NOTE: before, every room kept its metadata document and its messages in a collection named after the room. Now the messages
+            of every room are in the messages collection, keyed by (room_id, sequence_num), and the metadata is in room_metadata.
+            The room id is the _id of the old metadata document, and every message keeps its _id.
+    NOTE: the messages are copied in batches sorted by _id and the last _id copied is saved in the migrations collection after
+            every batch, so a migration that stops part way picks up from the last batch. Copying is an upsert by _id, so copying a
+            batch twice changes nothing.
+    NOTE: the messages collection has a unique index on (room_id, sequence_num). A legacy message whose sequence number is not a
+            number of zero or more (old rooms have -1 and documents in it), or that has the same number as a message already copied,
+            gets a new number from the counter of the room, after every number the room already has.
+    NOTE: the old collections are only read, never changed or dropped. Running the migration again (while old servers are still
+            writing to the old collections) copies the messages that were added since the last run.
+    NOTE: run with `python migrate_messages.py [room_name ...]`, with no room names every room of the old layout is migrated.
+            The sequence counters are moved to one document per room at the end, see sequence.py.
+'''
+
+logging.basicConfig(filename='message_chat.log', level=logging.DEBUG, format = LOG_FORMAT)
+
+RESERVED_COLLECTION_NAMES = {MONGO_DB_CLASS_MESSAGES, MONGO_DB_CLASS_ROOM_METADATA, MONGO_DB_CLASS_MIGRATIONS}
+
+class MessageMigration():
+    """ Copies rooms of the old layout into the messages and room_metadata collections, one batch at a time.
+    """
+    def __init__(self, database = None, batch_size: int = MIGRATION_BATCH_SIZE) -> None:
+        self.__mongo_db = database if database is not None else CONNECTION_MANAGER.get_database(MONGO_DB)
+        self.__batch_size = batch_size
+        self.__message_collection = self.__mongo_db.get_collection(MONGO_DB_CLASS_MESSAGES)
+        self.__metadata_collection = self.__mongo_db.get_collection(MONGO_DB_CLASS_ROOM_METADATA)
+        self.__migration_collection = self.__mongo_db.get_collection(MONGO_DB_CLASS_MIGRATIONS)
+        self.__sequence_allocators = dict()
+
+    def legacy_room_names(self) -> list:
+        ''' This method will return the names of the collections that hold a room of the old layout
+            NOTE: a collection holds a room if it has the metadata document of a room with the name of the collection
+        '''
+        return [collection_name for collection_name in sorted(self.__mongo_db.list_collection_names())
+                if collection_name not in RESERVED_COLLECTION_NAMES
+                and self.__mongo_db.get_collection(collection_name).find_one({'room_name': collection_name}, projection = {'_id': True}) is not None]
+
+    def migrate(self, room_names: list = None) -> dict:
+        ''' This method will migrate the rooms, every room of the old layout if no room names are given
+            NOTE: returns the number of messages copied for every room
+        '''
+        if room_names is None:
+            room_names = self.legacy_room_names()
+        return {room_name: self.migrate_room(room_name) for room_name in room_names}
+
+    def migrate_room(self, room_name: str) -> int:
+        ''' This method will copy the metadata and the messages of one room that were not copied yet
+            NOTE: if the room already has metadata in room_metadata (it was created or changed after the switch), that metadata is kept
+            NOTE: returns the number of messages copied by this run, None if the room is not in the old layout
+            NOTE: messages with a sequence number that is not valid or is taken are numbered again, see renumber()
+        '''
+        legacy_collection = self.__mongo_db.get_collection(room_name)
+        if room_name in RESERVED_COLLECTION_NAMES or (legacy_metadata := legacy_collection.find_one({'room_name': room_name})) is None:
+            logging.warning(f'Room {room_name} was not found in the old layout, nothing to migrate.')
+            return None
+        if (room_metadata := self.__metadata_collection.find_one({'room_name': room_name}, projection = {'_id': True})) is None:
+            self.__metadata_collection.replace_one({'_id': legacy_metadata['_id']}, legacy_metadata, upsert = True)
+            room_id = legacy_metadata['_id']
+        else:
+            room_id = room_metadata['_id']
+        migration_progress = self.__migration_collection.find_one({'_id': room_name}) or dict()
+        last_id = migration_progress.get('last_id')
+        num_copied = 0
+        while True:
+            message_filter = {'message': {'$exists': True}}
+            if last_id is not None:
+                message_filter['_id'] = {'$gt': last_id}
+            message_batch = list(legacy_collection.find(message_filter, sort = [('_id', ASCENDING)], limit = self.__batch_size))
+            if not message_batch:
+                break
+            for current_message in message_batch:
+                current_message['room_id'] = room_id
+                if type(current_message.get('sequence_num')) is not int or current_message['sequence_num'] < 0:
+                    self.renumber(room_name, room_id, current_message)
+            self.__copy_messages(room_name, room_id, message_batch)
+            last_id = message_batch[-1]['_id']
+            num_copied += len(message_batch)
+            self.__save_progress(room_name, room_id, last_id, len(message_batch), done = False)
+            logging.info(f'Migrating {room_name}: {num_copied} messages copied.')
+        self.__save_progress(room_name, room_id, last_id, 0, done = True)
+        logging.info(f'Room {room_name} migrated, {num_copied} messages copied by this run.')
+        return num_copied
+
+    def renumber(self, room_name: str, room_id, message: dict) -> int:
+        ''' This method will give a legacy message a new sequence number from the counter of the room
+            NOTE: the counter is moved past every number the room has in both layouts first, so the new number is never taken
+            NOTE: returns the new sequence number
+        '''
+        if (sequence_allocator := self.__sequence_allocators.get(room_name)) is None:
+            sequence_allocator = SequenceBlockAllocator(counter_collection = self.__mongo_db.get_collection(MONGO_DB_CLASS_SEQUENCE_COUNTERS),
+                                                        counter_name = room_name,
+                                                        legacy_collection = self.__mongo_db.get_collection(MONGO_DB_CLASS_SEQUENCE))
+            # $gte only matches numbers, so the documents and the negative numbers are left out of the max
+            for numbered_message in (self.__mongo_db.get_collection(room_name).find_one({'sequence_num': {'$gte': 0}}, projection = {'sequence_num': True},
+                                                                                        sort = [('sequence_num', DESCENDING)]),
+                                    self.__message_collection.find_one({'room_id': room_id, 'sequence_num': {'$gte': 0}}, projection = {'sequence_num': True},
+                                                                        sort = [('sequence_num', DESCENDING)])):
+                if numbered_message is not None:
+                    sequence_allocator.skip_past(int(numbered_message['sequence_num']))
+            self.__sequence_allocators[room_name] = sequence_allocator
+        old_sequence_num = message.get('sequence_num')
+        message['sequence_num'] = sequence_allocator.next()
+        logging.warning(f'Message {message["_id"]} in {room_name} had the sequence number {old_sequence_num!r}, it is now {message["sequence_num"]}.')
+        return message['sequence_num']
+
+    def __copy_messages(self, room_name: str, room_id, message_batch: list) -> None:
+        ''' This is a helper method to upsert a batch of messages by _id
+            NOTE: the messages that fail because their sequence number is already taken are numbered again and upserted once more,
+                    any other error is raised
+        '''
+        try:
+            self.__message_collection.bulk_write([ReplaceOne({'_id': current_message['_id']}, current_message, upsert = True)
+                                                for current_message in message_batch], ordered = False)
+        except BulkWriteError as error:
+            write_errors = error.details.get('writeErrors', [])
+            if not write_errors or any(write_error.get('code') != DUPLICATE_KEY_ERROR_CODE for write_error in write_errors):
+                logging.error(f'Copying a batch of {room_name} failed: {error.details}')
+                raise
+            duplicate_messages = [message_batch[write_error['index']] for write_error in write_errors]
+            for current_message in duplicate_messages:
+                self.renumber(room_name, room_id, current_message)
+            self.__message_collection.bulk_write([ReplaceOne({'_id': current_message['_id']}, current_message, upsert = True)
+                                                for current_message in duplicate_messages], ordered = False)
+
+    def __save_progress(self, room_name: str, room_id, last_id, num_copied: int, done: bool) -> None:
+        ''' This is a helper method to save how far the migration of a room got, so it can pick up from there
+        '''
+        self.__migration_collection.update_one({'_id': room_name},
+                                                {'$set': {'room_id': room_id, 'last_id': last_id, 'done': done, 'modify_time': datetime.now()},
+                                                '$inc': {'num_copied': num_copied}},
+                                                upsert = True)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Copy rooms from one collection per room to the messages and room_metadata collections.')
+    parser.add_argument('room_names', nargs = '*', help = 'the rooms to migrate, every room of the old layout if none are given')
+    parser.add_argument('--batch-size', type = int, default = MIGRATION_BATCH_SIZE, help = 'the number of messages copied per batch')
+    arguments = parser.parse_args()
+    migrated_rooms = MessageMigration(batch_size = arguments.batch_size).migrate(room_names = arguments.room_names or None)
+    for room_name, num_copied in migrated_rooms.items():
+        print(f'{room_name}: {num_copied} messages copied')
+    mongo_db = CONNECTION_MANAGER.get_database(MONGO_DB)
+    num_counters = migrate_sequence_counters(legacy_collection = mongo_db.get_collection(MONGO_DB_CLASS_SEQUENCE),
+                                            counter_collection = mongo_db.get_collection(MONGO_DB_CLASS_SEQUENCE_COUNTERS))
+    print(f'{num_counters} sequence counters migrated')
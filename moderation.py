@@ -0,0 +1,207 @@
+import logging
+import threading
+from collections import deque
+from constants import *
+from mongo_connection import CONNECTION_MANAGER
+
+''' This file holds the keyword moderation of the chat rooms.
+    NOTE: the banned terms are compiled into one Aho-Corasick automaton, so checking a message is a single pass over its text
+            no matter how many terms there are. Matching is case-insensitive and on substrings, the same as "keyword in message".
+    NOTE: the automaton is never changed in place, adding or removing terms builds a new one and swaps it in,
+            so a message being checked on another thread always sees a whole automaton.
+'''
+
+logging.basicConfig(filename='message_chat.log', level=logging.DEBUG, format = LOG_FORMAT)
+
+class KeywordAutomaton():
+    """ Aho-Corasick automaton over a set of terms.
+        NOTE: state 0 is the root, every state has its goto transitions, its failure link and the terms that end in it
+                (including the terms that end in the states its failure links lead to)
+    """
+    def __init__(self, terms) -> None:
+        self.__terms = frozenset(term.casefold() for term in terms if term)
+        self.__goto = [dict()]
+        self.__fail = [0]
+        self.__outputs = [tuple()]
+        for term in self.__terms:
+            self.__add_term(term)
+        self.__link_failures()
+
+    def __len__(self):
+        return len(self.__terms)
+
+    # property to get the terms in the automaton, casefolded
+    @property
+    def terms(self):
+        return self.__terms
+
+    def find(self, text: str, first_only: bool = False) -> set:
+        ''' This method will return the terms that show up anywhere in the text
+            NOTE: with first_only the search stops at the first match, which is all a yes/no check needs
+        '''
+        found_terms = set()
+        if not self.__terms or not text:
+            return found_terms
+        goto = self.__goto
+        fail = self.__fail
+        outputs = self.__outputs
+        state = 0
+        for character in text.casefold():
+            while state and character not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(character, 0)
+            if outputs[state]:
+                found_terms.update(outputs[state])
+                if first_only is True:
+                    break
+        return found_terms
+
+    def matches(self, text: str) -> bool:
+        ''' This method will check if any term shows up in the text
+        '''
+        return len(self.find(text, first_only = True)) > 0
+
+    def __add_term(self, term: str) -> None:
+        ''' This is a helper method to add the states for a term to the trie
+        '''
+        state = 0
+        for character in term:
+            next_state = self.__goto[state].get(character)
+            if next_state is None:
+                next_state = len(self.__goto)
+                self.__goto.append(dict())
+                self.__fail.append(0)
+                self.__outputs.append(tuple())
+                self.__goto[state][character] = next_state
+            state = next_state
+        self.__outputs[state] = (term,)
+
+    def __link_failures(self) -> None:
+        ''' This is a helper method to set the failure links breadth first, the outputs of a state's failure link are added to its own
+        '''
+        pending_states = deque(self.__goto[0].values())
+        while pending_states:
+            state = pending_states.popleft()
+            for character, next_state in self.__goto[state].items():
+                pending_states.append(next_state)
+                fail_state = self.__fail[state]
+                while fail_state and character not in self.__goto[fail_state]:
+                    fail_state = self.__fail[fail_state]
+                self.__fail[next_state] = self.__goto[fail_state].get(character, 0)
+                self.__outputs[next_state] += self.__outputs[self.__fail[next_state]]
+
+class ModerationEngine():
+    """ Holds the banned terms and decides what happens to a message that has one of them.
+        NOTE: the action is MODERATION_ACTION_FLAG (the message is only flagged) or MODERATION_ACTION_REMOVE (flagged and soft deleted)
+        NOTE: the terms live in one document of the moderation collection, persist() has to be called after changing them
+    """
+    def __init__(self, terms: list = None, action: str = MODERATION_ACTION, collection = None) -> None:
+        self.__lock = threading.Lock()
+        self.__automaton = KeywordAutomaton(terms if terms is not None else list())
+        self.__action = action
+        self.__collection = collection
+        self.__dirty = False
+
+    # property to get the banned terms, casefolded
+    @property
+    def terms(self):
+        return sorted(self.__automaton.terms)
+
+    # property to get what is done to a message that has a banned term
+    @property
+    def action(self):
+        return self.__action
+
+    @action.setter
+    def action(self, new_action):
+        if new_action in (MODERATION_ACTION_FLAG, MODERATION_ACTION_REMOVE):
+            self.__action = new_action
+            self.__dirty = True
+
+    # property to check if the terms changed since the last persist
+    @property
+    def dirty(self):
+        return self.__dirty
+
+    def add_terms(self, terms: list) -> int:
+        ''' This method will add terms to the banned terms and rebuild the automaton
+            NOTE: returns the number of terms that were not already banned
+        '''
+        with self.__lock:
+            current_terms = self.__automaton.terms
+            new_terms = {term.casefold() for term in terms if term} - current_terms
+            if new_terms:
+                self.__automaton = KeywordAutomaton(current_terms | new_terms)
+                self.__dirty = True
+                logging.info(f'{len(new_terms)} banned terms were added, there are {len(self.__automaton)} now.')
+            return len(new_terms)
+
+    def remove_terms(self, terms: list) -> int:
+        ''' This method will take terms out of the banned terms and rebuild the automaton
+            NOTE: returns the number of terms that were removed
+        '''
+        with self.__lock:
+            current_terms = self.__automaton.terms
+            removed_terms = {term.casefold() for term in terms if term} & current_terms
+            if removed_terms:
+                self.__automaton = KeywordAutomaton(current_terms - removed_terms)
+                self.__dirty = True
+                logging.info(f'{len(removed_terms)} banned terms were removed, there are {len(self.__automaton)} now.')
+            return len(removed_terms)
+
+    def check(self, text: str) -> set:
+        ''' This method will return the banned terms that are in the text
+        '''
+        return self.__automaton.find(text)
+
+    def moderate(self, message, edited: bool = False) -> bool:
+        ''' This method will flag the message, and soft delete it if that is the action, when it has a banned term
+            NOTE: returns True if the message was changed, a message that was already flagged is not changed again
+            NOTE: an edited message has its flag worked out again from the new text, so an edit without a banned term clears it
+        '''
+        if message.flagged is True and edited is False:
+            return False
+        if self.__automaton.matches(message.message) is False:
+            if message.flagged is False:
+                return False
+            message.flagged = False
+            return True
+        if message.flagged is True:
+            return False
+        message.flagged = True
+        if self.__action == MODERATION_ACTION_REMOVE:
+            message.removed = True
+        return True
+
+    def restore(self) -> bool:
+        ''' This method will load the banned terms and the action from mongo
+        '''
+        moderation_settings = self.__get_collection().find_one({'_id': MODERATION_SETTINGS_ID})
+        if moderation_settings is None:
+            logging.debug('No moderation settings were found in mongo.')
+            return False
+        with self.__lock:
+            self.__automaton = KeywordAutomaton(moderation_settings['terms'])
+            self.__action = moderation_settings.get('action', MODERATION_ACTION)
+            self.__dirty = False
+        logging.info(f'{len(self.__automaton)} banned terms were restored.')
+        return True
+
+    def persist(self) -> None:
+        ''' This method will save the banned terms and the action to mongo, only if they changed
+        '''
+        if self.__dirty is False:
+            return
+        self.__get_collection().replace_one({'_id': MODERATION_SETTINGS_ID},
+                                            {'terms': self.terms, 'action': self.__action},
+                                            upsert = True)
+        self.__dirty = False
+
+    def __get_collection(self):
+        ''' This is a helper method to get the moderation collection, it is only looked up the first time it is needed
+        '''
+        if self.__collection is None:
+            self.__collection = CONNECTION_MANAGER.get_collection(MONGO_DB_CLASS_MODERATION)
+        return self.__collection
+
+MODERATION_ENGINE = ModerationEngine()
@@ -0,0 +1,77 @@
+import unittest
+from constants import *
+from moderation import KeywordAutomaton, ModerationEngine
+
+class ModeratedMessage():
+    """ Just the parts of a ChatMessage that the moderation looks at
+    """
+    def __init__(self, message: str) -> None:
+        self.message = message
+        self.removed = False
+        self.flagged = False
+
+class KeywordAutomatonTest(unittest.TestCase):
+    """ This test environment will test that the automaton finds the same terms as checking every term with "in"
+    """
+    def test_overlapping_terms(self):
+        ''' Terms that overlap or sit inside of each other should all be found
+        '''
+        automaton = KeywordAutomaton(['he', 'she', 'his', 'hers'])
+        self.assertEqual(automaton.find('ushers'), {'he', 'she', 'hers'})
+        self.assertEqual(automaton.find('this'), {'his'})
+        self.assertEqual(automaton.find('nothing here'), {'he'})
+        self.assertTrue(automaton.matches('HeRs'))
+        self.assertFalse(automaton.matches('abc'))
+
+    def test_same_as_in(self):
+        ''' The automaton should agree with "term in text" for every text
+        '''
+        terms = ['spam', 'scam', 'amazing deal', 'free', 'ee', 'a']
+        automaton = KeywordAutomaton(terms)
+        for text in ['this is spam', 'a free scam', 'amazing dealer', 'nothing', 'feee', '']:
+            self.assertEqual(automaton.find(text), {term for term in terms if term in text})
+
+class ModerationEngineTest(unittest.TestCase):
+    """ This test environment will test flagging and removing messages with the moderation engine
+        NOTE: nothing is persisted, so no collection is needed
+    """
+    def test_flag(self):
+        ''' A message with a banned term is flagged once, and a message without one is left alone
+        '''
+        moderation_engine = ModerationEngine(terms = ['Spam'])
+        flagged_message = ModeratedMessage('buy SPAM now')
+        self.assertTrue(moderation_engine.moderate(flagged_message))
+        self.assertTrue(flagged_message.flagged)
+        self.assertFalse(flagged_message.removed)
+        self.assertFalse(moderation_engine.moderate(flagged_message))
+        self.assertFalse(moderation_engine.moderate(ModeratedMessage('hello')))
+
+    def test_remove_and_change_terms(self):
+        ''' With the remove action the message is soft deleted, and terms can be added and removed
+        '''
+        moderation_engine = ModerationEngine(action = MODERATION_ACTION_REMOVE)
+        self.assertFalse(moderation_engine.moderate(ModeratedMessage('scam')))
+        self.assertEqual(moderation_engine.add_terms(['scam', 'spam', 'scam']), 2)
+        self.assertTrue(moderation_engine.dirty)
+        removed_message = ModeratedMessage('a scam')
+        self.assertTrue(moderation_engine.moderate(removed_message))
+        self.assertTrue(removed_message.removed)
+        self.assertEqual(moderation_engine.remove_terms(['scam', 'unknown']), 1)
+        self.assertEqual(moderation_engine.terms, ['spam'])
+        self.assertEqual(moderation_engine.check('scam and spam'), {'spam'})
+
+    def test_edit_recomputes_flag(self):
+        ''' An edited message is flagged from its new text, so an edit without a banned term clears the flag
+        '''
+        moderation_engine = ModerationEngine(terms = ['spam'])
+        edited_message = ModeratedMessage('buy spam')
+        self.assertTrue(moderation_engine.moderate(edited_message))
+        edited_message.message = 'buy eggs'
+        self.assertFalse(moderation_engine.moderate(edited_message))
+        self.assertTrue(edited_message.flagged)
+        self.assertTrue(moderation_engine.moderate(edited_message, edited = True))
+        self.assertFalse(edited_message.flagged)
+        self.assertFalse(moderation_engine.moderate(edited_message, edited = True))
+        edited_message.message = 'more spam'
+        self.assertTrue(moderation_engine.moderate(edited_message, edited = True))
+        self.assertTrue(edited_message.flagged)
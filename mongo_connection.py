@@ -0,0 +1,174 @@
+import logging
+import threading
+from constants import *
+from pymongo import MongoClient, monitoring
+
+''' This file holds the single MongoClient that the whole process shares.
+    NOTE: pymongo already pools sockets inside of a MongoClient, so one client per process is all we need.
+            Building one per ChatRoom/UserList meant one pool (and one SCRAM handshake) per object.
+'''
+
+logging.basicConfig(filename='message_chat.log', level=logging.DEBUG, format = LOG_FORMAT)
+
+class ConnectionPoolCounter(monitoring.ConnectionPoolListener):
+    """ Listener that the driver calls whenever a connection pool or socket is opened or closed.
+        NOTE: the counts are what we use to show how many pools/sockets are actually alive.
+    """
+    def __init__(self) -> None:
+        self.__lock = threading.Lock()
+        self.__live_pools = 0
+        self.__live_sockets = 0
+        self.__sockets_created = 0
+
+    @property
+    def live_pools(self):
+        return self.__live_pools
+
+    @property
+    def live_sockets(self):
+        return self.__live_sockets
+
+    @property
+    def sockets_created(self):
+        return self.__sockets_created
+
+    def pool_created(self, event):
+        with self.__lock:
+            self.__live_pools += 1
+        logging.debug(f'Connection pool created for {event.address}.')
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        with self.__lock:
+            self.__live_pools -= 1
+        logging.debug(f'Connection pool closed for {event.address}.')
+
+    def connection_created(self, event):
+        with self.__lock:
+            self.__live_sockets += 1
+            self.__sockets_created += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self.__lock:
+            self.__live_sockets -= 1
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        pass
+
+    def connection_checked_out(self, event):
+        pass
+
+    def connection_checked_in(self, event):
+        pass
+
+class MongoConnectionManager():
+    """ Process-wide manager for the MongoClient. The client is only built the first time someone asks for it (lazy connect)
+            and every caller after that gets the same client, and therefore the same connection pool.
+        NOTE: settings can only be changed with configure() before the client is built.
+    """
+    def __init__(self, host: str = MONGO_DB_HOST, port: int = MONGO_DB_PORT, max_pool_size: int = MONGO_DB_MAX_POOL_SIZE,
+                min_pool_size: int = MONGO_DB_MIN_POOL_SIZE, connect_timeout_ms: int = MONGO_DB_CONNECT_TIMEOUT_MS,
+                server_selection_timeout_ms: int = MONGO_DB_SERVER_SELECTION_TIMEOUT_MS, socket_timeout_ms: int = MONGO_DB_SOCKET_TIMEOUT_MS) -> None:
+        self.__lock = threading.Lock()
+        self.__client = None
+        self.__clients_created = 0
+        self.__pool_counter = ConnectionPoolCounter()
+        self.__settings = { 'host': host,
+                            'port': port,
+                            'max_pool_size': max_pool_size,
+                            'min_pool_size': min_pool_size,
+                            'connect_timeout_ms': connect_timeout_ms,
+                            'server_selection_timeout_ms': server_selection_timeout_ms,
+                            'socket_timeout_ms': socket_timeout_ms }
+
+    # property to get the current connection settings
+    @property
+    def settings(self):
+        return dict(self.__settings)
+
+    # property to check if the client has been built yet
+    @property
+    def connected(self):
+        return self.__client is not None
+
+    def configure(self, **new_settings) -> bool:
+        ''' This method will change the connection settings (pool size, timeouts, host, port)
+            NOTE: once the client is built the settings are locked, close() the manager first to change them
+        '''
+        with self.__lock:
+            if self.__client is not None:
+                logging.warning('Mongo client is already connected, the connection settings were not changed.')
+                return False
+            for setting_name, setting_value in new_settings.items():
+                if setting_name not in self.__settings:
+                    logging.warning(f'{setting_name} is not a valid connection setting.')
+                    return False
+                self.__settings[setting_name] = setting_value
+            return True
+
+    def get_client(self) -> MongoClient:
+        ''' This method will return the shared MongoClient, building it on the first call
+            NOTE: connect = False makes the driver wait until the first operation to open any sockets
+        '''
+        if self.__client is not None:
+            return self.__client
+        with self.__lock:
+            if self.__client is None:
+                logging.info(f'Creating the shared mongo client for {self.__settings["host"]}:{self.__settings["port"]}.')
+                self.__client = MongoClient(host = self.__settings['host'],
+                                            port = self.__settings['port'],
+                                            username = MONGO_DB_USER,
+                                            password = MONGO_DB_PASS,
+                                            authSource = MONGO_DB_AUTH_SOURCE,
+                                            authMechanism = MONGO_DB_AUTH_MECHANISM,
+                                            maxPoolSize = self.__settings['max_pool_size'],
+                                            minPoolSize = self.__settings['min_pool_size'],
+                                            connectTimeoutMS = self.__settings['connect_timeout_ms'],
+                                            serverSelectionTimeoutMS = self.__settings['server_selection_timeout_ms'],
+                                            socketTimeoutMS = self.__settings['socket_timeout_ms'],
+                                            event_listeners = [self.__pool_counter],
+                                            connect = False)
+                self.__clients_created += 1
+        return self.__client
+
+    def get_database(self, database_name: str = MONGO_DB):
+        ''' This method will return a database from the shared client
+        '''
+        return self.get_client().get_database(database_name)
+
+    def get_collection(self, collection_name: str, database_name: str = MONGO_DB):
+        ''' This method will return a collection from the shared client
+        '''
+        return self.get_database(database_name).get_collection(collection_name)
+
+    def stats(self) -> dict:
+        ''' This method will return the counts of clients, pools and sockets that this process has opened
+            NOTE: clients_created should never be more than 1 unless the manager was closed and reopened
+        '''
+        return { 'clients_created': self.__clients_created,
+                'live_clients': 1 if self.__client is not None else 0,
+                'live_pools': self.__pool_counter.live_pools,
+                'live_sockets': self.__pool_counter.live_sockets,
+                'sockets_created': self.__pool_counter.sockets_created }
+
+    def close(self) -> None:
+        ''' This method will close the shared client and all of its sockets
+        '''
+        with self.__lock:
+            if self.__client is not None:
+                self.__client.close()
+                self.__client = None
+                logging.info('The shared mongo client was closed.')
+
+CONNECTION_MANAGER = MongoConnectionManager()
@@ -0,0 +1,36 @@
+import unittest
+from constants import *
+from mongo_connection import MongoConnectionManager
+
+class MongoConnectionTest(unittest.TestCase):
+    """ This test environment will make sure that the connection manager only ever builds one client
+        NOTE: the client is lazy, so none of these tests need to reach the database
+    """
+    def setUp(self) -> None:
+        ''' This setup method will make a fresh manager so the counters start at zero
+        '''
+        self.__manager = MongoConnectionManager(max_pool_size = 10)
+
+    def tearDown(self) -> None:
+        self.__manager.close()
+
+    def test_shared_client(self):
+        ''' Asking for the client, a database and a collection several times should only build one client
+        '''
+        self.assertFalse(self.__manager.connected)
+        first_client = self.__manager.get_client()
+        self.__manager.get_database(MONGO_DB)
+        self.__manager.get_collection(MONGO_DB_CLASS_USERS)
+        self.assertIs(first_client, self.__manager.get_client())
+        self.assertEqual(self.__manager.stats()['clients_created'], 1)
+        self.assertEqual(self.__manager.stats()['live_clients'], 1)
+
+    def test_configure(self):
+        ''' Settings can be changed before the client is built, but not after
+        '''
+        self.assertTrue(self.__manager.configure(max_pool_size = 20))
+        self.assertEqual(self.__manager.settings['max_pool_size'], 20)
+        self.assertFalse(self.__manager.configure(not_a_setting = 1))
+        self.__manager.get_client()
+        self.assertFalse(self.__manager.configure(max_pool_size = 30))
+        self.assertEqual(self.__manager.settings['max_pool_size'], 20)
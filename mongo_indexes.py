@@ -0,0 +1,169 @@
+import logging
+import threading
+from constants import *
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import PyMongoError
+
+''' This file holds the indexes that the queries of the messages, the rooms, the room list and the user list need.
+    NOTE: every kind of collection declares its indexes and the shape of the queries that are run on it. ensure() creates the indexes
+            that are missing and rebuilds the ones whose keys or options changed, indexes that are not declared are left alone.
+    NOTE: the metadata documents of the user list and the room list share their collection with other documents, so their
+            indexes are partial (only the documents that have the field are in the index).
+    NOTE: report() runs explain() on every declared query shape and $indexStats on the collection, to find the queries that
+            do not use an index (missing) and the indexes that no query has used since the server started (unused).
+'''
+
+logging.basicConfig(filename='message_chat.log', level=logging.DEBUG, format = LOG_FORMAT)
+
+MESSAGE_INDEXES = [
+    IndexModel([('room_id', ASCENDING), ('sequence_num', ASCENDING)], name = 'message_room_sequence_num', unique = True),
+    IndexModel([('room_id', ASCENDING), ('mess_props.from_user', ASCENDING), ('sequence_num', ASCENDING)], name = 'message_room_from_user_sequence_num'),
+]
+
+MESSAGE_QUERY_SHAPES = {
+    'restore messages': ({'room_id': None}, [('sequence_num', ASCENDING)]),
+    'messages by sender': ({'room_id': None, 'mess_props.from_user': '', 'removed': {'$ne': True}}, None),
+}
+
+ROOM_METADATA_INDEXES = [
+    IndexModel([('room_name', ASCENDING)], name = 'room_metadata_name', unique = True),
+]
+
+ROOM_METADATA_QUERY_SHAPES = {
+    'room metadata': ({'room_name': ''}, None),
+}
+
+USER_INDEXES = [
+    IndexModel([('alias', ASCENDING)], name = 'user_alias', unique = True,
+                partialFilterExpression = {'alias': {'$exists': True}}),
+    IndexModel([('list_name', ASCENDING)], name = 'user_list_metadata', unique = True,
+                partialFilterExpression = {'list_name': {'$exists': True}}),
+]
+
+USER_QUERY_SHAPES = {
+    'user list metadata': ({'list_name': ''}, None),
+    'restore users': ({'alias': {'$exists': True}}, None),
+}
+
+ROOM_LIST_INDEXES = [
+    IndexModel([('list_name', ASCENDING)], name = 'room_list_metadata', unique = True,
+                partialFilterExpression = {'list_name': {'$exists': True}}),
+]
+
+ROOM_LIST_QUERY_SHAPES = {
+    'room list metadata': ({'list_name': ''}, None),
+}
+
+class IndexManager():
+    """ Creates the declared indexes of every collection the first time the collection is used, and reports on them.
+        NOTE: a collection is only reconciled once per process, after that ensure() is a set lookup
+        NOTE: an index that can not be built (for example a unique index over duplicate aliases) is logged and skipped,
+                the app still runs without it
+    """
+    def __init__(self) -> None:
+        self.__lock = threading.Lock()
+        self.__ensured_collections = set()
+
+    def ensure(self, collection, index_models: list) -> list:
+        ''' This method will create the declared indexes that are missing from the collection and rebuild the ones that changed
+            NOTE: returns the names of the indexes that were created
+        '''
+        with self.__lock:
+            if collection.full_name in self.__ensured_collections:
+                return []
+            self.__ensured_collections.add(collection.full_name)
+        created_indexes = list()
+        try:
+            existing_indexes = collection.index_information()
+        except PyMongoError as error:
+            logging.error(f'Could not read the indexes of {collection.full_name}: {error}')
+            return created_indexes
+        for index_model in index_models:
+            index_document = index_model.document
+            index_name = index_document['name']
+            existing_index = existing_indexes.get(index_name)
+            if existing_index is not None and self.__same_index(existing_index, index_document):
+                continue
+            try:
+                if existing_index is not None:
+                    logging.info(f'Index {index_name} of {collection.full_name} changed, rebuilding it.')
+                    collection.drop_index(index_name)
+                collection.create_indexes([index_model])
+                created_indexes.append(index_name)
+                logging.info(f'Index {index_name} was created on {collection.full_name}.')
+            except PyMongoError as error:
+                logging.error(f'Could not create index {index_name} on {collection.full_name}: {error}')
+        return created_indexes
+
+    def ensure_message_indexes(self, collection) -> list:
+        ''' This method will ensure the indexes of the messages collection, that holds the messages of every room
+        '''
+        return self.ensure(collection, MESSAGE_INDEXES)
+
+    def ensure_room_metadata_indexes(self, collection) -> list:
+        ''' This method will ensure the indexes of the room metadata collection
+        '''
+        return self.ensure(collection, ROOM_METADATA_INDEXES)
+
+    def ensure_user_indexes(self, collection) -> list:
+        ''' This method will ensure the indexes of the collection of the user list
+        '''
+        return self.ensure(collection, USER_INDEXES)
+
+    def ensure_room_list_indexes(self, collection) -> list:
+        ''' This method will ensure the indexes of the collection of the room list
+        '''
+        return self.ensure(collection, ROOM_LIST_INDEXES)
+
+    def report(self, collection, index_models: list, query_shapes: dict) -> dict:
+        ''' This method will explain every query shape and read the usage of every index of the collection
+            NOTE: returns { 'queries': {name: {'index': ..., 'stage': ...}}, 'missing': [...], 'unused': [...], 'undeclared': [...] }
+                    missing are the query shapes that scan the collection, unused are the indexes with no use since the server started
+        '''
+        index_report = { 'collection': collection.full_name, 'queries': dict(), 'missing': list(), 'unused': list(), 'undeclared': list() }
+        for query_name, (query_filter, query_sort) in query_shapes.items():
+            try:
+                query_cursor = collection.find(query_filter)
+                if query_sort is not None:
+                    query_cursor = query_cursor.sort(query_sort)
+                winning_plan = query_cursor.explain()['queryPlanner']['winningPlan']
+            except (PyMongoError, NotImplementedError, KeyError) as error:
+                logging.warning(f'Could not explain "{query_name}" on {collection.full_name}: {error}')
+                index_report['queries'][query_name] = { 'index': None, 'stage': 'UNKNOWN' }
+                continue
+            index_name, stages = self.__plan_index(winning_plan)
+            index_report['queries'][query_name] = { 'index': index_name, 'stage': ' <- '.join(stages) }
+            if 'COLLSCAN' in stages:
+                index_report['missing'].append(query_name)
+        declared_names = {index_model.document['name'] for index_model in index_models}
+        try:
+            for index_stats in collection.aggregate([{'$indexStats': {}}]):
+                if index_stats['name'] == '_id_':
+                    continue
+                if index_stats['name'] not in declared_names:
+                    index_report['undeclared'].append(index_stats['name'])
+                if index_stats['accesses']['ops'] == 0:
+                    index_report['unused'].append(index_stats['name'])
+        except (PyMongoError, NotImplementedError, KeyError) as error:
+            logging.warning(f'Could not read the index usage of {collection.full_name}: {error}')
+        return index_report
+
+    def __same_index(self, existing_index: dict, index_document: dict) -> bool:
+        ''' This is a helper method to compare an index from index_information() with a declared index
+        '''
+        return (list(existing_index['key']) == list(index_document['key'].items())
+                and existing_index.get('unique', False) == index_document.get('unique', False)
+                and existing_index.get('partialFilterExpression') == index_document.get('partialFilterExpression'))
+
+    def __plan_index(self, plan_stage: dict) -> tuple:
+        ''' This is a helper method to walk down a winning plan, returning the index it uses and its stages from the top
+        '''
+        index_name = None
+        stages = list()
+        while plan_stage is not None:
+            stages.append(plan_stage.get('stage', 'UNKNOWN'))
+            index_name = plan_stage.get('indexName', index_name)
+            plan_stage = plan_stage.get('inputStage')
+        return index_name, stages
+
+INDEX_MANAGER = IndexManager()
@@ -0,0 +1,45 @@
+import unittest
+from constants import *
+from mongo_indexes import IndexManager, MESSAGE_INDEXES
+
+class IndexedCollection():
+    """ Just the parts of a collection that ensure() uses, keeping the indexes in a dictionary
+    """
+    def __init__(self, full_name: str, indexes: dict = None) -> None:
+        self.full_name = full_name
+        self.indexes = indexes if indexes is not None else dict()
+        self.num_created = 0
+
+    def index_information(self) -> dict:
+        return { index_name: dict(index_information) for index_name, index_information in self.indexes.items() }
+
+    def drop_index(self, index_name: str) -> None:
+        del self.indexes[index_name]
+
+    def create_indexes(self, index_models: list) -> None:
+        for index_model in index_models:
+            index_document = dict(index_model.document)
+            index_document['key'] = list(index_document['key'].items())
+            self.indexes[index_document.pop('name')] = index_document
+            self.num_created += 1
+
+class IndexManagerTest(unittest.TestCase):
+    """ This test environment will test that the declared indexes are created once and rebuilt when they change
+    """
+    def test_create_once(self):
+        ''' Every declared index is created the first time, and a collection is only reconciled once
+        '''
+        index_manager = IndexManager()
+        message_collection = IndexedCollection('db.messages')
+        self.assertEqual(index_manager.ensure_message_indexes(message_collection), [index_model.document['name'] for index_model in MESSAGE_INDEXES])
+        self.assertEqual(index_manager.ensure_message_indexes(message_collection), [])
+        self.assertEqual(IndexManager().ensure_message_indexes(message_collection), [])
+        self.assertEqual(message_collection.num_created, len(MESSAGE_INDEXES))
+
+    def test_rebuild_changed(self):
+        ''' An index with the declared name but other keys is rebuilt, an index that is not declared is left alone
+        '''
+        message_collection = IndexedCollection('db.messages', { 'message_room_sequence_num': { 'key': [('sequence_num', 1)] }, 'by_message': { 'key': [('message', 1)] } })
+        IndexManager().ensure_message_indexes(message_collection)
+        self.assertEqual(message_collection.indexes['message_room_sequence_num']['key'], [('room_id', 1), ('sequence_num', 1)])
+        self.assertIn('by_message', message_collection.indexes)
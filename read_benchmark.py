@@ -0,0 +1,130 @@
+import argparse
+import logging
+import sys
+import threading
+import time
+from datetime import datetime
+from constants import *
+from mongo_connection import CONNECTION_MANAGER
+from room import ChatRoom, MessageProperties
+from users import UserList
+from write_behind import WRITE_BEHIND_SCHEDULER
+
+''' This file holds a benchmark of get_messages() while a writer saturates the same room.
+    NOTE: readers read a snapshot of the room without taking its lock, so the read latency should stay about the same whether the room
+            is being written to or not. The benchmark reads with no writer first, then again while a writer sends batches to the room
+            as fast as it can (and removes and restores the messages of a sender every so often), and prints the latencies of both.
+    NOTE: run with `python read_benchmark.py`, it needs the same mongo as the API. The room it uses is made for the run (with a name that
+            starts with read_benchmark_) and its messages, metadata and sequence counter are deleted at the end.
+    NOTE: the readers and the writer are threads of one process, so a read can also wait for the GIL while the writer runs python code.
+            Lower --switch-interval to see how much of the saturated p99 is that wait rather than the read itself.
+'''
+
+logging.basicConfig(filename='message_chat.log', level=logging.DEBUG, format = LOG_FORMAT)
+
+BENCHMARK_ALIASES = ['bench_reader', 'bench_writer', 'bench_other']
+
+def benchmark_properties(room_name: str, from_alias: str, to_alias: str) -> MessageProperties:
+    ''' This function will return the properties of one benchmark message
+    '''
+    return MessageProperties(room_name = room_name, to_user = to_alias, from_user = from_alias, mess_type = PRIVATE_MESSAGE,
+                            sent_time = datetime.now(), rec_time = None)
+
+def send_batch(chat_room: ChatRoom, batch_size: int, batch_num: int) -> None:
+    ''' This function will send batch_size messages to the room with one call, the way the room actor does
+    '''
+    sends = list()
+    for message_num in range(batch_size):
+        from_alias = BENCHMARK_ALIASES[message_num % len(BENCHMARK_ALIASES)]
+        to_alias = BENCHMARK_ALIASES[(message_num + 1) % len(BENCHMARK_ALIASES)]
+        sends.append((f'benchmark message {batch_num}.{message_num}', from_alias, benchmark_properties(chat_room.room_name, from_alias, to_alias)))
+    chat_room.send_messages(sends = sends)
+
+def measure_reads(chat_room: ChatRoom, num_readers: int, duration: float, page_size: int) -> list:
+    ''' This function will have num_readers threads call get_messages() for duration seconds and return every latency, in milliseconds
+        NOTE: readers take turns between a page of the newest messages and the clean messages of one user
+    '''
+    latencies = list()
+    latencies_lock = threading.Lock()
+    stop_time = time.perf_counter() + duration
+    def read_loop() -> None:
+        reader_latencies = list()
+        read_num = 0
+        while time.perf_counter() < stop_time:
+            read_start = time.perf_counter()
+            chat_room.get_messages(user_alias = BENCHMARK_ALIASES[0], make_clean = read_num % 2 == 0, return_objects = True, limit = page_size)
+            reader_latencies.append((time.perf_counter() - read_start) * 1000)
+            read_num += 1
+        with latencies_lock:
+            latencies.extend(reader_latencies)
+    reader_threads = [threading.Thread(target = read_loop, name = f'bench-reader-{reader_num}') for reader_num in range(num_readers)]
+    for reader_thread in reader_threads:
+        reader_thread.start()
+    for reader_thread in reader_threads:
+        reader_thread.join()
+    return latencies
+
+def percentile(latencies: list, fraction: float) -> float:
+    ''' This function will return the latency that fraction of the latencies are at or below
+    '''
+    sorted_latencies = sorted(latencies)
+    return sorted_latencies[min(len(sorted_latencies) - 1, int(fraction * len(sorted_latencies)))] if sorted_latencies else 0.0
+
+def report(label: str, latencies: list, duration: float) -> None:
+    ''' This function will print the number of reads and the latencies of one phase
+    '''
+    print(f'{label:>10}: {len(latencies) / duration:9.0f} reads/s   p50 {percentile(latencies, 0.5):7.3f} ms'
+            f'   p99 {percentile(latencies, 0.99):7.3f} ms   max {max(latencies, default = 0.0):8.3f} ms')
+
+def delete_room(room_name: str) -> None:
+    ''' This function will delete the messages, the metadata and the sequence counter of the benchmark room
+    '''
+    mongo_db = CONNECTION_MANAGER.get_database(MONGO_DB)
+    if (room_metadata := mongo_db.get_collection(MONGO_DB_CLASS_ROOM_METADATA).find_one({'room_name': room_name}, projection = {'_id': True})) is not None:
+        mongo_db.get_collection(MONGO_DB_CLASS_MESSAGES).delete_many({'room_id': room_metadata['_id']})
+        mongo_db.get_collection(MONGO_DB_CLASS_ROOM_METADATA).delete_one({'_id': room_metadata['_id']})
+    mongo_db.get_collection(MONGO_DB_CLASS_SEQUENCE_COUNTERS).delete_one({'_id': room_name})
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Measure get_messages() latency while a writer saturates the same room.')
+    parser.add_argument('--messages', type = int, default = 100000, help = 'the number of messages in the room before reading')
+    parser.add_argument('--readers', type = int, default = 4, help = 'the number of reader threads')
+    parser.add_argument('--duration', type = float, default = 5.0, help = 'the seconds every phase runs for')
+    parser.add_argument('--page-size', type = int, default = 50, help = 'the number of messages every read asks for')
+    parser.add_argument('--batch-size', type = int, default = ROOM_ACTOR_MAX_BATCH, help = 'the number of messages the writer sends per batch')
+    parser.add_argument('--switch-interval', type = float, default = sys.getswitchinterval(), help = 'the seconds a thread runs before it hands over the GIL')
+    arguments = parser.parse_args()
+    sys.setswitchinterval(arguments.switch_interval)
+    # the room logs every message it is sent at debug and info, only keep the warnings so the log file is not what is measured
+    logging.getLogger().setLevel(logging.WARNING)
+    room_name = f'read_benchmark_{int(time.time())}'
+    chat_room = ChatRoom(room_name = room_name, member_list = list(BENCHMARK_ALIASES), owner_alias = BENCHMARK_ALIASES[0], room_type = ROOM_TYPE_PUBLIC, create_new = True,
+                        user_list = UserList(), durability = ACK_ON_ENQUEUE)
+    try:
+        for batch_num in range(0, arguments.messages, arguments.batch_size):
+            send_batch(chat_room, min(arguments.batch_size, arguments.messages - batch_num), batch_num)
+        WRITE_BEHIND_SCHEDULER.drain()
+        print(f'{len(chat_room)} messages in {room_name}, {arguments.readers} readers, {arguments.duration} seconds per phase')
+        report('idle', measure_reads(chat_room, arguments.readers, arguments.duration, arguments.page_size), arguments.duration)
+        writer_stop = threading.Event()
+        num_written = list()
+        def write_loop() -> None:
+            batch_num = 0
+            while not writer_stop.is_set():
+                send_batch(chat_room, arguments.batch_size, batch_num)
+                if batch_num % 50 == 49:
+                    chat_room.remove_messages(target_alias = BENCHMARK_ALIASES[2])
+                    chat_room.restore_messages(target_alias = BENCHMARK_ALIASES[2])
+                batch_num += 1
+            num_written.append(batch_num * arguments.batch_size)
+        writer_thread = threading.Thread(target = write_loop, name = 'bench-writer')
+        write_start = time.perf_counter()
+        writer_thread.start()
+        saturated_latencies = measure_reads(chat_room, arguments.readers, arguments.duration, arguments.page_size)
+        writer_stop.set()
+        writer_thread.join()
+        report('saturated', saturated_latencies, arguments.duration)
+        print(f'{"writer":>10}: {num_written[0] / (time.perf_counter() - write_start):9.0f} messages/s, {len(chat_room)} messages in the room')
+    finally:
+        WRITE_BEHIND_SCHEDULER.drain()
+        delete_room(room_name)
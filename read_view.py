@@ -0,0 +1,138 @@
+import logging
+import threading
+from collections import OrderedDict
+from constants import *
+from message_store import MessageStore
+
+''' This file holds the per-user read views of a ChatRoom.
+    NOTE: a read view is a MessageStore with only the messages that one user gets back when they ask for clean messages
+            (sent to them, not removed and not from anyone on their blacklist). New messages are added to the views as they are put
+            in the room, so a heavy reader pays for the filter once per message instead of once per message on every read.
+    NOTE: a view is tied to the blacklist snapshot it was built with, when the blacklist changes the view is rebuilt on the next read
+    NOTE: building a view reads the whole room, so it is done on a snapshot of the room outside the lock of the views. The messages
+            that are added while it is built are kept aside and put in the view before it is handed out
+'''
+
+logging.basicConfig(filename='message_chat.log', level=logging.DEBUG, format = LOG_FORMAT)
+
+class ReadView(MessageStore):
+    """ The messages of a room that one user can see, ordered by sequence number like the room itself.
+        NOTE: the messages are the same objects as the ones in the room, nothing is copied
+    """
+    def __init__(self, user_alias: str, blocked_aliases: frozenset, chunk_size: int = MESSAGE_STORE_CHUNK_SIZE) -> None:
+        super().__init__(chunk_size = chunk_size)
+        self.__user_alias = user_alias
+        self.__blocked_aliases = blocked_aliases
+
+    # property to get the alias of the user the view is for
+    @property
+    def user_alias(self):
+        return self.__user_alias
+
+    # property to get the blacklist snapshot that the view was built with
+    @property
+    def blocked_aliases(self):
+        return self.__blocked_aliases
+
+class ReadViews():
+    """ The read views of one room, only built for the users that read the room often.
+        NOTE: message_filter(message, user_alias, blocked_aliases) decides if a message goes in a view
+        NOTE: a user gets a view on their min_reads read, at most max_views are kept and the least recently read one is dropped
+        NOTE: readers and the writer of the room share the views, so the views have their own lock (readers never take the room lock)
+    """
+    def __init__(self, message_filter, min_reads: int = READ_VIEW_MIN_READS, max_views: int = READ_VIEW_MAX_VIEWS) -> None:
+        self.__message_filter = message_filter
+        self.__min_reads = min_reads
+        self.__max_views = max_views
+        self.__views = OrderedDict()
+        self.__read_counts = dict()
+        # NOTE: the messages added to the room while the view of a user is being built, by the alias of the user
+        self.__building = dict()
+        self.__lock = threading.Lock()
+
+    # property to get the number of views that are built
+    @property
+    def num_views(self):
+        return len(self.__views)
+
+    def get(self, user_alias: str, blocked_aliases: frozenset, messages: MessageStore) -> ReadView:
+        ''' This method will return the view of the user, building it from messages if the user reads often enough
+            NOTE: returns None if the user does not have a view yet, the caller should filter the messages itself
+            NOTE: the snapshot is compared by identity first, it is only the same object while the blacklist has not changed
+            NOTE: the view is built from a snapshot of messages without holding the lock, a reader that asks for the same view
+                    while it is built gets None instead of waiting for it
+        '''
+        with self.__lock:
+            read_view = self.__views.get(user_alias)
+            if read_view is not None and (read_view.blocked_aliases is blocked_aliases or read_view.blocked_aliases == blocked_aliases):
+                self.__views.move_to_end(user_alias)
+                return read_view
+            if read_view is None:
+                self.__read_counts[user_alias] = self.__read_counts.get(user_alias, 0) + 1
+                if self.__read_counts[user_alias] < self.__min_reads:
+                    return None
+            if user_alias in self.__building:
+                return None
+            # NOTE: the snapshot is taken under the lock, so every message that is not in it is added after it and kept aside
+            message_snapshot = messages.snapshot()
+            added_messages = self.__building[user_alias] = list()
+        read_view = self.__build(user_alias = user_alias, blocked_aliases = blocked_aliases, messages = message_snapshot)
+        with self.__lock:
+            if self.__building.pop(user_alias) is not added_messages:
+                logging.debug(f'Read view of {user_alias} was invalidated while it was built.')
+                return None
+            for message in added_messages:
+                self.__add_to_view(read_view, message)
+            self.__views[user_alias] = read_view
+            self.__views.move_to_end(user_alias)
+            while len(self.__views) > self.__max_views:
+                dropped_alias, _ = self.__views.popitem(last = False)
+                logging.debug(f'Read view of {dropped_alias} was dropped.')
+            return read_view
+
+    def add(self, message) -> None:
+        ''' This method will put a new message in every view that should have it
+        '''
+        with self.__lock:
+            for read_view in self.__views.values():
+                self.__add_to_view(read_view, message)
+            for added_messages in self.__building.values():
+                if added_messages is not None:
+                    added_messages.append(message)
+
+    def invalidate(self, messages: list = None) -> None:
+        ''' This method will drop the views that changed messages are in or should now be in, used when messages that are already
+                in the room change (removed, restored)
+            NOTE: without messages every view is dropped
+            NOTE: the read counts are kept, so heavy readers get their view back on their next read
+            NOTE: a view that is being built is always thrown away, it may have read the messages half way through the change
+        '''
+        with self.__lock:
+            for user_alias in list(self.__building):
+                self.__building[user_alias] = None
+            if messages is None:
+                self.__views.clear()
+                return
+            for user_alias, read_view in list(self.__views.items()):
+                if any(message.sequence_num in read_view or self.__message_filter(message, user_alias, read_view.blocked_aliases) is True
+                        for message in messages):
+                    del self.__views[user_alias]
+                    logging.debug(f'Read view of {user_alias} was invalidated.')
+
+    def __add_to_view(self, read_view: ReadView, message) -> None:
+        ''' This is a helper method to put a message in one view if it passes the filter of the view, the lock must be held
+        '''
+        if message.sequence_num in read_view:
+            # the view was built while the message was being put in the room, it already has it
+            return
+        if self.__message_filter(message, read_view.user_alias, read_view.blocked_aliases) is True:
+            read_view.insert(message)
+
+    def __build(self, user_alias: str, blocked_aliases: frozenset, messages) -> ReadView:
+        ''' This is a helper method to build the view of a user from a snapshot of the messages of the room
+            NOTE: the messages come in order, so every insert is an append
+        '''
+        read_view = ReadView(user_alias = user_alias, blocked_aliases = blocked_aliases)
+        read_view.bulk_load(message for message in messages if self.__message_filter(message, user_alias, blocked_aliases) is True)
+        logging.debug(f'Read view of {user_alias} was built with {len(read_view)} messages.')
+        return read_view
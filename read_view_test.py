@@ -0,0 +1,79 @@
+import unittest
+from collections import namedtuple
+from constants import *
+from message_store import MessageStore
+from read_view import ReadViews
+
+ViewMessage = namedtuple('ViewMessage', ['sequence_num', 'to_user', 'from_user'])
+
+def sent_to_reader(message, user_alias, blocked_aliases) -> bool:
+    return message.to_user == user_alias and message.from_user not in blocked_aliases
+
+class ReadViewsTest(unittest.TestCase):
+    """ This test environment will test that the read views only hold the messages a user can see
+        NOTE: the views are built on the second read so that the tests can see both sides of the threshold
+    """
+    def setUp(self) -> None:
+        self.__read_views = ReadViews(message_filter = sent_to_reader, min_reads = 2, max_views = 2)
+        self.__messages = MessageStore()
+        self.__messages.bulk_load(ViewMessage(sequence_num, 'bob' if sequence_num % 2 else 'kevin', 'carl' if sequence_num % 3 == 0 else 'kevin')
+                                for sequence_num in range(30))
+
+    def test_built_after_min_reads(self):
+        ''' A user only gets a view once they have read min_reads times, and the view keeps up with new messages
+        '''
+        self.assertIsNone(self.__read_views.get('bob', frozenset(), self.__messages))
+        read_view = self.__read_views.get('bob', frozenset(), self.__messages)
+        self.assertEqual([message.sequence_num for message in read_view], list(range(1, 30, 2)))
+        self.__read_views.add(ViewMessage(31, 'bob', 'kevin'))
+        self.__read_views.add(ViewMessage(32, 'kevin', 'kevin'))
+        self.assertEqual(read_view.last().sequence_num, 31)
+        self.assertIs(self.__read_views.get('bob', frozenset(), self.__messages), read_view)
+
+    def test_rebuilt_on_blacklist_change(self):
+        ''' A new blacklist snapshot rebuilds the view without the blocked sender
+        '''
+        self.__read_views.get('bob', frozenset(), self.__messages)
+        first_view = self.__read_views.get('bob', frozenset(), self.__messages)
+        blocked_view = self.__read_views.get('bob', frozenset(['carl']), self.__messages)
+        self.assertIsNot(blocked_view, first_view)
+        self.assertTrue(all(message.from_user != 'carl' for message in blocked_view))
+        self.assertEqual(len(blocked_view), len([sequence_num for sequence_num in range(1, 30, 2) if sequence_num % 3 != 0]))
+
+    def test_least_recently_read_dropped(self):
+        ''' Only max_views views are kept, the least recently read view goes first
+        '''
+        for user_alias in ['bob', 'kevin', 'carl']:
+            self.__read_views.get(user_alias, frozenset(), self.__messages)
+            self.__read_views.get(user_alias, frozenset(), self.__messages)
+        self.assertEqual(self.__read_views.num_views, 2)
+        self.__read_views.invalidate()
+        self.assertEqual(self.__read_views.num_views, 0)
+        self.assertIsNotNone(self.__read_views.get('bob', frozenset(), self.__messages))
+
+    def test_invalidate_changed_messages(self):
+        ''' Only the views that hold a changed message, or that it should now be in, are dropped
+        '''
+        for user_alias in ['bob', 'kevin']:
+            self.__read_views.get(user_alias, frozenset(), self.__messages)
+            self.__read_views.get(user_alias, frozenset(), self.__messages)
+        self.__read_views.invalidate(messages = [self.__messages.find(3)])
+        self.assertEqual(self.__read_views.num_views, 1)
+        kevin_view = self.__read_views.get('kevin', frozenset(), self.__messages)
+        self.__read_views.invalidate(messages = [ViewMessage(40, 'bob', 'carl')])
+        self.assertIs(self.__read_views.get('kevin', frozenset(), self.__messages), kevin_view)
+        self.__read_views.invalidate(messages = [ViewMessage(41, 'kevin', 'carl')])
+        self.assertEqual(self.__read_views.num_views, 0)
+
+    def test_added_while_built(self):
+        ''' A message added while a view is built ends up in the view, and a view that is invalidated while it is built is thrown away
+        '''
+        build_hooks = [lambda: read_views.add(ViewMessage(40, 'bob', 'kevin')), lambda: read_views.invalidate(messages = [])]
+        def run_hook_during_build(message, user_alias, blocked_aliases) -> bool:
+            if message.sequence_num == 10 and build_hooks:
+                build_hooks.pop(0)()
+            return sent_to_reader(message, user_alias, blocked_aliases)
+        read_views = ReadViews(message_filter = run_hook_during_build, min_reads = 1)
+        self.assertEqual(read_views.get('bob', frozenset(), self.__messages).last().sequence_num, 40)
+        self.assertIsNone(read_views.get('kevin', frozenset(), self.__messages))
+        self.assertEqual(len(read_views.get('kevin', frozenset(), self.__messages)), 15)
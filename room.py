@@ -1,15 +1,28 @@
 from concurrent.futures.process import _MAX_WINDOWS_WORKERS
 import logging
+import sys
+import threading
 from re import M
 from users import *
 from constants import *
-from datetime import date, datetime
-from pymongo import MongoClient, ReturnDocument
-from collections import deque
+from datetime import date, datetime, timedelta, timezone
+from mongo_connection import CONNECTION_MANAGER
+import time
+from collections import OrderedDict
+from message_store import MessageStore
+from sequence import SequenceBlockAllocator
+from write_behind import WriteBehindBuffer, WRITE_BEHIND_SCHEDULER
+from room_events import RoomEvents, RoomSubscription
+from room_actor import RoomActor
+from read_view import ReadViews
+from moderation import ModerationEngine, MODERATION_ENGINE
+from search_index import SearchIndex, SEARCH_INDEX
+from mongo_indexes import INDEX_MANAGER
+from migrate_messages import MessageMigration
 from constants import *
-from statsd import StatsClient
-
-STATS_CLIENT = StatsClient(host = LOCAL_HOST, port=8125, prefix='messaging')
+from metrics import STATS_CLIENT
+from pymongo import ASCENDING
+from pymongo.errors import PyMongoError
 
 ''' Task List for this file:
 TODO: When reading in a message, we may want to move the the sequence number to the chatmessage class
@@ -21,26 +34,51 @@ TODO: we want to also search for a message by user id and return it
 
 logging.basicConfig(filename='message_chat.log', level=logging.DEBUG, format = LOG_FORMAT)
 
+EPOCH = datetime(1970, 1, 1)
+ONE_MICROSECOND = timedelta(microseconds = 1)
+
+def to_epoch_micros(time_value: datetime) -> int:
+    ''' This function will turn a datetime into the number of microseconds since the epoch, None stays None
+        NOTE: the times of the messages are naive like datetime.now(), an aware time is moved to UTC first
+    '''
+    if time_value is None:
+        return None
+    if time_value.tzinfo is not None:
+        time_value = time_value.astimezone(timezone.utc).replace(tzinfo = None)
+    return (time_value - EPOCH) // ONE_MICROSECOND
+
+def from_epoch_micros(epoch_micros: int) -> datetime:
+    ''' This function will turn a number of microseconds since the epoch back into the datetime it came from, None stays None
+    '''
+    return EPOCH + timedelta(0, 0, epoch_micros) if epoch_micros is not None else None
+
 class MessageProperties():
     """ Class for holding the properties of a message: type, sent_to, sent_from, rec_time, send_time
         NOTE: The sequence number is defaulted to -1
+        NOTE: there is one of these for every message in memory, so it is kept small: slots instead of a __dict__, the aliases and the
+                room name are interned (every message of a sender points at the same string) and the times are kept as integer
+                microseconds since the epoch. The properties still return datetimes.
     """
+    __slots__ = ('__mess_type', '__room_name', '__to_user', '__from_user', '__sent_time', '__rec_time')
+
     def __init__(self, room_name: str, to_user: str, from_user: str, mess_type: int, sent_time: datetime = datetime.now(), rec_time: datetime = datetime.now()) -> None:
         self.__mess_type = mess_type
-        self.__room_name = room_name
-        self.__to_user = to_user
-        self.__from_user = from_user
-        self.__sent_time = sent_time
-        self.__rec_time = rec_time
-
-    def to_dict(self):
-        logging.error(f'sent time is {self.__sent_time}')
+        self.__room_name = sys.intern(room_name) if type(room_name) is str else room_name
+        self.__to_user = sys.intern(to_user) if type(to_user) is str else to_user
+        self.__from_user = sys.intern(from_user) if type(from_user) is str else from_user
+        self.__sent_time = to_epoch_micros(sent_time)
+        self.__rec_time = to_epoch_micros(rec_time)
+
+    def to_dict(self, rec_time: datetime = None):
+        ''' NOTE: rec_time is the time a reader got the message, it is put in the dictionary (as an iso string like sent_time) in place of
+                    the received time of the properties, so a reader never has to change the properties
+        '''
         return {'room_name': self.__room_name, 
             'mess_type': self.__mess_type,
             'to_user': self.__to_user, 
             'from_user': self.__from_user,
-            'sent_time': self.__sent_time.isoformat(), # formating? users
-            'rec_time': self.__rec_time, # formating? users
+            'sent_time': self.sent_time.isoformat(), # formating? users
+            'rec_time': rec_time.isoformat() if rec_time is not None else self.rec_time, # formating? users
         } 
 
     # the following properties are to get functions to get message properties
@@ -62,15 +100,15 @@ class MessageProperties():
 
     @property
     def sent_time(self):
-        return self.__sent_time
+        return from_epoch_micros(self.__sent_time)
 
     @property
     def rec_time(self):
-        return self.__rec_time
+        return from_epoch_micros(self.__rec_time)
 
     @rec_time.setter
     def rec_time(self, time_value):
-        self.__rec_time = time_value
+        self.__rec_time = to_epoch_micros(time_value)
 
     def __str__(self):
         return str(self.to_dict())
@@ -78,19 +116,43 @@ class MessageProperties():
 class ChatMessage():
     """ Class for holding individual messages in a chat thread/queue. Each message has a message, sequence number, timestamp and type
         NOTE: message id is autogenerated by mongodb
+        NOTE: like MessageProperties, this uses slots instead of a __dict__, and the list of revisions is only made on the first edit
     """
-    def __init__(self, message: str, mess_id = None, mess_props: MessageProperties = None, sequence_number: int = -1, removed: bool = False) -> None:
+    __slots__ = ('__message', '__mess_props', '__mess_id', '__sequence_num', '__removed', '__flagged', '__revisions', '__dirty')
+
+    def __init__(self, message: str, mess_id = None, mess_props: MessageProperties = None, sequence_number: int = -1, removed: bool = False,
+                flagged: bool = False, revisions: list = None) -> None:
         self.__message = message
         self.__mess_props = mess_props
         self.__mess_id = mess_id
         self.__sequence_num = sequence_number
         self.__removed = removed
+        self.__flagged = flagged
+        self.__revisions = revisions if revisions else None
         self.__dirty = True
 
+    # property to get the text of the message, this is always the latest revision
     @property
     def message(self):
         return self.__message
 
+    # property to get the earlier texts of the message, oldest first, as { 'message': ..., 'edit_time': ... }
+    @property
+    def revisions(self):
+        return self.__revisions if self.__revisions is not None else list()
+
+    def edit(self, new_message: str) -> dict:
+        ''' This method will replace the text of the message, keeping the text it had before as a revision
+            NOTE: returns the revision that was added
+        '''
+        revision = {'message': self.__message, 'edit_time': datetime.now().isoformat()}
+        if self.__revisions is None:
+            self.__revisions = list()
+        self.__revisions.append(revision)
+        self.__message = new_message
+        self.dirty = True
+        return revision
+
     @property
     def message_properties(self):
         return self.__mess_props
@@ -122,6 +184,17 @@ class ChatMessage():
             self.__removed = new_value
             self.dirty = True
     
+    # property to check if the moderation found a banned term in the message
+    @property
+    def flagged(self):
+        return self.__flagged
+
+    @flagged.setter
+    def flagged(self, new_value):
+        if type(new_value) is bool:
+            self.__flagged = new_value
+            self.dirty = True
+
     @property
     def sequence_num(self):
         return self.__sequence_num
@@ -132,33 +205,69 @@ class ChatMessage():
             self.__sequence_num = new_seq_num
             self.dirty = True
 
-    def to_dict(self):
-        mess_props_dict = self.__mess_props.to_dict()
+    def to_dict(self, rec_time: datetime = None):
+        mess_props_dict = self.__mess_props.to_dict(rec_time = rec_time)
         return {'message': self.__message,
             'sequence_num': self.sequence_num,
             'mess_props': mess_props_dict,
-            'removed': self.removed
+            'removed': self.removed,
+            'flagged': self.flagged,
+            'revisions': self.revisions
         }
 
     def __str__(self):
         return f'Chat Message: {self.__message} - message props: {self.__mess_props}'
 
-class ChatRoom(deque):
+class ChatRoom(MessageStore):
     """ We reuse the constructor for creating new or grabbing an existing instance. If owner_alias is empty and user_alias is not, 
             this is assuming an existing instance. The opposite (owner_alias set and user_alias empty) means we're creating new
             members is always optional, and room_type is only relevant if we're creating new.
     """
-    def __init__(self, room_name: str, member_list: list = {}, owner_alias: str = "", room_type: int = ROOM_TYPE_PRIVATE, create_new: bool = False) -> None:
+    def __init__(self, room_name: str, member_list: dict = None, owner_alias: str = "", room_type: int = ROOM_TYPE_PRIVATE, create_new: bool = False, user_list: UserList = None,
+                durability: str = WRITE_BEHIND_DURABILITY, moderation_engine: ModerationEngine = None, search_index: SearchIndex = None) -> None:
         super(ChatRoom, self).__init__()
+        # NOTE: the API runs the room from the threads of the database executor, every change to the room holds the lock
+        self.__lock = threading.RLock()
+        # NOTE: removes and restores write to mongo outside the lock, this keeps their writes in the same order as their changes
+        self.__sender_update_lock = threading.Lock()
+        if member_list is None:
+            member_list = dict()
+        elif type(member_list) is list:
+            member_list = dict.fromkeys(member_list, -1)
         self.__room_name = room_name
-        self.__user_list = UserList()
-        # Set up mongo - client, db, collection, sequence_collection
-        self.__mongo_client = MongoClient(host = MONGO_DB_HOST, port = MONGO_DB_PORT, username = MONGO_DB_USER, password = MONGO_DB_PASS, authSource = MONGO_DB_AUTH_SOURCE, authMechanism = MONGO_DB_AUTH_MECHANISM)
-        self.__mongo_db = self.__mongo_client.get_database(MONGO_DB)
-        self.__mongo_collection = self.__mongo_db.get_collection(self.__room_name) 
-        self.__mongo_seq_collection = self.__mongo_db.get_collection("sequence")
-        if self.__mongo_collection is None:
-            self.__mongo_collection = self.__mongo_db.create_collection(self.__room_name)
+        # NOTE: the user list is shared between every room, only build one when the room is used on its own
+        self.__user_list = user_list if user_list is not None else UserList()
+        # NOTE: the banned terms are the same for every room unless a room is given its own engine
+        self.__moderation_engine = moderation_engine if moderation_engine is not None else MODERATION_ENGINE
+        # NOTE: the search index covers every room, it is written by the same scheduler as the messages
+        self.__search_index = search_index if search_index is not None else SEARCH_INDEX
+        WRITE_BEHIND_SCHEDULER.register(self.__search_index)
+        # Set up mongo - db, collections, sequence_collection (the client is shared by the whole process)
+        # NOTE: the messages of every room are in one collection keyed by (room_id, sequence_num), the metadata is in its own collection
+        self.__mongo_db = CONNECTION_MANAGER.get_database(MONGO_DB)
+        self.__mongo_collection = self.__mongo_db.get_collection(MONGO_DB_CLASS_MESSAGES)
+        self.__mongo_metadata_collection = self.__mongo_db.get_collection(MONGO_DB_CLASS_ROOM_METADATA)
+        # NOTE: every room has its own counter document, the legacy sequence document is only read to seed it
+        self.__mongo_seq_collection = self.__mongo_db.get_collection(MONGO_DB_CLASS_SEQUENCE_COUNTERS)
+        self.__sequence_allocator = SequenceBlockAllocator(counter_collection = self.__mongo_seq_collection, counter_name = self.__room_name,
+                                                            legacy_collection = self.__mongo_db.get_collection(MONGO_DB_CLASS_SEQUENCE))
+        INDEX_MANAGER.ensure_message_indexes(self.__mongo_collection)
+        INDEX_MANAGER.ensure_room_metadata_indexes(self.__mongo_metadata_collection)
+        self.__room_id = None
+        # New and changed messages are written by the write-behind buffer in batches
+        self.__write_buffer = WriteBehindBuffer(collection = self.__mongo_collection, buffer_name = self.__room_name, durability = durability,
+                                                document_fields = self.__message_key)
+        WRITE_BEHIND_SCHEDULER.register(self.__write_buffer)
+        # Requests waiting for new messages in this room are parked on the room events
+        self.__events = RoomEvents(room_name = self.__room_name)
+        # The API changes the room through the mailbox of its actor, one change at a time and sends in batches
+        self.__actor = RoomActor(chat_room = self)
+        # Users that read the room often get their own filtered view of the messages
+        self.__read_views = ReadViews(message_filter = self.__visible_to)
+        # NOTE: odd while a change to messages that are already in the room is being made, readers check it to never return half of a change
+        self.__change_version = 0
+        # Every message of the room by the alias of its sender, for the operations that work on one sender
+        self.__messages_by_sender = dict()
         # Restore from mongo if possible, if not (or we're creating new) then setup ChatRoom properties
         if owner_alias not in member_list:
             member_list[owner_alias] = -1
@@ -206,11 +315,31 @@ class ChatRoom(deque):
     def owner_alias(self):
         return self.__owner_alias
 
-    # property to get the length of the deque
+    # property to get the number of messages in the room
     @property
     def num_messages(self):
         return len(self)
 
+    # property to get the events that requests can wait on for new messages
+    @property
+    def events(self):
+        return self.__events
+
+    # property to get the actor that the API sends its changes to the room through
+    @property
+    def actor(self):
+        return self.__actor
+
+    # property to check if requests are waiting on the room or changes are queued on it, a room in use is not dropped from memory
+    @property
+    def in_use(self):
+        return self.__events.in_use or self.__actor.in_use
+
+    # property to get a rough estimate of the memory the messages of this room take up
+    @property
+    def estimated_bytes(self):
+        return len(self) * ESTIMATED_MESSAGE_BYTES
+
     # property to get the type of the room
     @property
     def room_type(self):
@@ -237,142 +366,205 @@ class ChatRoom(deque):
             self.__deleted = new_value
             self.dirty = True
 
-    def __get_next_sequence_num(self):
-        """ This is the method that you need for managing the sequence. Note that there is a separate collection for just this one document
+    def __get_next_sequence_num(self) -> int:
+        """ This is the method that you need for managing the sequence. Note that there is a separate collection for the counters
+            NOTE: numbers are reserved from the counter document of the room in blocks, so most calls never reach mongo
         """
-        sequence_num = self.__mongo_seq_collection.find_one_and_update(
-                                                        {'_id': 'userid'},
-                                                        {'$inc': {self.__room_name: 1}},
-                                                        projection={self.__room_name: True, '_id': False},
-                                                        upsert=True,
-                                                        return_document=ReturnDocument.AFTER)
-        return sequence_num
+        return self.__sequence_allocator.next()
 
     def __get_current_sequence_num(self):
         ''' This method will get the sequence number from a specific ChatRoom instance
             NOTE: if the ChatRoom instance does not exist, return a -1 default value
+            NOTE: the counter document of the room is looked up by _id
         '''
-        if (sequence_num := self.__mongo_seq_collection.find_one({ self.__room_name: { '$exists': 'true'}})) is None:
-            return SEQUENCE_NUMBER_NOT_FOUND
-        return sequence_num[self.__room_name]
-
-    def __get_insertion_position(self, sequence_num: int) -> int:
-        ''' This method is a helper method to get the insertion point for the new message
-            for the message list
-        '''
-        current_low_index = 0
-        current_high_index = self.num_messages - 1
-        while self[current_low_index] < sequence_num < self[current_high_index]:
-            current_middle = (current_high_index - current_low_index) // 2
-            if sequence_num < self[current_middle].message_properties.sequence_num:
-                current_high_index = current_middle
-            elif sequence_num > self[current_middle].message_properties.sequence_num:
-                current_low_index = current_middle
-            else:
-                '''insert log error here since we should have unique sequence numbers.'''
-        return current_high_index
+        return self.__sequence_allocator.current()
 
-    #Overriding the queue type put and get operations to add type hints for the ChatMessage type
-    def put(self, message: ChatMessage = None) -> None:
-        ''' This method will put the current message to the left side of the deque
-            NOTE: we use the insert method to put the ChatMessage in the correct placement in the deque
+    # put and get operations with type hints for the ChatMessage type
+    def put(self, message: ChatMessage = None) -> bool:
+        ''' This method will put the current message in the message store in order of its sequence number
+            NOTE: in order messages are appended in O(1), out of order messages are found in O(log n) and copy one chunk and one segment (see MessageStore)
+        '''
+        logging.info(f'Calling the put() method with current message being {message}.')
+        if message is not None and self.insert(message) is True:
+            self.__index_message(message)
+            self.__read_views.add(message)
+            logging.info(f'{message} was placed in the message store.')
+            return True
+        return False
+
+    def __index_message(self, message: ChatMessage) -> None:
+        ''' This is a helper method to add a message that was just stored to the sender index and the search index
         '''
-        logging.info(f'Calling the put() method with current message being {message} appending to the left of the deque.')
-        if message is not None:
-            message_insertion_position = self.__get_insertion_position(message.sequence_num)
-            super().insert(message_insertion_position, message)
-            logging.info(f'{message} was appended to the left of the queue.')
+        self.__messages_by_sender.setdefault(message.message_properties.from_user, list()).append(message)
+        if message.removed is not True:
+            self.__search_index.add_message(room_name = self.__room_name, message = message)
 
-    # overriding parent and setting block to false so we don't wait for messages if there are none
     def get(self) -> ChatMessage:
-        ''' This method will take a ChatMessage from the right side of the deque.
-            NOTE: the method pop() to take a value from the right of the deque
+        ''' This method will return the ChatMessage with the highest sequence number.
+            NOTE: the message is not taken out of the store
         '''
-        try:
-            message_right = super()[-1]
-        except:
-            logging.debug(f'There is no message in the deque for room {self.__room_name}')
+        if (message_right := self.last()) is None:
+            logging.debug(f'There is no message in the message store for room {self.__room_name}')
             return None
-        else:
-            logging.debug(f'Message {message_right} was found on the deque.')
-            return message_right
+        logging.debug(f'Message {message_right} was found in the message store.')
+        return message_right
 
     def find_message(self, user_alias: str, message_text: str, any_message: bool = False) -> ChatMessage:
-        ''' Traverse through the deque of the Chatroom and find the ChatMessage 
+        ''' Traverse through the message store of the Chatroom and find the ChatMessage 
                 with the message_text input from the user.
         '''
-        for current_message in list(self):
+        for current_message in self:
             if current_message.message == message_text:
-                logging.debug(f'found "{message_text}" in deque.')
+                logging.debug(f'found "{message_text}" in the message store.')
                 if any_message is False and current_message.message_properties.from_user in self.__user_list.get(user_alias):
                     logging.warning(f'The message was from a user from the user_aliases blacklist, aborting.')
                 return current_message
-        logging.debug(f'{message_text} was not found in the deque.')
+        logging.debug(f'{message_text} was not found in the message store.')
         return None
     
     @STATS_CLIENT.timer('get_messages')
-    def get_messages(self, user_alias: str, make_clean: bool, return_objects: bool, num_messages: int = GET_ALL_MESSAGES):
-        ''' This method will get num_messages from the deque and get their text, objects and a total count of the messages
+    def get_messages(self, user_alias: str, make_clean: bool, return_objects: bool, num_messages: int = GET_ALL_MESSAGES,
+                    after_seq: int = None, before_seq: int = None, limit: int = None):
+        ''' This method will get num_messages from the message store and get their text, objects and a total count of the messages
             NOTE: total # of messages seems to just be num messages, but if getting all then just return the length of the list
             NOTE: indecies 0 and 1 is to access the values in the tuple for the objects and the number of objects
-            NOTE: case of message_objects[1] gets the length of the cleaned list of messages
+            NOTE: the last value of the tuple is next_cursor, the sequence number to pass back to get the next page, or None if there is no next page
+            NOTE: paging:
+                    - with after_seq, the messages after it are returned oldest first and next_cursor is the next after_seq
+                    - without after_seq, the newest messages before before_seq (or the newest overall) are returned and next_cursor
+                        is the next before_seq to page further back
+                    - num_messages is the same as limit when limit is not given
+            NOTE: readers do not take the lock, they read a snapshot of the store (see MessageStore.snapshot()). If a change to messages
+                    that are already in the room (remove, restore, edit, moderate) was made during the read, the read is done again
         '''
-        # return message texts, full message objects, and total # of messages
+        # return message texts, full message objects, total # of messages and the cursor for the next page
         if user_alias not in self.__member_list and self.__room_type is ROOM_TYPE_PRIVATE:
             logging.warning(f'User with alias {user_alias} is not a member of {self.__room_name}.')
-            return [], [], 0
-        message_objects = self.__get_message_objects(num_messages = num_messages)
-        STATS_CLIENT.gauge('num_messages', message_objects[1])
-        cleaned_message_list = self.__clean_messages(message_object_list = message_objects, user_alias = user_alias, make_clean = make_clean)
+            return [], [], 0, None
+        for _ in range(SNAPSHOT_READ_RETRIES):
+            change_version = self.__change_version
+            if change_version % 2 == 0:
+                messages_read = self.__read_messages(user_alias = user_alias, make_clean = make_clean, return_objects = return_objects,
+                                                    num_messages = num_messages, after_seq = after_seq, before_seq = before_seq, limit = limit)
+                if change_version == self.__change_version:
+                    return messages_read
+            STATS_CLIENT.incr('snapshot_read_retries')
+        # NOTE: the messages kept changing under the reader, wait for the change that is being made instead of trying again
+        logging.debug(f'Messages of {self.__room_name} kept changing during the read, reading them under the lock.')
+        with self.__lock:
+            return self.__read_messages(user_alias = user_alias, make_clean = make_clean, return_objects = return_objects,
+                                        num_messages = num_messages, after_seq = after_seq, before_seq = before_seq, limit = limit)
+
+    def __read_messages(self, user_alias: str, make_clean: bool, return_objects: bool, num_messages: int = GET_ALL_MESSAGES,
+                        after_seq: int = None, before_seq: int = None, limit: int = None):
+        ''' This is a helper method to do one read for get_messages() on a snapshot of the room, or of the read view of the user
+            NOTE: the messages are not copied and nothing on them is changed, the received time is only put in the returned dictionaries
+            NOTE: the dictionaries are built here, so get_messages() can check that no change was made while they were read
+        '''
+        if limit is None and num_messages != GET_ALL_MESSAGES:
+            limit = num_messages
+        oldest_first = after_seq is not None
+        blocked_aliases = self.__get_blocked_aliases(user_alias)
+        read_view = None
+        if make_clean is False and user_alias is not None:
+            read_view = self.__read_views.get(user_alias = user_alias, blocked_aliases = blocked_aliases, messages = self)
+        if read_view is not None:
+            # the read view only holds the messages the user can see, so there is nothing left to filter
+            message_objects = self.__get_message_objects(after_seq = after_seq, before_seq = before_seq, message_store = read_view.snapshot())
+            make_clean = True
+        else:
+            message_objects = self.__get_message_objects(after_seq = after_seq, before_seq = before_seq, message_store = self.snapshot())
+        cleaned_message_list = self.__clean_messages(message_objects = message_objects, user_alias = user_alias, make_clean = make_clean,
+                                                    max_messages = limit + 1 if limit is not None else None, blocked_aliases = blocked_aliases)
+        next_cursor = None
+        if limit is not None and len(cleaned_message_list) > limit:
+            cleaned_message_list = cleaned_message_list[:limit]
+            next_cursor = cleaned_message_list[-1].sequence_num if cleaned_message_list else None
+        if oldest_first is False:
+            cleaned_message_list.reverse()
+        STATS_CLIENT.gauge('num_messages', len(cleaned_message_list))
         if return_objects is True:
             logging.debug('Returning messages with the message objects.')
-            if num_messages == GET_ALL_MESSAGES:
-                return [current_message.message for current_message in cleaned_message_list], [{'message_object': message_obj.to_dict()} for message_obj in cleaned_message_list], len(cleaned_message_list)
-            else:
-                message_texts = list()
-                message_object_list = list()
-                for current_message_index in range(RIGHT_SIDE_OF_DEQUE, RIGHT_SIDE_OF_DEQUE - num_messages, RANGE_STEP):
-                    message_texts.append(cleaned_message_list[current_message_index].message)
-                    message_objects.append(cleaned_message_list[current_message_index])
-                return message_texts, message_object_list, len(message_object_list)
+            received_time = datetime.now()
+            return [current_message.message for current_message in cleaned_message_list], [{'message_object': message_obj.to_dict(rec_time = received_time)} for message_obj in cleaned_message_list], len(cleaned_message_list), next_cursor
         else:
             logging.debug('Returning messages without the message objects.')
-            if num_messages == GET_ALL_MESSAGES:
-                return [current_message.message for current_message in cleaned_message_list], len(cleaned_message_list)
-            else:
-                message_texts = list()
-                for current_message_index in range(RIGHT_SIDE_OF_DEQUE, RIGHT_SIDE_OF_DEQUE - num_messages, RANGE_STEP):
-                    message_texts.append(cleaned_message_list[current_message_index].message)
-                return message_texts, len(message_texts)
+            return [current_message.message for current_message in cleaned_message_list], len(cleaned_message_list), next_cursor
+
+    async def wait_for_messages(self, after_seq: int, timeout: float) -> bool:
+        ''' This method will wait until the room has a message with a sequence number higher than after_seq
+            NOTE: returns False if nothing new showed up before the timeout, in seconds
+        '''
+        def has_new_message() -> bool:
+            newest_message = self.last()
+            return newest_message is not None and newest_message.sequence_num > after_seq
+        return await self.__events.wait(ready = has_new_message, timeout = timeout)
+
+    def subscribe(self, subscriber_alias: str, make_clean: bool = True) -> RoomSubscription:
+        ''' This method will open a push subscription to the new messages of the room, it has to be called on the event loop
+            NOTE: returns None if the user is not allowed to read the room
+            NOTE: the messages are filtered the same way as get_messages(), and a sender on the blacklist of the subscriber is never pushed
+        '''
+        if subscriber_alias not in self.__member_list and self.__room_type is ROOM_TYPE_PRIVATE:
+            logging.warning(f'User with alias {subscriber_alias} is not a member of {self.__room_name}.')
+            return None
+        def visible_to_subscriber(message) -> bool:
+            if message.removed is True:
+                return False
+            if subscriber_alias not in self.__member_list and self.__room_type is ROOM_TYPE_PRIVATE:
+                return False
+            if (subscriber := self.__user_list.get(subscriber_alias)) is None or message.message_properties.from_user in subscriber.blacklist_snapshot:
+                return False
+            return make_clean is True or message.message_properties.to_user == subscriber_alias
+        return self.__events.subscribe(subscriber_alias = subscriber_alias, message_filter = visible_to_subscriber)
+
+    def unsubscribe(self, subscription: RoomSubscription) -> None:
+        ''' This method will close a push subscription to the room
+        '''
+        self.__events.unsubscribe(subscription)
 
-    def __get_message_objects(self, num_messages: int = GET_ALL_MESSAGES):
+    def __get_message_objects(self, after_seq: int = None, before_seq: int = None, message_store: MessageStore = None):
         ''' This is a helper method to get the actual message objects rather than just the message from the object
+            NOTE: the messages are not copied, this returns an iterator that starts at the cursor in O(log n)
+            NOTE: with after_seq the messages come oldest first, otherwise they come newest first
+            NOTE: message_store is the room itself unless a read view is given
         '''
         logging.info(f'Attempting to get message objects in {self.__room_name}.')
-        if num_messages == GET_ALL_MESSAGES:
-            logging.debug('Returning all message objects in the deque.')
-            return list(self), len(self)
-        message_objects = list()
-        for current_message_object in range(RIGHT_SIDE_OF_DEQUE, RIGHT_SIDE_OF_DEQUE - num_messages, RANGE_STEP):
-            message_objects.append(super()[current_message_object].to_dict())
-        logging.debug(f'Returning {num_messages} message objects from the deque.')
-        return message_objects, len(message_objects)
-
-    def __clean_messages(self, message_object_list: list, make_clean: bool, user_alias: str = None) -> list:
+        if message_store is None:
+            message_store = self
+        if after_seq is not None:
+            return message_store.iter_after(after_seq, before_seq)
+        return message_store.iter_before(before_seq)
+
+    def __get_blocked_aliases(self, user_alias: str) -> frozenset:
+        ''' This is a helper method to resolve the blacklist of a user once for a whole request
+        '''
+        if user_alias is None or (reader := self.__user_list.get(user_alias)) is None:
+            return frozenset()
+        return reader.blacklist_snapshot
+
+    @staticmethod
+    def __visible_to(message: ChatMessage, user_alias: str, blocked_aliases: frozenset) -> bool:
+        ''' This is a helper method to check if a message makes it through the clean filter for a user
+            NOTE: this is the filter of __clean_messages() and of the read views, so both always agree
+        '''
+        return ((user_alias is None or message.message_properties.to_user == user_alias)
+                and message.message_properties.from_user not in blocked_aliases
+                and message.removed is not True)
+
+    def __clean_messages(self, message_objects, make_clean: bool, user_alias: str = None, max_messages: int = None,
+                        blocked_aliases: frozenset = frozenset()) -> list:
         ''' This method will be a helper method that will get rid of any messages that are 
             removed or were blacklisted from the user. The helper method checks if they are blacklisted first
             and then checks if the message was removed. The user can also request all messages so they can restore them.
+            NOTE: stops reading messages once max_messages messages have made it through
+            NOTE: blocked_aliases is the blacklist of the user, resolved once by the caller instead of once per message
         '''
         cleaned_message_list = list()
-        for message_object in message_object_list[0]:
-            if make_clean is False:
-                if user_alias is None or message_object.message_properties.to_user == user_alias:
-                    if message_object.message_properties.from_user not in self.__user_list.get(user_alias).blacklist:
-                        if message_object.removed is not True:
-                            message_object.rec_time = datetime.now()
-                            cleaned_message_list.append(message_object)
-            else:
-                message_object.rec_time = datetime.now()
+        for message_object in message_objects:
+            if max_messages is not None and len(cleaned_message_list) >= max_messages:
+                break
+            if make_clean is True or self.__visible_to(message_object, user_alias, blocked_aliases) is True:
                 cleaned_message_list.append(message_object)
         return cleaned_message_list
 
@@ -380,78 +572,185 @@ class ChatRoom(deque):
     def send_message(self, message: str, from_alias: str, mess_props: MessageProperties = None) -> bool:
         ''' This method will send a message to the ChatRoom instance
             List is sorted through the put() methods
+            NOTE: the message is handed to the write-behind buffer, in ack after flush mode we wait for its batch to be written
+            NOTE: the lock is let go before waiting for the flush, so other senders can join the same batch
+            NOTE: returns SEND_NOT_DURABLE if the message was accepted but the flush failed
+        '''
+        return self.send_messages(sends = [(message, from_alias, mess_props)])[0]
+
+    @STATS_CLIENT.timer('send_messages')
+    def send_messages(self, sends: list) -> list:
+        ''' This method will send a batch of messages, every send is (message, from_alias, mess_props)
+            NOTE: the messages are put in the room under one hold of the lock, in ack after flush mode the batch is waited on once
+            NOTE: returns what send_message() would have returned for every send, in the same order
+            NOTE: if the flush fails the accepted sends are SEND_NOT_DURABLE, they are already in the room and published and stay
+                    queued for the next flush, so they must not be sent again
+        '''
+        send_results = list()
+        write_ticket = None
+        with self.__lock:
+            for message, from_alias, mess_props in sends:
+                if (message_ticket := self.__accept_message(message = message, from_alias = from_alias, mess_props = mess_props)) is not None:
+                    write_ticket = message_ticket
+                send_results.append(message_ticket is not None)
+        if write_ticket is not None and self.__write_buffer.durability == ACK_AFTER_FLUSH:
+            if self.__write_buffer.wait_for(write_ticket) is False:
+                logging.warning(f'The flush after {len(send_results)} sends to {self.__room_name} failed, the messages stay queued.')
+                return [SEND_NOT_DURABLE if send_result is True else False for send_result in send_results]
+        return send_results
+
+    def __accept_message(self, message: str, from_alias: str, mess_props: MessageProperties) -> int:
+        ''' This is a helper method to build a message, put it in the room, queue it to be written and publish it, the lock must be held
+            NOTE: returns the ticket from the write-behind buffer, or None if the message was not accepted
         '''
         logging.info(f'Attempting to send {message} with the alias {from_alias}.')
-        if from_alias in self.__member_list or self.__room_type is ROOM_TYPE_PUBLIC:
-            logging.debug(f'{from_alias} was granted access to {self.__room_name} to send a message.')
-            if mess_props is not None:
-                new_message = ChatMessage(message = message, mess_props = mess_props)
-                self.put(new_message)
-                logging.debug(f'New ChatMessage created with message {message} and placed in the deque.')
-                self.persist()
-                return True
-            else:
-                logging.warning(f'No message properties given, cannot generate to_user for message properties. Failed to send message.')
-                return False
-        else:
+        if from_alias not in self.__member_list and self.__room_type is not ROOM_TYPE_PUBLIC:
             logging.debug(f'Alias {from_alias} is not a member of the private chat room {self.__room_name}.')
-            return False
+            return None
+        if mess_props is None:
+            logging.warning(f'No message properties given, cannot generate to_user for message properties. Failed to send message.')
+            return None
+        logging.debug(f'{from_alias} was granted access to {self.__room_name} to send a message.')
+        new_message = ChatMessage(message = message, mess_props = mess_props, sequence_number = self.__get_next_sequence_num())
+        if self.__moderation_engine.moderate(new_message) is True:
+            logging.info(f'Message {new_message.sequence_num} from {from_alias} in {self.__room_name} has a banned term.')
+        self.put(new_message)
+        logging.debug(f'New ChatMessage created with message {message} and placed in the message store.')
+        self.__persist_metadata()
+        write_ticket = self.__mark_dirty(new_message)
+        self.__events.publish(new_message)
+        return write_ticket
+
+    def __begin_change(self) -> None:
+        ''' This is a helper method to mark the start of a change to messages that are already in the room, the lock must be held
+            NOTE: the change version is odd until __end_change(), a read that overlaps the change is done again
+        '''
+        self.__change_version += 1
+
+    def __end_change(self) -> None:
+        ''' This is a helper method to mark the end of a change started with __begin_change(), the lock must be held
+        '''
+        self.__change_version += 1
 
-    def remove_messages(self, target_alias: str) -> bool:
+    def remove_messages(self, target_alias: str) -> int:
         ''' This method will remove all messages based on the target_alias
+            NOTE: returns the number of messages that were removed, or None if the alias is not a member of the room
         '''
         if target_alias not in self.__member_list:
             logging.warning(f'"{target_alias}" is not a member of room instance "{self.__room_name}"')
-            return False
-        for message_object_index in range(len(list(self))):
-            if super()[message_object_index].message_properties.from_user == target_alias:
-                super()[message_object_index].removed = True
-                logging.debug(f'Removed message "{super()[message_object_index].message}" was removed from room instance "{self.__room_name}"')
-        logging.info(f'All messages from "{target_alias}" removed from the room instance "{self.__room_name}"')
-        self.persist()
-        return True
+            return None
+        num_removed = self.__set_removed_by_sender(target_alias = target_alias, removed = True)
+        logging.info(f'{num_removed} messages from "{target_alias}" removed from the room instance "{self.__room_name}"')
+        return num_removed
 
-    def restore_messages(self, target_alias: str) -> bool:
+    def restore_messages(self, target_alias: str) -> int:
         ''' This method will restore all messages based on the target alias in a member list
+            NOTE: returns the number of messages that were restored, or None if the alias is not a member of the room
         '''
         if target_alias not in self.__member_list:
             logging.warning(f'"{target_alias}" is not a member of room instance "{self.__room_name}"')
-            return False
-        for message_object_index in range(len(list(self))):
-            if super()[message_object_index].message_properties.from_user == target_alias:
-                super()[message_object_index].removed = False
-                logging.debug(f'Restored message "{super()[message_object_index].message}" for room instance "{self.__room_name}"')
-        logging.info(f'All messages from "{target_alias}" restored for the room instance "{self.__room_name}"')
-        self.persist()
-        return True
+            return None
+        num_restored = self.__set_removed_by_sender(target_alias = target_alias, removed = False)
+        logging.info(f'{num_restored} messages from "{target_alias}" restored for the room instance "{self.__room_name}"')
+        return num_restored
+
+    def __set_removed_by_sender(self, target_alias: str, removed: bool) -> int:
+        ''' This is a helper method to flip the removed flag of every message from a sender with one update_many
+            NOTE: only the messages of the sender are looked at, through the sender index
+            NOTE: the messages are changed under the lock, the flush and the update_many happen after it is let go so readers and
+                    senders never wait on mongo
+            NOTE: the write-behind buffer is flushed first, so no queued write can land after the update_many with the old flag
+            NOTE: if the flush or the update_many fails, the changed messages are queued on the write-behind buffer instead
+            NOTE: the update_many only matches the sequence numbers that were changed here, a message the sender sends once the lock
+                    is let go can be flushed before it and must keep the flag it has in memory
+        '''
+        with self.__sender_update_lock:
+            with self.__lock:
+                changed_messages = [current_message for current_message in self.__messages_by_sender.get(target_alias, ())
+                                    if current_message.removed is not removed]
+                if not changed_messages:
+                    return 0
+                self.__begin_change()
+                try:
+                    for current_message in changed_messages:
+                        current_message.removed = removed
+                        if removed is True:
+                            self.__search_index.remove_message(room_name = self.__room_name, message = current_message)
+                        else:
+                            self.__search_index.add_message(room_name = self.__room_name, message = current_message)
+                    self.__read_views.invalidate(messages = changed_messages)
+                finally:
+                    self.__end_change()
+                room_id = self.__room_id
+            try:
+                if self.__write_buffer.flush() is False:
+                    raise PyMongoError('the write-behind buffer could not be flushed')
+                self.__mongo_collection.update_many({'room_id': room_id,
+                                                    'sequence_num': {'$in': [current_message.sequence_num for current_message in changed_messages]}},
+                                                    {'$set': {'removed': removed}})
+                with self.__lock:
+                    for current_message in changed_messages:
+                        if current_message.removed is removed:
+                            current_message.dirty = False
+                        else:
+                            # moderated since the lock was let go, queue it so mongo ends up with the flag that is in memory
+                            self.__mark_dirty(current_message)
+            except PyMongoError as error:
+                logging.error(f'Failed to update the messages from "{target_alias}" in {self.__room_name}, queueing them instead: {error}')
+                with self.__lock:
+                    for current_message in changed_messages:
+                        self.__mark_dirty(current_message)
+            return len(changed_messages)
     
-    def edit_message(self, user_alias: str, previous_message: str = None, new_message: str = None) -> bool:
-        ''' This method will find a previous message sent by a user by the entire message, if the entire message is
-            not found, it will not replace the message.
-            TODO: check if the previous message is there
-        '''
-        message_to_edit = self.find_message(user_alias = user_alias, message_text = previous_message, any_message = True)
-        if message_to_edit is None:
-            logging.warning(f'"{previous_message}" was not found in the message list, Process Failed')
-            return False 
-        if user_alias is not message_to_edit.message_properties.from_user:
-            logging.warning(f'User "{user_alias}" is trying to edit a message that is not theirs')
-            return False
-        return self.send_message(message = new_message, from_alias = user_alias, mess_props = MessageProperties(room_name = self.__room_name,
-                                                                                                                to_user = message_to_edit.message_properties.to_user,
-                                                                                                                from_user = user_alias,
-                                                                                                                mess_type = message_to_edit.message_properties.message_type,
-                                                                                                                sent_time = message_to_edit.message_properties.sent_time,
-                                                                                                                rec_time = message_to_edit.message_properties.rec_time)) # rec time will be statsd
+    def edit_message(self, user_alias: str, sequence_num: int, new_message: str) -> bool:
+        ''' This method will edit the message with the sequence number, only the sender of a message can edit it
+            NOTE: the message is found in O(log n), the text it had is kept as a revision on the same message
+            NOTE: a message that is already in mongo is updated with one update_one, one that is still queued is just queued again
+            NOTE: the flag is worked out again from the new text, so editing out a banned term unflags the message
+        '''
+        with self.__lock:
+            message_to_edit = self.find(sequence_num)
+            if message_to_edit is None or message_to_edit.removed is True:
+                logging.warning(f'Message {sequence_num} was not found in room instance "{self.__room_name}", Process Failed')
+                return False
+            if user_alias != message_to_edit.message_properties.from_user:
+                logging.warning(f'User "{user_alias}" is trying to edit a message that is not theirs')
+                return False
+            write_pending = message_to_edit.message_id is None or message_to_edit.dirty is True
+            self.__begin_change()
+            try:
+                revision = message_to_edit.edit(new_message = new_message)
+                self.__moderation_engine.moderate(message_to_edit, edited = True)
+                self.__search_index.remove_message(room_name = self.__room_name, message = message_to_edit, message_text = revision['message'])
+                if message_to_edit.removed is True:
+                    self.__read_views.invalidate(messages = [message_to_edit])
+                else:
+                    self.__search_index.add_message(room_name = self.__room_name, message = message_to_edit)
+            finally:
+                self.__end_change()
+            if write_pending is True:
+                self.__mark_dirty(message_to_edit)
+                return True
+            try:
+                self.__mongo_collection.update_one({'_id': message_to_edit.message_id},
+                                                    {'$set': {'message': message_to_edit.message,
+                                                            'removed': message_to_edit.removed,
+                                                            'flagged': message_to_edit.flagged},
+                                                    '$push': {'revisions': revision}})
+                message_to_edit.dirty = False
+            except PyMongoError as error:
+                logging.error(f'Failed to update message {sequence_num} in {self.__room_name}, queueing it instead: {error}')
+                self.__mark_dirty(message_to_edit)
+            logging.debug(f'Message {sequence_num} in room instance "{self.__room_name}" has {len(message_to_edit.revisions)} revisions.')
+            return True
 
     def find_member(self, member_alias) -> str:
         ''' This method will find the member within the current ChatRoom instance
             NOTE: if the member is not found, return none
-            TODO: log the possibility of not finding the member in the list
+            NOTE: the member list is keyed by alias, so this is a dictionary lookup
         '''
-        for current_member in self.__member_list:
-            if current_member == member_alias:
-                return current_member
+        if member_alias in self.__member_list:
+            return member_alias
         logging.warning(f'"{member_alias}" is not in the memberlist for room instance "{self.__room_name}"')
         return None
 
@@ -459,15 +758,18 @@ class ChatRoom(deque):
         ''' This method will attempt to add a member alias to the list of
             members for a ChatRoom instance.
             TODO: log for each case below
+            NOTE: the member list is changed under the lock, the persist happens after it is let go
         '''
         try:
             if self.__user_list.get(member_alias) is None:
                 logging.warning(f'"{member_alias}" is not a registered user')
                 return INVALID_USER
-            if self.find_member(member_alias) is not None:
-                logging.debug(f'"{member_alias}" is already a member of room instance "{self.__room_name}"')
-                return MEMBER_FOUND
-            self.__member_list.append(member_alias)
+            with self.__lock:
+                if self.find_member(member_alias) is not None:
+                    logging.debug(f'"{member_alias}" is already a member of room instance "{self.__room_name}"')
+                    return MEMBER_FOUND
+                self.__member_list[member_alias] = -1
+                self.dirty = True
             logging.debug(f'"{member_alias}" was added to the member list of "{self.__room_name}"')
             self.persist()
             return MEMBER_ADDED
@@ -480,53 +782,75 @@ class ChatRoom(deque):
             a ChatRoom instance
             TODO: log the situation below
         '''
-        if member_alias in self.__member_list:
-            self.__member_list.remove(member_alias)
-            self.persist()
-            logging.debug(f'"{member_alias}" was removed from the member list of room instance "{self.__room_name}"')
-            return MEMBER_FOUND
-        else:
-            logging.warning(f'"{member_alias}" was not found in the member list in room instance "{self.__room_name}"')
-            return INVALID_USER
+        with self.__lock:
+            if member_alias not in self.__member_list:
+                logging.warning(f'"{member_alias}" was not found in the member list in room instance "{self.__room_name}"')
+                return INVALID_USER
+            del self.__member_list[member_alias]
+            self.dirty = True
+        self.persist()
+        if self.__room_type is ROOM_TYPE_PRIVATE:
+            self.__events.close_subscriptions(subscriber_alias = member_alias)
+        logging.debug(f'"{member_alias}" was removed from the member list of room instance "{self.__room_name}"')
+        return MEMBER_FOUND
 
     def find_message_by_sequence_num(self, sequence_num: int) -> ChatMessage:
         ''' This method will use binary search to find the message by the sequence number.
             NOTE: when the sequence number matches, we return the message that is found.
             NOTE: if there is no message found, we will return nothing.
         '''
-        current_low_index = 0
-        current_high_index = self.num_messages - 1
-        while self[current_low_index] < sequence_num < self[current_high_index]:
-            current_middle = (current_high_index - current_low_index) // 2
-            if sequence_num < self[current_middle].message_properties.sequence_num:
-                current_high_index = current_middle
-            elif sequence_num > self[current_middle].message_properties.sequence_num:
-                current_low_index = current_middle
-            else:
-                # add a log here for finding the message
-                return self[current_middle]
-        return None
+        if (found_message := self.find(sequence_num)) is None:
+            logging.debug(f'No message with sequence number {sequence_num} in room instance "{self.__room_name}"')
+        return found_message
 
     def find_messages_by_alias(self, alias: str) -> list:
-        ''' This method will return a list of messages from the deque if the message was sent
+        ''' This method will return a list of messages from the message store if the message was sent
             by the alias provided.
             NOTE: the list can be empty
             NOTE: possibly check if the alias provided is a valid user?
         '''
         message_list = list()
-        for current_chat_message in list(self):
+        for current_chat_message in self:
             current_chat_message: ChatMessage
             if current_chat_message.message_properties.from_user == alias:
                 message_list.append(current_chat_message)
         return message_list
 
+    def moderate_messages(self) -> int:
+        ''' This method will run the moderation over every message already in the room, used after the banned terms change
+            NOTE: messages that were already flagged are skipped, the changed messages are written in one flush of the write-behind buffer
+            NOTE: the messages are changed and queued under the lock, the flush happens after it is let go so senders and readers
+                    never wait on mongo. If the flush fails the messages stay queued on the write-behind buffer for the next flush
+            NOTE: returns the number of messages that were flagged
+        '''
+        with self.__lock:
+            num_flagged = 0
+            removed_messages = list()
+            self.__begin_change()
+            try:
+                for current_message in self:
+                    if self.__moderation_engine.moderate(current_message) is True:
+                        self.__mark_dirty(current_message)
+                        if current_message.removed is True:
+                            self.__search_index.remove_message(room_name = self.__room_name, message = current_message)
+                            removed_messages.append(current_message)
+                        num_flagged += 1
+                if removed_messages:
+                    self.__read_views.invalidate(messages = removed_messages)
+            finally:
+                self.__end_change()
+        if num_flagged > 0 and self.__write_buffer.flush() is False:
+            logging.error(f'Failed to write the {num_flagged} flagged messages of {self.__room_name}, they stay queued.')
+        logging.info(f'{num_flagged} messages were flagged in room instance "{self.__room_name}"')
+        return num_flagged
+
     def find_messages_by_keyword(self, keyword: str) -> list:
-        ''' This method will return a list of messages from the deque if the message contains
+        ''' This method will return a list of messages from the message store if the message contains
             the keyword provided by the user.
             NOTE: how can we handle this if the keyword is None/empty?
         '''
         message_list = list()
-        for current_chat_message in list(self):
+        for current_chat_message in self:
             current_chat_message: ChatMessage
             if keyword in current_chat_message.message:
                 message_list.append(current_chat_message)
@@ -534,12 +858,17 @@ class ChatRoom(deque):
 
     def restore(self) -> bool:
         ''' This method will restore the metadata and the messages that a certain ChatRoom instance needs
-            NOTE: a ChatRoom will contain it's own collection, if we are creating a new collection, we don't
-                    need to restore
-            TODO: implement a bubble insert
+            NOTE: the metadata is looked up by room name, the messages by the room id of the metadata
+            NOTE: a room that is only in the old layout (its own collection) is migrated by the room list before it is loaded,
+                    see RoomList.get() and migrate_messages.py
+            NOTE: the messages are streamed from mongo sorted by sequence number with only the fields we need,
+                    so the message store is built with bulk_load() in one pass
+            NOTE: a message without a valid sequence number (missing, negative or not a number) can come anywhere in the sort:
+                    missing and negative ones sort before the numbers and documents sort after them. Wherever they come they are
+                    held back and numbered after everything else has been loaded
         '''
         logging.info('Beginning the restore process.')
-        room_metadata = self.__mongo_collection.find_one(filter = { 'room_name' : self.room_name })
+        room_metadata = self.__mongo_metadata_collection.find_one(filter = { 'room_name' : self.room_name })
         if room_metadata is None:
             logging.debug(f'Room name {self.__room_name} was not found in the collections.')
             return False
@@ -547,48 +876,109 @@ class ChatRoom(deque):
         self.__owner_alias = room_metadata['owner_alias']
         self.__room_type = room_metadata['room_type']
         self.__member_list = room_metadata['member_list']
+        if type(self.__member_list) is list:
+            self.__member_list = dict.fromkeys(self.__member_list, -1)
         self.__create_time = room_metadata['create_time']
         self.__modify_time = room_metadata['modify_time']
         self.__room_id = room_metadata['_id']
         self.__deleted = room_metadata['deleted']
         self.__dirty = False
-        for current_message in self.__mongo_collection.find({'message': {'$exists': 'true'}}):
-            message_properties = MessageProperties(room_name = current_message['mess_props']['room_name'],
-                                                    to_user = current_message['mess_props']['to_user'],
-                                                    from_user = current_message['mess_props']['from_user'],
-                                                    mess_type = current_message['mess_props']['mess_type'],
-                                                    sent_time = current_message['mess_props']['sent_time'],
-                                                    rec_time = current_message['mess_props']['rec_time'])
-            new_message = ChatMessage(message = current_message['message'], 
-                                    mess_id = current_message['_id'], 
-                                    mess_props = message_properties, 
-                                    sequence_number = current_message['sequence_num'],
-                                    removed = current_message['removed'])
-            new_message.dirty = False
+        restore_start = time.perf_counter()
+        unnumbered_messages = list()
+        message_cursor = self.__mongo_collection.find({'room_id': self.__room_id},
+                                                    projection = RESTORE_MESSAGE_PROJECTION,
+                                                    sort = [('sequence_num', ASCENDING)],
+                                                    batch_size = RESTORE_BATCH_SIZE)
+        self.bulk_load(self.__stream_messages(message_cursor, unnumbered_messages, restore_start))
+        if (newest_message := self.last()) is not None:
+            self.__sequence_allocator.skip_past(newest_message.sequence_num)
+        for current_message in self:
+            self.__index_message(current_message)
+        for new_message in unnumbered_messages:
+            logging.warning(f'Message {new_message.message_id} in {self.__room_name} has no sequence number, giving it a new one.')
+            new_message.sequence_num = self.__get_next_sequence_num()
+            self.__mark_dirty(new_message)
             self.put(message = new_message)
-            logging.debug('Message ' + current_message['message'] + ' was placed onto the deque.')
-        logging.info('All messages restored to the deque.')
+        restore_seconds = time.perf_counter() - restore_start
+        docs_per_second = len(self) / restore_seconds if restore_seconds > 0 else 0
+        STATS_CLIENT.gauge('restore_docs_per_second', docs_per_second)
+        logging.info(f'All {len(self)} messages restored to the message store of {self.__room_name} in {restore_seconds:.3f}s ({docs_per_second:.0f} docs/s).')
         return True
 
-    def persist(self):
+    def __stream_messages(self, message_cursor, unnumbered_messages: list, restore_start: float):
+        ''' This is a helper method to turn the documents from the restore cursor into messages, in the order they come in
+            NOTE: messages without a valid sequence number are put in unnumbered_messages instead of being returned
+            NOTE: progress is logged every RESTORE_PROGRESS_INTERVAL documents
+        '''
+        num_documents = 0
+        for current_message in message_cursor:
+            num_documents += 1
+            message_properties = current_message['mess_props']
+            new_message = ChatMessage(message = current_message['message'],
+                                    mess_id = current_message['_id'],
+                                    mess_props = MessageProperties(room_name = message_properties['room_name'],
+                                                                to_user = message_properties['to_user'],
+                                                                from_user = message_properties['from_user'],
+                                                                mess_type = message_properties['mess_type'],
+                                                                sent_time = datetime.fromisoformat(message_properties['sent_time']),
+                                                                rec_time = message_properties['rec_time']),
+                                    sequence_number = current_message.get('sequence_num'),
+                                    removed = current_message['removed'],
+                                    flagged = current_message.get('flagged', False),
+                                    revisions = current_message.get('revisions'))
+            new_message.dirty = False
+            if num_documents % RESTORE_PROGRESS_INTERVAL == 0:
+                elapsed_seconds = time.perf_counter() - restore_start
+                logging.info(f'Restoring {self.__room_name}: {num_documents} messages read ({num_documents / elapsed_seconds:.0f} docs/s).')
+            if type(new_message.sequence_num) is not int or new_message.sequence_num < 0:
+                unnumbered_messages.append(new_message)
+                continue
+            yield new_message
+
+    def persist(self) -> bool:
         ''' This method will maintain the data inside of a ChatRoom instance:  
                 - The metadata
                 - The messages in the room.
-            NOTE: we want to iterate through the deque
+            NOTE: only the messages that were marked dirty are written, they are already queued on the write-behind buffer
         '''
         logging.info(f'Beginning the persistence process for a chat room: {self.__room_name}.')
-        if self.__mongo_collection.find_one({ 'room_name': self.__room_name }) is None:
-            self.__room_id = self.__mongo_collection.insert_one({'room_name':self.__room_name,
+        self.__persist_metadata()
+        # put messages in the collection now
+        return self.__write_buffer.flush()
+
+    def __mark_dirty(self, message: ChatMessage) -> int:
+        ''' This is a helper method to flag a new or changed message and queue it to be written
+            NOTE: the write-behind buffer is the set of dirty messages, returns the ticket from the buffer
+            NOTE: the metadata is written first if the room has no id yet, so every queued message can be keyed by the room id
+        '''
+        if self.__room_id is None:
+            self.__persist_metadata()
+        message.dirty = True
+        return self.__write_buffer.enqueue(message)
+
+    def __message_key(self) -> dict:
+        ''' This is a helper method for the write-behind buffer, the fields that key the messages of this room in the messages collection
+        '''
+        return {'room_id': self.__room_id}
+
+    def __persist_metadata(self) -> None:
+        ''' This is a helper method to write the metadata of the room, only when it is new or it has changed
+            NOTE: once the room has an id we know the metadata document exists, so there is no need to look it up again
+        '''
+        if self.__room_id is None and (existing_metadata := self.__mongo_metadata_collection.find_one({ 'room_name': self.__room_name })) is not None:
+            self.__room_id = existing_metadata['_id']
+        if self.__room_id is None:
+            self.__room_id = self.__mongo_metadata_collection.insert_one({'room_name':self.__room_name,
                                                                 'owner_alias': self.__owner_alias,
                                                                 'room_type': self.__room_type,
                                                                 'deleted': self.deleted,
                                                                 'member_list': self.__member_list,
                                                                 'create_time': self.__create_time,
-                                                                'modify_time': self.__modify_time})
+                                                                'modify_time': self.__modify_time}).inserted_id
             logging.debug(f'Chatroom {self.__room_name} metadata has been added to the collection.')
         else:
             if self.__dirty == True:
-                self.__mongo_collection.replace_one(filter = {'room_name': self.__room_name}, 
+                self.__mongo_metadata_collection.replace_one(filter = {'room_name': self.__room_name}, 
                                                     replacement = {'room_name':self.__room_name,
                                                     'owner_alias': self.__owner_alias,
                                                     'room_type': self.__room_type,
@@ -599,79 +989,113 @@ class ChatRoom(deque):
                                                     upsert = True)
                 logging.debug(f'Chatroom {self.__room_name} metadata has been updated in the collection.')
         self.__dirty = False
-        # put messages in the collection now
-        for current_message in list(self):
-            if current_message.dirty == True:
-                if current_message.message_id is None or self.__mongo_collection.find_one({ '_id' : current_message.message_id }) is None:
-                    current_message.sequence_num = self.__get_next_sequence_num()
-                    serialized = current_message.to_dict()
-                    self.__mongo_collection.insert_one(serialized)
-                    current_message.dirty = False
 
 class RoomList():
     """ This is the RoomList class instance that will handle a list of ChatRooms and obtaining them.
         NOTE: no need to have properties as this will be the main handler of all other class instances.
+        NOTE: rooms are only built (and their messages restored) the first time they are asked for. Only a bounded
+                number of hot rooms are kept in memory, the least recently used rooms are flushed and dropped past that.
     """
-    def __init__(self, room_list_name: str = DEFAULT_ROOM_LIST_NAME) -> None:
+    def __init__(self, room_list_name: str = DEFAULT_ROOM_LIST_NAME, user_list: UserList = None, max_loaded_rooms: int = ROOM_CACHE_MAX_ROOMS,
+                max_loaded_bytes: int = ROOM_CACHE_MAX_BYTES, max_idle_seconds: float = ROOM_CACHE_MAX_IDLE_SECONDS) -> None:
         """ Try to restore from mongo and establish variables for the room list
-            NOTE: restore will handle putting the rooms into the room_list
+            NOTE: restore will only load the metadata of the rooms, the rooms themselves are loaded in get()
+            NOTE: user_list is the one registry of users that every room in this list will share
         """
         logging.info(f'Creating RoomList Instance: {room_list_name}')
+        # NOTE: the API changes the room list from the threads of the database executor, every change holds the lock
+        self.__lock = threading.RLock()
         self.__room_list_name = room_list_name
-        self.__room_list = list()
-        self.__user_list = UserList()
-        # Set up mongo - client, db, collection
-        self.__mongo_client = MongoClient(host = MONGO_DB_HOST, port = MONGO_DB_PORT, username = MONGO_DB_USER, password = MONGO_DB_PASS, authSource = MONGO_DB_AUTH_SOURCE, authMechanism = MONGO_DB_AUTH_MECHANISM)
-        self.__mongo_db = self.__mongo_client.get_database(MONGO_DB)
+        self.__rooms_metadata = dict()
+        self.__rooms_by_member = dict()
+        self.__rooms_by_owner = dict()
+        self.__public_rooms = set()
+        self.__loaded_rooms = OrderedDict()
+        self.__last_access = dict()
+        self.__max_loaded_rooms = max_loaded_rooms
+        self.__max_loaded_bytes = max_loaded_bytes
+        self.__max_idle_seconds = max_idle_seconds
+        self.__user_list = user_list if user_list is not None else UserList()
+        # NOTE: the rooms of the old layout that are being copied, by room name, only the loads of the same room wait on the copy
+        self.__migration_locks = dict()
+        # Set up mongo - db, collection (the client is shared by the whole process)
+        self.__mongo_db = CONNECTION_MANAGER.get_database(MONGO_DB)
         self.__mongo_collection = self.__mongo_db.get_collection(room_list_name)
+        self.__room_metadata_collection = self.__mongo_db.get_collection(MONGO_DB_CLASS_ROOM_METADATA)
+        self.__migration_collection = self.__mongo_db.get_collection(MONGO_DB_CLASS_MIGRATIONS)
         if self.__mongo_collection is None:
             self.__mongo_collection = self.__mongo_db.create_collection(room_list_name)
+        INDEX_MANAGER.ensure_room_list_indexes(self.__mongo_collection)
         # Restore from mongo if possible, if not (or we're creating new) then setup properties
         if self.__restore() is not True:
             self.__room_list_create = datetime.now()
             self.__room_list_modify = datetime.now()
             self.__dirty = True
 
+    # property to get the number of rooms that are currently materialized in memory
+    @property
+    def num_loaded_rooms(self):
+        return len(self.__loaded_rooms)
+
+    # property to get the estimated memory used by the materialized rooms
+    @property
+    def loaded_bytes(self):
+        return sum(chat_room.estimated_bytes for chat_room in self.__loaded_rooms.values())
+
     def create(self, room_name: str, owner_alias: str, room_type: int = ROOM_TYPE_PRIVATE) -> ChatRoom:
         ''' This method will create a new ChatRoom given that the room_name is not already taken for the collection.
             NOTE: This can just be a checker for the chatroom name existing in the list when restored or if it's in the collection
             NOTE: Maybe check with the collection as it is possible for all names to not be in the list and removed, due to the option for removal
         '''
         logging.info(f'Attempting to create a ChatRoom instance with name {room_name}.')
-        if self.get(room_name = room_name) is None:
-            return ChatRoom(room_name = room_name, owner_alias = owner_alias, room_type = room_type, create_new = True)
-        logging.debug(f'Instance of {room_name} collection already exists.')
-        return None
+        with self.__lock:
+            if self.get(room_name = room_name) is None:
+                return ChatRoom(room_name = room_name, owner_alias = owner_alias, room_type = room_type, create_new = True, user_list = self.__user_list)
+            logging.debug(f'Instance of {room_name} collection already exists.')
+            return None
 
     def add(self, new_room: ChatRoom) -> bool:
         ''' This method will add a ChatRoom instance to the list of ChatRooms
             NOTE: this method will add the list if the room name does not already exist in the list
+            NOTE: the name is checked again under the lock, in case another thread added a room with the same name since create()
         '''
         if new_room is None:
             logging.debug(f'This room already exists in {self.__room_list_name}.')
             return False
-        self.__room_list.append(new_room)
-        logging.debug(f'Chat room {new_room.room_name} added to the room list.')
-        self.__dirty = True
-        self.__persist()
-        return True
+        with self.__lock:
+            if (room_metadata := self.__rooms_metadata.get(new_room.room_name)) is not None and room_metadata['deleted'] is not REMOVED_ROOM:
+                logging.debug(f'Room {new_room.room_name} was added to {self.__room_list_name} by another request.')
+                return False
+            self.__rooms_metadata[new_room.room_name] = self.__build_metadata(new_room)
+            self.__index_room(self.__rooms_metadata[new_room.room_name])
+            self.__cache_room(new_room)
+            logging.debug(f'Chat room {new_room.room_name} added to the room list.')
+            self.__dirty = True
+            self.__persist()
+            self.__evict()
+            return True
 
     def remove(self, room_name: str):
         ''' This method will remove a ChatRoom instance from the list of ChatRooms.
             NOTE: we want to make sure that the ChatRoom instance with the given room_name exists.
-            NOTE: accessing the property may not work
+            NOTE: the room is only flagged as deleted so it can be restored later
         '''
-        chat_room_to_remove = self.__find_pos(room_name)
-        if chat_room_to_remove is not CHAT_ROOM_INDEX_NOT_FOUND:
-            self.__room_list[chat_room_to_remove].deleted = True
-            logging.debug(f'ChatRoom {room_name} was removed from the room list.')
-            self.__persist()
-        else:
-            logging.debug(f'ChatRoom {room_name} was not found in the room list.')
+        with self.__lock:
+            chat_room_to_remove = self.get(room_name = room_name)
+            if chat_room_to_remove is not None:
+                chat_room_to_remove.deleted = True
+                chat_room_to_remove.persist()
+                self.__rooms_metadata[room_name]['deleted'] = True
+                self.__unindex_room(self.__rooms_metadata[room_name])
+                logging.debug(f'ChatRoom {room_name} was removed from the room list.')
+                self.__dirty = True
+                self.__persist()
+            else:
+                logging.debug(f'ChatRoom {room_name} was not found in the room list.')
 
     def find_room_in_metadata(self, room_name: str) -> dict:
         ''' This method will return a dictionary of information, relating to the metadata...?
-            NOTE: most likely this method will just access the metadata and find the room
+            NOTE: the metadata is kept for every room, so this will not load the room
             NOTE: metadata will consist of:
                     - room_name
                     - room_type
@@ -679,91 +1103,259 @@ class RoomList():
                     - member_list
             NOTE: this is mainly for restoring a room_list
         '''
-        if self.get(room_name = room_name) is None:
+        room_metadata = self.__rooms_metadata.get(room_name)
+        if room_metadata is None or room_metadata['deleted'] is REMOVED_ROOM:
             logging.warning(f'No metadata can be found for {room_name}')
             return None
-        else:
-            room_found = self.get(room_name = room_name)
-            return {
-                'room_name': room_found.room_name,
-                'room_type': room_found.room_type,
-                'owner_alias': room_found.owner_alias,
-                'member_list': room_found.member_list
-            }
+        return {
+            'room_name': room_metadata['room_name'],
+            'room_type': room_metadata['room_type'],
+            'owner_alias': room_metadata['owner_alias'],
+            'member_list': room_metadata['member_list']
+        }
 
     def get_rooms(self):
         ''' This method will return the rooms in the room list, it now will check every room 
             if it has been removed from the room list
             NOTE: The room list can be empty
-            
+            NOTE: this only reads the metadata, no room is loaded
         '''
         logging.info('Returned the list of rooms.')
         visible_room_list = {}
-        for room in self.__room_list:
-            if room.deleted is not REMOVED_ROOM:
-                visible_room_list[f'{room.room_name}'] = f'{room.room_type}'
+        for room_metadata in list(self.__rooms_metadata.values()):
+            if room_metadata['deleted'] is not REMOVED_ROOM:
+                visible_room_list[f'{room_metadata["room_name"]}'] = f'{room_metadata["room_type"]}'
         return visible_room_list
 
     def get(self, room_name: str) -> ChatRoom:
         ''' This method will return a ChatRoom instance, given the name of the room, room_name.
             The method now checks if the room instance has been removed or not
             NOTE: It is possible for a ChatRoom instance to not be in the list of rooms.
-            NOTE: do we create a new ChatRoom if the chatroom was not found?
+            NOTE: if the room is in the metadata but not in memory, it gets loaded here and may push out a cold room
+            NOTE: a room that is already loaded is returned without taking the lock
+            NOTE: a room that is only in the old layout is copied before the lock is taken, so the copy does not hold up the
+                    loads of other rooms, see __migrate_legacy_room()
         '''
         logging.info(f'Attemping to get a chat room with name {room_name}.')
-        for chat_room in self.__room_list:
-            if chat_room.room_name == room_name and chat_room.deleted is not REMOVED_ROOM:
-                logging.debug(f'{room_name} was found in the chat room list.')
+        room_metadata = self.__rooms_metadata.get(room_name)
+        if room_metadata is None or room_metadata['deleted'] is REMOVED_ROOM:
+            logging.debug(f'{room_name} was not found in the chat room list.')
+            return None
+        chat_room = self.__loaded_rooms.get(room_name)
+        if chat_room is not None:
+            self.__touch(room_name)
+            logging.debug(f'{room_name} was found in the chat room list.')
+            return chat_room
+        self.__migrate_legacy_room(room_name)
+        with self.__lock:
+            # another thread may have loaded the room while we were waiting for the lock
+            if (chat_room := self.__loaded_rooms.get(room_name)) is not None:
                 return chat_room
-        logging.debug(f'{room_name} was not found in the chat room list.')
-        return None
+            chat_room = self.__load_room(room_metadata)
+            self.__evict()
+            return chat_room
+
+    def add_member(self, room_name: str, member_alias: str) -> int:
+        ''' This method will add a member to a room and to the member index of the room list
+            NOTE: returns the result of ChatRoom.add_member(), or None if the room is not in the room list
+        '''
+        with self.__lock:
+            if (chat_room := self.get(room_name = room_name)) is None:
+                logging.debug(f'ChatRoom {room_name} was not found in the room list.')
+                return None
+            if (result := chat_room.add_member(member_alias = member_alias)) == MEMBER_ADDED:
+                self.__rooms_by_member.setdefault(member_alias, set()).add(room_name)
+                self.__dirty = True
+                self.__persist()
+            return result
+
+    def remove_member(self, room_name: str, member_alias: str) -> int:
+        ''' This method will remove a member from a room and from the member index of the room list
+            NOTE: returns the result of ChatRoom.remove_member(), or None if the room is not in the room list
+        '''
+        with self.__lock:
+            if (chat_room := self.get(room_name = room_name)) is None:
+                logging.debug(f'ChatRoom {room_name} was not found in the room list.')
+                return None
+            if (result := chat_room.remove_member(member_alias = member_alias)) == MEMBER_FOUND:
+                self.__discard_from_index(self.__rooms_by_member, member_alias, room_name)
+                self.__dirty = True
+                self.__persist()
+            return result
+
+    def flush(self) -> None:
+        ''' This method will persist every room that is in memory, along with the room list itself
+        '''
+        with self.__lock:
+            for chat_room in list(self.__loaded_rooms.values()):
+                chat_room.persist()
+            self.__persist()
 
-    def __find_pos(self, room_name: str) -> int:
-        ''' This method is most likely a helper method for getting the position of a ChatRoom instance is in a list.
-            NOTE: This maybe just for find_by_member and find_by_owner.
-            NOTE: This is used for removing a chatroom instance in the list
-        '''
-        for chat_room_index in range(len(self.__room_list)):
-            if self.__room_list[chat_room_index].room_name is room_name:
-                logging.debug(f'{room_name} was found in the room list.')
-                return chat_room_index
-        logging.debug(f'Room name {room_name} was not found in the room list.')
-        return CHAT_ROOM_INDEX_NOT_FOUND
-    
     def find_by_member(self, member_alias: str) -> list:
         ''' This method will return a list of ChatRoom instances that has the the current alias within the list of
                 member_aliases in the ChatRoom instance. The method now checks if the room instance has been removed from the list.
             NOTE: it is possible for all rooms to not have a the member_alias within their instance. return a empty list
-            NOTE: create a new list and append the ChatRooms to the list.
-            TODO: using the member_alias, find all rooms with a members_list that has this alias
-            TODO: check if this member_alias is valid
+            NOTE: the member index only holds rooms that are not deleted, so this only touches the rooms of the member
         '''
         logging.info(f'Attempting to find chat rooms for member {member_alias} in {self.__room_list_name}.')
-        if member_alias not in self.__user_list.user_aliases:
+        if member_alias not in self.__user_list:
             logging.debug(f'Alias {member_alias} was not found in the list of users!')
             return []
         found_member_chat_rooms = list()
-        for current_chat_room in self.__room_list:
-            if member_alias in current_chat_room.member_list and current_chat_room.deleted is not REMOVED_ROOM:
-                found_member_chat_rooms.append(current_chat_room)
+        for room_name in sorted(self.__rooms_by_member.get(member_alias, ())):
+            found_member_chat_rooms.append(self.get(room_name = room_name))
         logging.info(f'Returning a list of chat rooms with the member alias of {member_alias}.')
         return found_member_chat_rooms
 
+    def readable_room_names(self, user_alias: str) -> set:
+        ''' This method will return the names of the rooms that a user can read, the rooms they are a member of and every public room
+            NOTE: only the indexes are used, no room is loaded
+        '''
+        return self.__rooms_by_member.get(user_alias, set()) | self.__public_rooms
+
     def find_by_owner(self, owner_alias: str) -> list:
         ''' This method will return a list of ChatRoom instances that have an owner_alias that the user is searching for.
             NOTE: it is possible for all rooms to not have the current owner_alias, resulting in the list being empty.
         '''
         logging.info(f'Attempting to find chat rooms for owner {owner_alias} in {self.__room_list_name}.')
-        if owner_alias not in self.__user_alias_list.user_aliases:
+        if owner_alias not in self.__user_list:
             logging.debug(f'Owner alias {owner_alias} was not found in the list of users!')
             return []
         found_owner_chat_rooms = list()
-        for current_chat_room in self.__room_list:
-            if owner_alias is current_chat_room.owner_alias and current_chat_room.deleted is not REMOVED_ROOM:
-                found_owner_chat_rooms.append(current_chat_room)
+        for room_name in sorted(self.__rooms_by_owner.get(owner_alias, ())):
+            found_owner_chat_rooms.append(self.get(room_name = room_name))
         logging.info(f'Returning a list of chat rooms with the owner alias of {owner_alias}.')
         return found_owner_chat_rooms
 
+    def __build_metadata(self, chat_room: ChatRoom) -> dict:
+        ''' This is a helper method to build the metadata entry that the room list keeps for a room
+            NOTE: the member_list is the room's own object, so member changes in a loaded room show up here too
+        '''
+        return {
+            'room_name': chat_room.room_name,
+            'room_type': chat_room.room_type,
+            'owner_alias': chat_room.owner_alias,
+            'member_list': chat_room.member_list,
+            'deleted': chat_room.deleted
+        }
+
+    def __index_room(self, room_metadata: dict) -> None:
+        ''' This is a helper method to add a room to the member and owner indexes
+        '''
+        room_name = room_metadata['room_name']
+        for member_alias in room_metadata['member_list']:
+            self.__rooms_by_member.setdefault(member_alias, set()).add(room_name)
+        self.__rooms_by_owner.setdefault(room_metadata['owner_alias'], set()).add(room_name)
+        if room_metadata['room_type'] == ROOM_TYPE_PUBLIC:
+            self.__public_rooms.add(room_name)
+
+    def __unindex_room(self, room_metadata: dict) -> None:
+        ''' This is a helper method to take a room out of the member and owner indexes
+        '''
+        room_name = room_metadata['room_name']
+        for member_alias in room_metadata['member_list']:
+            self.__discard_from_index(self.__rooms_by_member, member_alias, room_name)
+        self.__discard_from_index(self.__rooms_by_owner, room_metadata['owner_alias'], room_name)
+        self.__public_rooms.discard(room_name)
+
+    def __discard_from_index(self, index: dict, alias: str, room_name: str) -> None:
+        ''' This is a helper method to take a room name out of the set of an alias, dropping the set when it is empty
+        '''
+        if (room_names := index.get(alias)) is not None:
+            room_names.discard(room_name)
+            if not room_names:
+                del index[alias]
+
+    def __cache_room(self, chat_room: ChatRoom) -> None:
+        ''' This is a helper method to put a room in the set of loaded rooms as the most recently used room
+        '''
+        self.__loaded_rooms[chat_room.room_name] = chat_room
+        self.__loaded_rooms.move_to_end(chat_room.room_name)
+        self.__last_access[chat_room.room_name] = time.monotonic()
+
+    def __touch(self, room_name: str) -> None:
+        ''' This is a helper method to mark a loaded room as the most recently used room
+            NOTE: the room may have been evicted by another thread since it was looked up, then there is nothing to mark
+        '''
+        try:
+            self.__loaded_rooms.move_to_end(room_name)
+            self.__last_access[room_name] = time.monotonic()
+        except KeyError:
+            pass
+
+    def __migrate_legacy_room(self, room_name: str) -> None:
+        ''' This is a helper method to copy a room that is only in the old layout (its own collection) into the messages collection
+            NOTE: the copy is batched and picks up where the last run stopped, see migrate_messages.py. A room whose copy was started
+                    but is not done (by this server or by migrate_messages.py) is copied again before it is loaded
+            NOTE: this runs without the lock of the room list, the loads of the same room wait on a lock of their own instead
+            NOTE: if the migration fails part way, the room is loaded with what was copied, run migrate_messages.py again for the rest
+        '''
+        with self.__lock:
+            migration_lock = self.__migration_locks.setdefault(room_name, threading.Lock())
+        try:
+            with migration_lock:
+                if (self.__room_metadata_collection.find_one({'room_name': room_name}, projection = {'_id': True}) is not None
+                        and self.__migration_collection.find_one({'_id': room_name, 'done': False}, projection = {'_id': True}) is None):
+                    return
+                MessageMigration(database = self.__mongo_db).migrate_room(room_name)
+        except PyMongoError as error:
+            # the metadata is copied before the messages, so the messages that were copied can still be restored
+            logging.error(f'Migrating {room_name} failed part way, run migrate_messages.py again to copy the rest: {error}')
+        finally:
+            with self.__lock:
+                if self.__migration_locks.get(room_name) is migration_lock and not migration_lock.locked():
+                    del self.__migration_locks[room_name]
+
+    def __load_room(self, room_metadata: dict) -> ChatRoom:
+        ''' This is a helper method to build a ChatRoom from its metadata, which restores its messages from its collection
+        '''
+        logging.debug(f'Loading room {room_metadata["room_name"]} into memory.')
+        chat_room = ChatRoom(room_name = room_metadata['room_name'],
+                            member_list = room_metadata['member_list'],
+                            owner_alias = room_metadata['owner_alias'],
+                            room_type = room_metadata['room_type'],
+                            user_list = self.__user_list)
+        if room_metadata['member_list'] != chat_room.member_list:
+            self.__unindex_room(room_metadata)
+            room_metadata['member_list'] = chat_room.member_list
+            self.__index_room(room_metadata)
+        room_metadata['member_list'] = chat_room.member_list
+        self.__cache_room(chat_room)
+        STATS_CLIENT.incr('room_list.rooms_loaded')
+        return chat_room
+
+    def __evict(self) -> None:
+        ''' This is a helper method that will flush and drop rooms from memory, starting with the least recently used,
+                while the room count or byte budget is exceeded or while the oldest room has been idle for too long.
+            NOTE: the most recently used room is never evicted, and neither is a room with requests waiting on it
+            NOTE: a room is only dropped once its flush succeeded, the scheduler holds its write-behind buffer weakly so the messages
+                    that could not be written would be lost with it. A room that fails to flush stays loaded and is tried again later
+        '''
+        now = time.monotonic()
+        loaded_bytes = self.loaded_bytes
+        for coldest_room_name in list(self.__loaded_rooms)[:-1]:
+            over_budget = len(self.__loaded_rooms) > self.__max_loaded_rooms or loaded_bytes > self.__max_loaded_bytes
+            idle = now - self.__last_access[coldest_room_name] > self.__max_idle_seconds
+            if not over_budget and not idle:
+                break
+            coldest_room = self.__loaded_rooms[coldest_room_name]
+            if coldest_room.in_use is True:
+                continue
+            try:
+                flushed = coldest_room.persist()
+            except PyMongoError as error:
+                logging.error(f'Failed to persist the metadata of room {coldest_room_name}: {error}')
+                flushed = False
+            if flushed is False:
+                logging.warning(f'Room {coldest_room_name} could not be flushed, keeping it in memory.')
+                STATS_CLIENT.incr('room_list.evictions_failed')
+                continue
+            del self.__loaded_rooms[coldest_room_name]
+            del self.__last_access[coldest_room_name]
+            loaded_bytes -= coldest_room.estimated_bytes
+            STATS_CLIENT.incr('room_list.rooms_evicted')
+            logging.debug(f'Room {coldest_room_name} was flushed and evicted from memory.')
+
     def __persist(self):
         ''' This method will save the metadata of the RoomList class and push it to the collections
             NOTE: the metadata should contain the list of room_names in the metadata where we would collect the room_names and find the room based on
@@ -774,7 +1366,7 @@ class RoomList():
             self.__room_id = self.__mongo_collection.insert_one({'list_name':self.__room_list_name,                                                            
                                                                 'create_time': self.__room_list_create,
                                                                 'modify_time': self.__room_list_modify,
-                                                                'rooms_metadata': [self.find_room_in_metadata(room.room_name) for room in self.__room_list]}) # metadata here
+                                                                'rooms_metadata': list(self.__rooms_metadata.values())}) # metadata here
         else:
             if self.__dirty == True:
                 logging.debug(f'Updating persistence of {self.__room_list_name} metadata.')
@@ -782,15 +1374,14 @@ class RoomList():
                                                     replacement = {'list_name':self.__room_list_name,                                                   
                                                     'create_time': self.__room_list_create,
                                                     'modify_time': self.__room_list_modify,
-                                                    'rooms_metadata': [self.find_room_in_metadata(room.room_name) for room in self.__room_list]},
+                                                    'rooms_metadata': list(self.__rooms_metadata.values())},
                                                     upsert = True) # metadata here and upsert = True to update the room metadata
         self.__dirty = False
 
     def __restore(self) -> bool:
         ''' This method will load the metadata from the collection of the RoomList class and load it to the instance.
-            NOTE: the collection will have to be checked for all ChatRoom aliases
-            TODO: take in the rooms_metadata for one of the methods
-            TODO: restore all of the chat rooms through the metadata in the collections.
+            NOTE: only the metadata is restored here, the rooms are loaded on demand by get()
+            NOTE: older metadata does not have the deleted flag, those rooms are treated as not deleted
         '''
         logging.info('Beginning the restore process.')
         room_metadata = self.__mongo_collection.find_one({ 'list_name' : self.__room_list_name })
@@ -800,15 +1391,15 @@ class RoomList():
         self.__room_list_name = room_metadata['list_name']
         self.__room_list_create = room_metadata['create_time']
         self.__room_list_modify = room_metadata['modify_time']
-        self.__rooms_metadata = room_metadata['rooms_metadata']
-        logging.info(f'Attempting to load chat rooms into room list.')
-        for current_room_metadata in self.__rooms_metadata:
-            new_chatroom = ChatRoom(room_name = current_room_metadata['room_name'],
-                                    member_list = current_room_metadata['member_list'],
-                                    owner_alias = current_room_metadata['owner_alias'],
-                                    room_type = current_room_metadata['room_type'])
-            self.__room_list.append(new_chatroom)
-            logging.debug('Room ' + current_room_metadata['room_name'] + ' has been added to the room list.')
-        logging.info(f'All rooms in {self.__room_list_name} placed into the room list.')
+        logging.info(f'Attempting to load chat room metadata into room list.')
+        for current_room_metadata in room_metadata['rooms_metadata']:
+            if current_room_metadata is None:
+                continue
+            current_room_metadata.setdefault('deleted', False)
+            self.__rooms_metadata[current_room_metadata['room_name']] = current_room_metadata
+            if current_room_metadata['deleted'] is not REMOVED_ROOM:
+                self.__index_room(current_room_metadata)
+            logging.debug('Room ' + current_room_metadata['room_name'] + ' metadata has been added to the room list.')
+        logging.info(f'All room metadata in {self.__room_list_name} placed into the room list.')
         self.__dirty = False
-        return True
\ No newline at end of file
+        return True
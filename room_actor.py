@@ -0,0 +1,136 @@
+import asyncio
+import logging
+from constants import *
+from db_executor import DB_EXECUTOR, DatabaseBusyError
+
+''' This file holds the actor that applies the changes to one ChatRoom in the order they come in.
+    NOTE: every change to a room (send, remove, restore, edit, members) is put in the mailbox of the room and a single worker applies them
+            one at a time, so two requests never change the same room at once and they are applied in the order they were made.
+    NOTE: sends that are next to each other in the mailbox are applied together as one batch: every message of the batch is put in the
+            room and then the batch is written with one flush of the write-behind buffer, instead of one flush per message.
+    NOTE: the worker hands the changes to the database executor, so the event loop never blocks on mongo. Readers do not go through the
+            mailbox at all, they read the room directly.
+    NOTE: like the room events, there is one mailbox per event loop. The worker stops when its mailbox is empty and is started again
+            by the next change.
+'''
+
+logging.basicConfig(filename='message_chat.log', level=logging.DEBUG, format = LOG_FORMAT)
+
+class RoomChange():
+    """ One change waiting in the mailbox of a room, with the future that the caller is waiting on
+        NOTE: a send only carries its arguments, the actor applies the sends of a batch together
+    """
+    def __init__(self, future: asyncio.Future, function = None, kwargs: dict = None, send: tuple = None) -> None:
+        self.future = future
+        self.function = function
+        self.kwargs = kwargs
+        self.send = send
+
+class RoomActor():
+    """ The mailbox and the worker of one room.
+        NOTE: the room only needs send_messages(sends), the other changes are any function that is passed to call()
+    """
+    def __init__(self, chat_room, executor = None, mailbox_size: int = ROOM_ACTOR_MAILBOX_SIZE, max_batch: int = ROOM_ACTOR_MAX_BATCH) -> None:
+        self.__chat_room = chat_room
+        self.__executor = executor if executor is not None else DB_EXECUTOR
+        self.__mailbox_size = mailbox_size
+        self.__max_batch = max_batch
+        self.__mailboxes = dict()
+        self.__num_batches = 0
+        self.__num_sends = 0
+
+    # property to get the number of changes waiting in the mailboxes
+    @property
+    def num_queued(self):
+        return sum([mailbox.qsize() for mailbox in self.__mailboxes.values()])
+
+    # property to check if a worker is running, the room has changes that are queued or being applied
+    @property
+    def in_use(self):
+        return len(self.__mailboxes) > 0
+
+    # property to get the average number of sends that were applied together
+    @property
+    def average_batch(self):
+        return self.__num_sends / self.__num_batches if self.__num_batches > 0 else 0.0
+
+    async def send(self, message: str, from_alias: str, mess_props) -> bool:
+        ''' This method will send a message through the mailbox and return what ChatRoom.send_message() would
+        '''
+        return await self.__submit(send = (message, from_alias, mess_props))
+
+    async def call(self, function, **kwargs):
+        ''' This method will apply a change to the room through the mailbox, after every change that came before it, and return its result
+        '''
+        return await self.__submit(function = function, kwargs = kwargs)
+
+    async def __submit(self, **change_fields):
+        ''' This is a helper method to put a change in the mailbox of the running loop, starting the worker if it is not running
+            NOTE: raises DatabaseBusyError if the mailbox is full
+        '''
+        loop = asyncio.get_running_loop()
+        room_change = RoomChange(future = loop.create_future(), **change_fields)
+        if (mailbox := self.__mailboxes.get(loop)) is None:
+            mailbox = self.__mailboxes[loop] = asyncio.Queue(maxsize = self.__mailbox_size)
+            loop.create_task(self.__run(loop, mailbox))
+        try:
+            mailbox.put_nowait(room_change)
+        except asyncio.QueueFull:
+            raise DatabaseBusyError(f'{mailbox.qsize()} changes are already waiting for room {self.__chat_room.room_name}.')
+        return await room_change.future
+
+    async def __run(self, loop, mailbox: asyncio.Queue) -> None:
+        ''' This is the worker of a mailbox, it applies the changes in order until the mailbox is empty
+            NOTE: the sends at the front of the mailbox are taken together, up to max_batch, a change that is not a send ends the batch
+        '''
+        next_change = None
+        while next_change is not None or not mailbox.empty():
+            room_change = next_change if next_change is not None else mailbox.get_nowait()
+            next_change = None
+            if room_change.send is None:
+                await self.__apply(room_change)
+                continue
+            send_batch = [room_change]
+            while len(send_batch) < self.__max_batch and not mailbox.empty():
+                queued_change = mailbox.get_nowait()
+                if queued_change.send is None:
+                    next_change = queued_change
+                    break
+                send_batch.append(queued_change)
+            await self.__apply_sends(send_batch)
+        del self.__mailboxes[loop]
+
+    async def __apply(self, room_change: RoomChange) -> None:
+        ''' This is a helper method to apply one change on the executor and hand its result to the caller
+        '''
+        try:
+            result = await self.__executor.run(room_change.function, **room_change.kwargs)
+        except Exception as error:
+            self.__resolve(room_change.future, error = error)
+            return
+        self.__resolve(room_change.future, result = result)
+
+    async def __apply_sends(self, send_batch: list) -> None:
+        ''' This is a helper method to apply a batch of sends with one call to the room, which writes them with one flush
+        '''
+        try:
+            results = await self.__executor.run(self.__chat_room.send_messages, sends = [room_change.send for room_change in send_batch])
+        except Exception as error:
+            for room_change in send_batch:
+                self.__resolve(room_change.future, error = error)
+            return
+        self.__num_batches += 1
+        self.__num_sends += len(send_batch)
+        logging.debug(f'{len(send_batch)} sends were applied together to {self.__chat_room.room_name}.')
+        for room_change, result in zip(send_batch, results):
+            self.__resolve(room_change.future, result = result)
+
+    def __resolve(self, future: asyncio.Future, result = None, error: Exception = None) -> None:
+        ''' This is a helper method to finish the future of a change, unless the caller already gave up on it
+        '''
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
@@ -0,0 +1,69 @@
+import asyncio
+import unittest
+from constants import *
+from db_executor import DatabaseExecutor, DatabaseBusyError
+from room_actor import RoomActor
+
+class ActorRoom():
+    """ Just the parts of a ChatRoom that the actor uses, it keeps every change in the order it was applied
+        NOTE: a send of the text 'fail' makes its whole batch raise
+    """
+    def __init__(self) -> None:
+        self.room_name = 'general'
+        self.applied = list()
+
+    def send_messages(self, sends: list) -> list:
+        if any(message == 'fail' for message, _, _ in sends):
+            raise ValueError('the batch failed')
+        self.applied.append([message for message, _, _ in sends])
+        return [True] * len(sends)
+
+    def change(self, name: str) -> str:
+        self.applied.append(name)
+        return name
+
+class RoomActorTest(unittest.TestCase):
+    """ This test environment will test that the changes to a room are applied in order, with the sends next to each other batched
+    """
+    def setUp(self) -> None:
+        self.__executor = DatabaseExecutor(max_workers = 1)
+        self.__room = ActorRoom()
+
+    def tearDown(self) -> None:
+        self.__executor.shutdown()
+
+    def test_batches_in_order(self):
+        ''' Sends that are next to each other in the mailbox are applied as one batch, a change that is not a send ends the batch
+        '''
+        room_actor = RoomActor(chat_room = self.__room, executor = self.__executor)
+        async def make_changes():
+            return await asyncio.gather(room_actor.send('a', 'kevin', None), room_actor.send('b', 'kevin', None),
+                                        room_actor.call(self.__room.change, name = 'members'),
+                                        room_actor.send('c', 'kevin', None), room_actor.send('d', 'kevin', None))
+        self.assertEqual(asyncio.run(make_changes()), [True, True, 'members', True, True])
+        self.assertEqual(self.__room.applied, [['a', 'b'], 'members', ['c', 'd']])
+        self.assertEqual(room_actor.average_batch, 2.0)
+        self.assertFalse(room_actor.in_use)
+
+    def test_batch_error(self):
+        ''' A batch that fails hands its error to every send of the batch, the changes after it are still applied
+        '''
+        room_actor = RoomActor(chat_room = self.__room, executor = self.__executor)
+        async def make_changes():
+            return await asyncio.gather(room_actor.send('a', 'kevin', None), room_actor.send('fail', 'kevin', None),
+                                        room_actor.call(self.__room.change, name = 'members'), return_exceptions = True)
+        first_result, second_result, change_result = asyncio.run(make_changes())
+        self.assertIsInstance(first_result, ValueError)
+        self.assertIsInstance(second_result, ValueError)
+        self.assertEqual(change_result, 'members')
+
+    def test_mailbox_full(self):
+        ''' A change that does not fit in the mailbox is turned away right away
+        '''
+        room_actor = RoomActor(chat_room = self.__room, executor = self.__executor, mailbox_size = 1)
+        async def make_changes():
+            return await asyncio.gather(room_actor.send('a', 'kevin', None), room_actor.send('b', 'kevin', None), return_exceptions = True)
+        first_result, second_result = asyncio.run(make_changes())
+        self.assertTrue(first_result)
+        self.assertIsInstance(second_result, DatabaseBusyError)
+        self.assertEqual(self.__room.applied, [['a']])
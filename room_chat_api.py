@@ -1,13 +1,22 @@
+import asyncio
 import socket
 import logging
 import json
-from fastapi import FastAPI, Request, status, Form, Depends, HTTPException, status
-from fastapi.responses import JSONResponse, Response
+import time
+from typing import List
+from fastapi import FastAPI, Request, status, Form, Depends, HTTPException, status, WebSocket, WebSocketDisconnect, Query
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.templating import Jinja2Templates
 from room import *
 from constants import *
 from users import *
+from mongo_connection import CONNECTION_MANAGER
+from metrics import FLUSH_METRICS
+from moderation import MODERATION_ENGINE
+from search_index import SEARCH_INDEX
+from mongo_indexes import *
+from db_executor import DB_EXECUTOR, DatabaseBusyError
 from pydantic import BaseModel
 from passlib.context import CryptContext
 
@@ -26,16 +35,37 @@ TODO: for testing, we want to include metrics now, for example, getting the time
 
 ''' Reasons for global variables:
         - The first is the documented way to deal with running the app in uvicorn
-        - The second one handles the RoomList to access the rooms from MongoDB
-        - The third one handles the users in the UserList from MongoDB
+        - The second one handles the users in the UserList from MongoDB
+        - The third one handles the RoomList to access the rooms from MongoDB, every room shares the UserList above
 '''
 logging.basicConfig(filename='message_chat.log', level=logging.INFO, format = LOG_FORMAT)
 app = FastAPI()
-room_list = RoomList()
 users = UserList()
+room_list = RoomList(user_list = users)
+MODERATION_ENGINE.restore()
+SEARCH_INDEX.restore()
 pwd_contexts = CryptContext(schemes = ['bcrypt'], deprecated = 'auto')    
 templates = Jinja2Templates(directory="")
 
+@app.on_event('shutdown')
+def shutdown():
+    ''' When the app shuts down, every room in memory is persisted and the write-behind buffers are drained
+        NOTE: the rooms are flushed before the executor is shut down, the executor threads may still be writing to them
+    '''
+    logging.info('Shutting down, flushing all rooms and write-behind buffers.')
+    room_list.flush()
+    DB_EXECUTOR.shutdown()
+    WRITE_BEHIND_SCHEDULER.stop()
+
+@app.exception_handler(DatabaseBusyError)
+async def database_busy(request: Request, error: DatabaseBusyError):
+    ''' When the database executor is full, the request is turned away with a 503 so the client retries later
+        NOTE: the read, send, register, member and blacklist APIs run their mongo work on the database executor
+    '''
+    logging.warning(f'Turning away {request.url.path}: {error}')
+    return JSONResponse(content = { 'message': 'The server is busy, try again shortly.' }, status_code = 503,
+                        headers = { 'Retry-After': str(DB_EXECUTOR_RETRY_AFTER_SECONDS) })
+
 ''' Structures to use for authentication
 '''
 class Token(BaseModel):
@@ -110,39 +140,215 @@ async def index():
     return { 'message' : { 'from' : 'kevin', 'to' : 'you :)' }}
 
 @app.get("/messages/", status_code = 200)
-async def get_messages(alias: str, room_name: str, messages_to_get: int = GET_ALL_MESSAGES, return_objects: bool = True, any_message: bool = True):
+async def get_messages(alias: str, room_name: str, messages_to_get: int = GET_ALL_MESSAGES, return_objects: bool = True, any_message: bool = True,
+                        after_seq: int = None, before_seq: int = None, limit: int = None):
     """ API for getting messages from a room
         NOTE: this user must be a valid member of the room to access the messages to the room.
+        NOTE: pass the next_cursor from the response as after_seq (when paging forward) or before_seq (when paging back) to get the next page
+        NOTE: the read runs on the database executor, building the read view of a heavy reader goes over the whole room
     """
     logging.info(f'Attempting to get messages from {room_name} room...')
-    if room_list.get(room_name = room_name) is None:
+    room_requested = await DB_EXECUTOR.run(room_list.get, room_name = room_name)
+    if room_requested is None:
         logging.debug(f'Room {room_name} was not found in the list of rooms.')
         return JSONResponse(content = { 'message': f'Room {room_name} was not found in the list of rooms.'}, status_code = 400)
-    room_requested = room_list.get(room_name = room_name)
-    if alias not in users.get_all_users_aliases() or (alias not in room_requested.member_list and room_requested.room_type is ROOM_TYPE_PRIVATE):
+    if alias not in users or (alias not in room_requested.member_list and room_requested.room_type is ROOM_TYPE_PRIVATE):
         logging.warning(f'User {alias} does not exist or they are not a member of the room.')
         return JSONResponse(content = { 'message': f'User {alias} does not exist or they are not a member of the room.'}, status_code = 400)
     try:
-        messages_in_room = room_requested.get_messages(user_alias = alias, num_messages = messages_to_get, return_objects = return_objects, make_clean = any_message) # error is here
-        if messages_in_room[2] is EMPTY:
+        messages_in_room = await DB_EXECUTOR.run(room_requested.get_messages, user_alias = alias, num_messages = messages_to_get, return_objects = True,
+                                                make_clean = any_message, after_seq = after_seq, before_seq = before_seq, limit = limit)
+        message_texts, message_objects, num_messages, next_cursor = messages_in_room
+        if num_messages is EMPTY:
             logging.debug(f'Could not get messages in room {room_name}.')
-            return JSONResponse(content = { 'message': 
-                                        { 'data': {
-                                            'message_texts': messages_in_room[0],
-                                            'message_objects': messages_in_room[1],
-                                            'num_messages': messages_in_room[2]
-                                        }}}, status_code = 200)
         else:
-            logging.debug(f'{messages_in_room[2]} messages were found in {room_name} for user {alias}.')
-            return JSONResponse(content = { 'message': { 'data': {
-                                            'message_texts': messages_in_room[0],
-                                            'message_objects': messages_in_room[1],
-                                            'num_messages': messages_in_room[2]
-                                        }}})
+            logging.debug(f'{num_messages} messages were found in {room_name} for user {alias}.')
+        return JSONResponse(content = { 'message': { 'data': {
+                                        'message_texts': message_texts,
+                                        'message_objects': message_objects if return_objects is True else [],
+                                        'num_messages': num_messages,
+                                        'next_cursor': next_cursor
+                                    }}}, status_code = 200)
+    except DatabaseBusyError:
+        raise
     except:
         logging.error(f'Unknown Error obtaining the messages in room {room_name} for user {alias}.')
         return JSONResponse(content = { 'message': f'Unknown Error obtaining the messages in room {room_name} for user {alias}.' }, status_code = 400)
 
+@app.get("/messages/wait", status_code = 200)
+async def wait_for_messages(alias: str, room_name: str, after_seq: int, timeout: float = LONG_POLL_DEFAULT_TIMEOUT, limit: int = None, any_message: bool = True):
+    """ API for long polling a room: the request waits until there is a message after after_seq or the timeout (seconds) runs out
+        NOTE: the response is the same as /messages/ with after_seq, plus timed_out when nothing new showed up
+        NOTE: a waiting request does not read anything until the room gets a new message, the read then runs on the database executor
+    """
+    logging.info(f'{alias} is waiting for messages after {after_seq} in {room_name} room...')
+    room_requested = await DB_EXECUTOR.run(room_list.get, room_name = room_name)
+    if room_requested is None:
+        logging.debug(f'Room {room_name} was not found in the list of rooms.')
+        return JSONResponse(content = { 'message': f'Room {room_name} was not found in the list of rooms.'}, status_code = 400)
+    if alias not in users or (alias not in room_requested.member_list and room_requested.room_type is ROOM_TYPE_PRIVATE):
+        logging.warning(f'User {alias} does not exist or they are not a member of the room.')
+        return JSONResponse(content = { 'message': f'User {alias} does not exist or they are not a member of the room.'}, status_code = 400)
+    deadline = time.monotonic() + min(max(timeout, 0), LONG_POLL_MAX_TIMEOUT)
+    message_texts, message_objects, num_messages, next_cursor = [], [], EMPTY, None
+    while num_messages is EMPTY and (remaining := deadline - time.monotonic()) > 0:
+        if await room_requested.wait_for_messages(after_seq = after_seq, timeout = remaining) is False:
+            break
+        # every message up to the newest one before the read is looked at by the read, a message that comes in during the read is not
+        newest_seen_seq = room_requested.last().sequence_num
+        message_texts, message_objects, num_messages, next_cursor = await DB_EXECUTOR.run(room_requested.get_messages, user_alias = alias, return_objects = True,
+                                                                                            make_clean = any_message, after_seq = after_seq, limit = limit)
+        # everything new was filtered out for this user (blacklist), wait for the next message instead
+        if num_messages is EMPTY:
+            after_seq = max(after_seq, newest_seen_seq)
+    return JSONResponse(content = { 'message': { 'data': {
+                                    'message_texts': message_texts,
+                                    'message_objects': message_objects,
+                                    'num_messages': num_messages,
+                                    'next_cursor': next_cursor if next_cursor is not None else (message_objects[-1]['message_object']['sequence_num'] if message_objects else after_seq),
+                                    'timed_out': num_messages is EMPTY
+                                }}}, status_code = 200)
+
+def hydrate_search_matches(matches: list, blocked_aliases: frozenset) -> list:
+    ''' This function will turn the (score, room name, sequence number) matches of a search into the results of /search/
+        NOTE: matches whose message was removed, can no longer be found or is from a sender on the blacklist are left out
+        NOTE: this can load rooms from mongo, run it on the database executor
+    '''
+    search_results = list()
+    for score, match_room_name, sequence_num in matches:
+        if (match_room := room_list.get(room_name = match_room_name)) is None:
+            continue
+        found_message = match_room.find_message_by_sequence_num(sequence_num = sequence_num)
+        if found_message is None or found_message.removed is True or found_message.message_properties.from_user in blocked_aliases:
+            continue
+        search_results.append({ 'room_name': match_room_name, 'score': round(score, 4), 'message_object': found_message.to_dict() })
+    return search_results
+
+@app.get("/search/", status_code = 200)
+async def search_messages(alias: str, query: str, room_name: str = None, limit: int = SEARCH_DEFAULT_LIMIT, offset: int = 0):
+    """ API for searching the messages of every room the user can read (or just room_name), best matches first
+        NOTE: pass next_offset from the response as offset to get the next page, it is None on the last page
+        NOTE: messages from senders on the blacklist of the user are left out after paging, so a page can be shorter than limit
+        NOTE: the search and the loading of the matched rooms run on the database executor, a room that is not in memory is loaded from mongo
+    """
+    logging.info(f'{alias} is searching for "{query}"...')
+    if alias not in users:
+        logging.warning(f'User {alias} does not exist.')
+        return JSONResponse(content = { 'message': f'User {alias} does not exist.'}, status_code = 400)
+    readable_room_names = room_list.readable_room_names(user_alias = alias)
+    if room_name is not None:
+        if room_name not in readable_room_names:
+            logging.warning(f'User {alias} can not read room {room_name}.')
+            return JSONResponse(content = { 'message': f'Room {room_name} was not found or {alias} is not a member of the room.'}, status_code = 400)
+        readable_room_names = {room_name}
+    limit = min(max(limit, 0), SEARCH_MAX_LIMIT)
+    offset = max(offset, 0)
+    matches = await DB_EXECUTOR.run(SEARCH_INDEX.search, query = query, room_names = readable_room_names, limit = limit + 1, offset = offset)
+    search_results = await DB_EXECUTOR.run(hydrate_search_matches, matches = matches[:limit], blocked_aliases = users.get(alias).blacklist_snapshot)
+    return JSONResponse(content = { 'message': { 'data': {
+                                    'results': search_results,
+                                    'num_results': len(search_results),
+                                    'next_offset': offset + limit if len(matches) > limit else None
+                                }}}, status_code = 200)
+
+@app.websocket("/ws/messages/")
+async def push_messages_websocket(websocket: WebSocket, alias: str, room_name: str, any_message: bool = True):
+    """ API for a websocket that gets every new message of a room pushed to it as { 'message_object': ... }
+        NOTE: the user must be able to read the room, otherwise the socket is closed with a policy violation
+        NOTE: a socket that falls too far behind is closed with "try again later" (1013), the client should reconnect
+                and catch up with /messages/ using the sequence number of the last message it got
+        NOTE: the socket is also closed with 1013 if the database threads are too busy to load the room
+    """
+    logging.info(f'{alias} is opening a websocket to {room_name} room...')
+    try:
+        room_requested = await DB_EXECUTOR.run(room_list.get, room_name = room_name)
+    except DatabaseBusyError as error:
+        logging.warning(f'The websocket of {alias} to {room_name} was turned away: {error}')
+        await websocket.close(code = status.WS_1013_TRY_AGAIN_LATER)
+        return
+    subscription = None
+    if room_requested is not None and alias in users:
+        subscription = room_requested.subscribe(subscriber_alias = alias, make_clean = any_message)
+    if subscription is None:
+        logging.warning(f'User {alias} does not exist, is not a member of the room or the room {room_name} was not found.')
+        await websocket.close(code = status.WS_1008_POLICY_VIOLATION)
+        return
+    await websocket.accept()
+    try:
+        while True:
+            try:
+                new_message = await subscription.get(timeout = ROOM_SUBSCRIPTION_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                await websocket.send_json({ 'heartbeat': time.time() })
+                continue
+            if new_message is None:
+                await websocket.close(code = status.WS_1013_TRY_AGAIN_LATER if subscription.dropped is True else status.WS_1008_POLICY_VIOLATION)
+                break
+            await websocket.send_json({ 'message_object': new_message.to_dict() })
+    except WebSocketDisconnect:
+        logging.debug(f'The websocket of {alias} to {room_name} was closed by the client.')
+    finally:
+        room_requested.unsubscribe(subscription)
+
+@app.get("/messages/stream", status_code = 200)
+async def push_messages_stream(request: Request, alias: str, room_name: str, any_message: bool = True):
+    """ API for a server-sent events stream of every new message of a room, for clients that can not open a websocket
+        NOTE: every message is a "message" event with the sequence number as its id, a "closed" event ends the stream
+    """
+    logging.info(f'{alias} is opening an event stream to {room_name} room...')
+    room_requested = await DB_EXECUTOR.run(room_list.get, room_name = room_name)
+    if room_requested is None:
+        logging.debug(f'Room {room_name} was not found in the list of rooms.')
+        return JSONResponse(content = { 'message': f'Room {room_name} was not found in the list of rooms.'}, status_code = 400)
+    if alias not in users or (subscription := room_requested.subscribe(subscriber_alias = alias, make_clean = any_message)) is None:
+        logging.warning(f'User {alias} does not exist or they are not a member of the room.')
+        return JSONResponse(content = { 'message': f'User {alias} does not exist or they are not a member of the room.'}, status_code = 400)
+    async def message_events():
+        try:
+            while not await request.is_disconnected():
+                try:
+                    new_message = await subscription.get(timeout = ROOM_SUBSCRIPTION_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ': heartbeat\n\n'
+                    continue
+                if new_message is None:
+                    yield f'event: closed\ndata: {json.dumps({ "dropped": subscription.dropped })}\n\n'
+                    break
+                yield f'id: {new_message.sequence_num}\nevent: message\ndata: {json.dumps({ "message_object": new_message.to_dict() })}\n\n'
+        finally:
+            room_requested.unsubscribe(subscription)
+    return StreamingResponse(message_events(), media_type = 'text/event-stream', headers = { 'Cache-Control': 'no-cache' })
+
+@app.get("/metrics/connections/", status_code = 200)
+async def get_connection_metrics():
+    """ API for getting the number of mongo clients, pools and sockets this worker has open
+    """
+    return JSONResponse(content = { 'message': 'connection metrics', 'connections': CONNECTION_MANAGER.stats() }, status_code = 200)
+
+@app.get("/metrics/flushes/", status_code = 200)
+async def get_flush_metrics():
+    """ API for getting how many entries the message and user flushes have written
+    """
+    return JSONResponse(content = { 'message': 'flush metrics', 'flushes': FLUSH_METRICS.stats() }, status_code = 200)
+
+@app.get("/metrics/executor/", status_code = 200)
+async def get_executor_metrics():
+    """ API for getting how many database calls are running or waiting on the database executor, and how many were turned away
+    """
+    return JSONResponse(content = { 'message': 'executor metrics', 'executor': DB_EXECUTOR.stats() }, status_code = 200)
+
+@app.get("/metrics/indexes/", status_code = 200)
+async def get_index_metrics():
+    """ API for getting which queries scan their collection (missing indexes) and which indexes are never used
+        NOTE: the reports run explain and $indexStats, so they run on the database executor
+    """
+    index_reports = [await DB_EXECUTOR.run(INDEX_MANAGER.report, CONNECTION_MANAGER.get_collection(collection_name), declared_indexes, query_shapes)
+                    for collection_name, declared_indexes, query_shapes in [(MONGO_DB_CLASS_MESSAGES, MESSAGE_INDEXES, MESSAGE_QUERY_SHAPES),
+                                                                            (MONGO_DB_CLASS_ROOM_METADATA, ROOM_METADATA_INDEXES, ROOM_METADATA_QUERY_SHAPES),
+                                                                            (MONGO_DB_CLASS_USERS, USER_INDEXES, USER_QUERY_SHAPES),
+                                                                            (DEFAULT_ROOM_LIST_NAME, ROOM_LIST_INDEXES, ROOM_LIST_QUERY_SHAPES)]]
+    return JSONResponse(content = { 'message': 'index metrics', 'indexes': index_reports }, status_code = 200)
+
 @app.get("/rooms/", status_code = 200)
 async def get_rooms():
     """ API for getting messages from a room
@@ -158,7 +364,7 @@ async def get_users():
     """
     logging.info('Attempting to get all of the users from the user list...')
     try:
-        if len(users.get_all_users_aliases()) is EMPTY:
+        if len(users) == EMPTY:
             logging.debug('No users were found in the user list.')
             return JSONResponse(content = 'No users were found in the user list.', status_code = 400)
         else:
@@ -175,14 +381,15 @@ async def blacklist_user(client_alias: str, user_to_blacklist: str):
     """
     logging.info('Attempting to get all of the users from the user list...')
     try:
-        if client_alias not in users.get_all_users_aliases() and user_to_blacklist not in users.get_all_users_aliases():
+        if client_alias not in users and user_to_blacklist not in users:
             logging.debug(f'{client_alias} or {user_to_blacklist} is not registered as a valid user.')
             return JSONResponse(content = f'{client_alias} or {user_to_blacklist} is not registered as a valid user.', status_code = 510)
         else:
-            client_user = users.get(target_alias = client_alias)
-            client_user.add_alias_to_blacklist(alias = user_to_blacklist)
+            client_user = await DB_EXECUTOR.run(users.update_blacklist, alias = client_alias, target_alias = user_to_blacklist, blacklisted = True)
             return JSONResponse(content = { 'message': 'list of current blacklist users', 
                                             'list_of_users': client_user.blacklist}, status_code = 201)
+    except DatabaseBusyError:
+        raise
     except:
         logging.error(f'Unknown Error when blacklisting {user_to_blacklist}.')
         return JSONResponse(content = { 'message': f'Unknown Error when blacklisting {user_to_blacklist}.' }, status_code = 400)
@@ -193,14 +400,15 @@ async def unblacklist_user(client_alias: str, user_to_unblacklist: str):
     """
     logging.info('Attempting to get all of the users from the user list...')
     try:
-        if client_alias not in users.get_all_users_aliases() and user_to_unblacklist not in users.get_all_users_aliases():
+        if client_alias not in users and user_to_unblacklist not in users:
             logging.debug(f'{client_alias} or {user_to_unblacklist} is not registered as a valid user.')
             return JSONResponse(content = f'{client_alias} or {user_to_unblacklist} is not registered as a valid user.', status_code = 510)
         else:
-            client_user = users.get(target_alias = client_alias)
-            client_user.remove_alias_from_blacklist(alias = user_to_unblacklist)
+            client_user = await DB_EXECUTOR.run(users.update_blacklist, alias = client_alias, target_alias = user_to_unblacklist, blacklisted = False)
             return JSONResponse(content = { 'message': 'list of current blacklist users', 
                                             'list_of_users': client_user.blacklist}, status_code = 201)
+    except DatabaseBusyError:
+        raise
     except:
         logging.error(f'Unknown Error when blacklisting {user_to_unblacklist}.')
         return JSONResponse(content = { 'message': f'Unknown Error when blacklisting {user_to_unblacklist}.' }, status_code = 400)
@@ -211,12 +419,14 @@ async def register_client(client_alias: str):
     """
     logging.info(f'Attempting to register {client_alias} as a user...')
     try:
-        if users.register(new_alias = client_alias) is not None:
+        if await DB_EXECUTOR.run(users.register, new_alias = client_alias) is not None:
             logging.debug(f'User {client_alias} was successfully registered as a new user to the user list.')
             return JSONResponse(content = { 'message': f'{client_alias} was successfully added to the list of users.' }, status_code = 201)
         else:
             logging.debug(f'{client_alias} is already registered as a user.')
             return JSONResponse(content = { 'message': f'User {client_alias} already exists in the list of users.' }, status_code = 403)
+    except DatabaseBusyError:
+        raise
     except:
         logging.error(f'Unknown Error registering a user with the name {client_alias}.')
         return JSONResponse(content = { 'message': f'Unknown Error registering a user with the name {client_alias}.' }, status_code = 400)
@@ -229,11 +439,13 @@ async def deregister_client(client_alias: str):
     try:
         if users.get(target_alias = client_alias) is not None:
             logging.debug(f'User {client_alias} was successfully registered as a new user to the user list.')
-            users.deregister(alias_to_remove = client_alias)
+            await DB_EXECUTOR.run(users.deregister, alias_to_remove = client_alias)
             return JSONResponse(content = { 'message': f'{client_alias} was successfully removed from the list of users.' }, status_code = 201)
         else:
             logging.debug(f'{client_alias} is not a valid user.')
             return JSONResponse(content = { 'message': f'User {client_alias} is not a user.' }, status_code = 403)
+    except DatabaseBusyError:
+        raise
     except:
         logging.error(f'Unknown Error deregistering a user with the name {client_alias}.')
         return JSONResponse(content = { 'message': f'Unknown Error deregistering a user with the name {client_alias}.' }, status_code = 400)
@@ -244,16 +456,19 @@ async def create_room(room_name: str, owner_alias: str, room_type: int = ROOM_TY
         NOTE: there are edge cases to make sure no duplicates of rooms
     """
     logging.info(f'{owner_alias} is attempting to create a room with the name {room_name} to the room list...')
-    if owner_alias not in users.get_all_users_aliases():
+    if owner_alias not in users:
         logging.debug(f'{owner_alias} was not a valid user alias in the UserList.')
         return JSONResponse(content = { 'message': 'Users not found in UserList.' }, status_code = 412)
     try:
-        new_chat_room = room_list.add(room_list.create(room_name = room_name, owner_alias = owner_alias, room_type = room_type))
+        new_chat_room = await DB_EXECUTOR.run(room_list.create, room_name = room_name, owner_alias = owner_alias, room_type = room_type)
+        new_chat_room = await DB_EXECUTOR.run(room_list.add, new_room = new_chat_room)
         if new_chat_room is False:
             logging.debug(f'"{room_name}" room already exists in the list of rooms.')
             return JSONResponse(content = { 'message': f'"{room_name}" room already exists in the list of rooms.' }, status_code = 409)
         else:
             return JSONResponse(content = { 'message': f'"{room_name}" room has been successfully added to the list of rooms.' }, status_code = 201)
+    except DatabaseBusyError:
+        raise
     except:
         logging.error(f'Unknown Error creating a room with name {room_name} by {owner_alias}.')
         return JSONResponse(content = { 'message': f'Unknown Error creating a room with name {room_name} by {owner_alias}.'}, status_code = 400)
@@ -263,11 +478,11 @@ async def add_member(room_name: str, member_name: str):
     if users.get(member_name) is None:
         logging.debug(f'{member_name} is not a valid user.')
         return JSONResponse(status_code = 433, content = {'message': f'{member_name} is not a valid user.'})
-    room_instance = room_list.get(room_name = room_name)
+    room_instance = await DB_EXECUTOR.run(room_list.get, room_name = room_name)
     if room_instance is None:
         logging.warning(f'{member_name} was attempting to access a room that does not exist, named {room_name}')
         return JSONResponse(status_code = 404, content = {'message': f'Room instance {room_name} is not in the room list.'})
-    if (result := room_instance.add_member(member_alias = member_name)) is MEMBER_FOUND:
+    if (result := await room_instance.actor.call(room_list.add_member, room_name = room_name, member_alias = member_name)) is MEMBER_FOUND:
         logging.debug(f'{member_name} is already a member in {room_name}')
         return JSONResponse(status_code = 510, content = {'message': f'{member_name} is already a member of room instance {room_name}'})
     elif result is UNABLE_TO_ADD_MEMBER:    
@@ -275,52 +490,58 @@ async def add_member(room_name: str, member_name: str):
         return JSONResponse(status_code = 510, content = {'message': f'There was an unexpected API error adding {member_name} to room {room_name} as a member'})
     else:
         logging.debug(f'{member_name} was successflly added as a member to room instance {room_name}')
-        return Response(status_code = 201, content = {'message': f'{member_name} was successflly added as a member to room instance {room_name}'})
+        return JSONResponse(status_code = 201, content = {'message': f'{member_name} was successflly added as a member to room instance {room_name}'})
 
 @app.post("/room/remove_member/", status_code=201)
 async def remove_member(room_name: str, member_name: str):
     if users.get(member_name) is None:
         logging.debug(f'{member_name} is not a valid user.')
         return JSONResponse(status_code = 433, content = {'message': f'{member_name} is not a valid user.'})
-    room_instance = room_list.get(room_name = room_name)
+    room_instance = await DB_EXECUTOR.run(room_list.get, room_name = room_name)
     if room_instance is None:
         logging.warning(f'{member_name} was attempting to access a room that does not exist, named {room_name}')
         return JSONResponse(status_code = 510, content = {'message': f'Room instance {room_name} is not in the room list.'})
-    if room_instance.add_member(member_alias = member_name) is INVALID_USER:
+    if await room_instance.actor.call(room_list.remove_member, room_name = room_name, member_alias = member_name) is INVALID_USER:
         logging.debug(f'{member_name} is not in the member list of room instance {room_name}')
         return JSONResponse(status_code = 510, content = {'message': f'{member_name} is not in the member list of room instance {room_name}'})
     else:
-        logging.debug(f'{member_name} was successflly added as a member to room instance {room_name}')
-        return Response(status_code = 201, content = {'message': f'{member_name} was successflly added as a member to room instance {room_name}'})
+        logging.debug(f'{member_name} was successflly removed as a member from room instance {room_name}')
+        return JSONResponse(status_code = 201, content = {'message': f'{member_name} was successflly removed as a member from room instance {room_name}'})
 
 @app.post("/room/message/", status_code = 201)
 async def send_message(room_name: str, message: str, from_alias: str, to_alias: str):
     """ API for sending a message, for a particular room
-        TODO: this may want to access the send_message feature from a chatroom
+        NOTE: the message goes through the mailbox of the room, so sends that come in together are written together
+        NOTE: 202 means the message is in the room but could not be written to the database yet, it will be and must not be sent again
     """
     logging.info(f'Attempting to send "{message}" to {to_alias} from {from_alias}...')
-    if from_alias not in users.get_all_users_aliases() and to_alias not in users.get_all_users_aliases():
+    if from_alias not in users and to_alias not in users:
         logging.debug(f'{from_alias} or {to_alias} was not a valid user alias in the UserList.')
         return JSONResponse(content = { 'message': 'Users not found in UserList.'}, status_code = 412)
-    if room_list.get(room_name = room_name) is None:
+    requested_chat_room = await DB_EXECUTOR.run(room_list.get, room_name = room_name)
+    if requested_chat_room is None:
         logging.debug(f'ChatRoom {room_name} does not exists in the list of rooms.')
         return JSONResponse(content = { 'message': f'{room_name} room was not found in room list.'}, status_code = 409)
-    requested_chat_room = room_list.get(room_name = room_name)
     try:
-        request_status = requested_chat_room.send_message(message = message, 
-                                                        from_alias = from_alias, 
-                                                        mess_props = MessageProperties(room_name = room_name,
-                                                                                    to_user = to_alias,
-                                                                                    from_user = from_alias,
-                                                                                    mess_type = PRIVATE_MESSAGE,
-                                                                                    sent_time = datetime.now(),
-                                                                                    rec_time = None))
+        request_status = await requested_chat_room.actor.send(message = message, 
+                                                            from_alias = from_alias, 
+                                                            mess_props = MessageProperties(room_name = room_name,
+                                                                                        to_user = to_alias,
+                                                                                        from_user = from_alias,
+                                                                                        mess_type = PRIVATE_MESSAGE,
+                                                                                        sent_time = datetime.now(),
+                                                                                        rec_time = None))
         if request_status is True:
             logging.debug(f'"{message}" was successfully sent to {to_alias} from {from_alias}.')
             return JSONResponse(content = { 'message': f'{message} was successfully sent to {to_alias}.'}, status_code = 201)
+        elif request_status == SEND_NOT_DURABLE:
+            logging.warning(f'"{message}" was sent to {to_alias} from {from_alias} but is not written to the database yet.')
+            return JSONResponse(content = { 'message': f'{message} was accepted for {to_alias} but is not saved yet, do not send it again.'}, status_code = 202)
         else:
             logging.warning(f'User {from_alias} attempted to send a message to a room they are not a member of!')
             return JSONResponse(content = { 'message': f'{message} was not sent successfully to {to_alias}.'}, status_code = 412)
+    except DatabaseBusyError:
+        raise
     except:
         logging.error(f'Unknown Error when sending {message} to {to_alias}.')
         return JSONResponse(content = { 'message': f'Unknown Error sending {message} to {to_alias}.'}, status_code = 400)
@@ -330,43 +551,83 @@ async def remove_messages(room_name: str, client_alias: str):
     ''' This method will remove a message from the list of messages for a certain user
         NOTE: this method will just set the removed bool to True
     '''
-    if client_alias not in users.get_all_users_aliases:
+    if client_alias not in users:
         return JSONResponse(content = {'message': f'{client_alias} is not a valid registered user.'}, status_code = 510)
-    room_instance = room_list.get(room_name = room_name)
+    room_instance = await DB_EXECUTOR.run(room_list.get, room_name = room_name)
     if room_instance is None:
         return JSONResponse(content = {'message': f'{room_name} is not a valid registered room.'}, status_code = 510)
-    removed_messages_success = room_instance.remove_messages(target_alias = client_alias)
-    if removed_messages_success is False:
+    num_removed = await room_instance.actor.call(room_instance.remove_messages, target_alias = client_alias)
+    if num_removed is None:
         return JSONResponse(content = {'message': f'{client_alias} is not a member of the room.'}, status_code = 510)
     else:
-        return JSONResponse(content = {'message': f'All of {client_alias} messages have been removed.'}, status_code = 201)
+        return JSONResponse(content = {'message': f'All of {client_alias} messages have been removed.', 'num_messages': num_removed}, status_code = 201)
 
 @app.post('/room/restore_messages/', status_code = 201)
 async def restore_messages(room_name: str, client_alias: str):
     ''' This method will restore a message from the list of messages for a certain user
     '''
-    if client_alias not in users.get_all_users_aliases:
+    if client_alias not in users:
         return JSONResponse(content = {'message': f'{client_alias} is not a valid registered user.'}, status_code = 510)
-    room_instance = room_list.get(room_name = room_name)
+    room_instance = await DB_EXECUTOR.run(room_list.get, room_name = room_name)
     if room_instance is None:
         return JSONResponse(content = {'message': f'{room_name} is not a valid registered room.'}, status_code = 510)
-    restored_messages_success = room_instance.restore_messages(target_alias = client_alias)
-    if restored_messages_success is False:
+    num_restored = await room_instance.actor.call(room_instance.restore_messages, target_alias = client_alias)
+    if num_restored is None:
         return JSONResponse(content = {'message': f'{client_alias} is not a member of the room.'}, status_code = 510)
     else:
-        return JSONResponse(content = {'message': f'All of {client_alias} messages have been removed.'}, status_code = 201)
+        return JSONResponse(content = {'message': f'All of {client_alias} messages have been restored.', 'num_messages': num_restored}, status_code = 201)
+
+@app.get('/moderation/terms/', status_code = 200)
+async def get_banned_terms():
+    ''' This method will return the banned terms and what is done to a message that has one
+    '''
+    return JSONResponse(content = {'message': 'banned terms', 'terms': MODERATION_ENGINE.terms, 'action': MODERATION_ENGINE.action}, status_code = 200)
+
+@app.post('/moderation/terms/', status_code = 201)
+async def add_banned_terms(terms: List[str] = Query(...), action: str = None):
+    ''' This method will add terms to the banned terms, and change the action if one is given
+        NOTE: only new messages are checked against the new terms, use /room/moderate/ to check the messages already in a room
+    '''
+    if action is not None and action not in (MODERATION_ACTION_FLAG, MODERATION_ACTION_REMOVE):
+        return JSONResponse(content = {'message': f'{action} is not a valid moderation action.'}, status_code = 400)
+    num_added = MODERATION_ENGINE.add_terms(terms = terms)
+    if action is not None:
+        MODERATION_ENGINE.action = action
+    await DB_EXECUTOR.run(MODERATION_ENGINE.persist)
+    return JSONResponse(content = {'message': f'{num_added} terms were added to the banned terms.', 'num_terms': num_added}, status_code = 201)
+
+@app.delete('/moderation/terms/', status_code = 200)
+async def remove_banned_terms(terms: List[str] = Query(...)):
+    ''' This method will take terms out of the banned terms
+        NOTE: messages that were already flagged stay flagged
+    '''
+    num_removed = MODERATION_ENGINE.remove_terms(terms = terms)
+    await DB_EXECUTOR.run(MODERATION_ENGINE.persist)
+    return JSONResponse(content = {'message': f'{num_removed} terms were removed from the banned terms.', 'num_terms': num_removed}, status_code = 200)
+
+@app.post('/room/moderate/', status_code = 201)
+async def moderate_messages(room_name: str):
+    ''' This method will check every message already in a room against the banned terms
+    '''
+    room_instance = await DB_EXECUTOR.run(room_list.get, room_name = room_name)
+    if room_instance is None:
+        return JSONResponse(content = {'message': f'{room_name} is not a valid registered room.'}, status_code = 510)
+    num_flagged = await room_instance.actor.call(room_instance.moderate_messages)
+    return JSONResponse(content = {'message': f'{num_flagged} messages were flagged in {room_name}.', 'num_messages': num_flagged}, status_code = 201)
 
 @app.post('/room/edit_message/', status_code = 201)
-async def edit_message(room_name: str, client_alias: str, message_to_edit: str, new_message: str):
+async def edit_message(room_name: str, client_alias: str, sequence_num: int, new_message: str):
     ''' This method will edit an existing message in a ChatRoom
+        NOTE: the message is picked by its sequence number, the text it had before is kept in its revisions
     '''
-    if client_alias not in users.get_all_users_aliases:
+    if client_alias not in users:
         return JSONResponse(content = {'message': f'{client_alias} is not a valid registered user.'}, status_code = 510)
-    room_instance = room_list.get(room_name = room_name)
+    room_instance = await DB_EXECUTOR.run(room_list.get, room_name = room_name)
     if room_instance is None:
         return JSONResponse(content = {'message': f'{room_name} is not a valid registered room.'}, status_code = 510)
-    restored_messages_success = room_instance.edit_message(user_alias = client_alias, previous_message = message_to_edit, new_message = new_message)
-    if restored_messages_success is False:
+    edited_message_success = await room_instance.actor.call(room_instance.edit_message, user_alias = client_alias, sequence_num = sequence_num, new_message = new_message)
+    if edited_message_success is False:
         return JSONResponse(content = {'message': f'Error editing a message in edit_message() call, Refer to logs.'}, status_code = 510)
     else:
-        return JSONResponse(content = {'message': f'{message_to_edit} has been updated to {new_message} as a new message.'}, status_code = 201)
\ No newline at end of file
+        return JSONResponse(content = {'message': f'Message {sequence_num} has been updated to {new_message}.',
+                                    'message_object': room_instance.find_message_by_sequence_num(sequence_num = sequence_num).to_dict()}, status_code = 201)
\ No newline at end of file
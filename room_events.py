@@ -0,0 +1,215 @@
+import asyncio
+import logging
+from constants import *
+
+''' This file holds the notifications that a ChatRoom sends out when a new message is accepted.
+    NOTE: ChatRoom is not async and may be called from a worker thread, so waking the waiters and feeding the subscriptions is always
+            handed to the event loop that they belong to.
+    NOTE: there are two ways to listen to a room:
+            - wait(): a long poll request parks until the room has something new and then reads it from the room itself
+            - subscribe(): a push connection (websocket or server-sent events) gets every accepted message put on its own queue
+'''
+
+logging.basicConfig(filename='message_chat.log', level=logging.DEBUG, format = LOG_FORMAT)
+
+class RoomSubscription():
+    """ The queue of messages for one push connection to a room.
+        NOTE: the queue is bounded, a connection that falls queue_size messages behind is dropped instead of slowing down the room
+        NOTE: get() returns None once the subscription is closed, the connection should then be closed as well
+    """
+    def __init__(self, subscriber_alias: str, loop, message_filter = None, queue_size: int = ROOM_SUBSCRIPTION_QUEUE_SIZE) -> None:
+        self.__subscriber_alias = subscriber_alias
+        self.__loop = loop
+        self.__message_filter = message_filter
+        self.__queue = asyncio.Queue(maxsize = queue_size)
+        self.__closed = False
+        self.__dropped = False
+
+    # property to get the alias of the user on the other end of the connection
+    @property
+    def subscriber_alias(self):
+        return self.__subscriber_alias
+
+    # property to get the event loop that the connection runs on
+    @property
+    def loop(self):
+        return self.__loop
+
+    # property to check if the subscription was closed
+    @property
+    def closed(self):
+        return self.__closed
+
+    # property to check if the subscription was closed because the connection fell too far behind
+    @property
+    def dropped(self):
+        return self.__dropped
+
+    # property to get the number of messages waiting to be sent on the connection
+    @property
+    def num_queued(self):
+        return self.__queue.qsize()
+
+    def accepts(self, message) -> bool:
+        ''' This method will check if the message should be sent to the subscriber
+            NOTE: this runs on the thread that sent the message, so the filter has to be cheap
+        '''
+        if self.__closed is True:
+            return False
+        return self.__message_filter is None or self.__message_filter(message) is True
+
+    def offer(self, message) -> bool:
+        ''' This method will put the message on the queue, it only runs on the loop of the subscription
+            NOTE: returns False if the queue was full, the subscription is then dropped
+        '''
+        if self.__closed is True:
+            return False
+        try:
+            self.__queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            logging.warning(f'Subscription of {self.__subscriber_alias} fell {self.__queue.maxsize} messages behind and was dropped.')
+            self.__dropped = True
+            self.close()
+            return False
+
+    def close(self) -> None:
+        ''' This method will close the subscription, it only runs on the loop of the subscription
+            NOTE: whatever is still queued is thrown away so that get() returns None right away
+        '''
+        if self.__closed is True:
+            return
+        self.__closed = True
+        while not self.__queue.empty():
+            self.__queue.get_nowait()
+        self.__queue.put_nowait(None)
+
+    async def get(self, timeout: float = None):
+        ''' This method will wait for the next message of the subscription
+            NOTE: returns None when the subscription is closed, raises asyncio.TimeoutError if nothing came in before the timeout
+        '''
+        if timeout is None:
+            return await self.__queue.get()
+        return await asyncio.wait_for(self.__queue.get(), timeout)
+
+class RoomEvents():
+    """ Lets requests park on a room until a new message shows up, and fans new messages out to the push subscriptions of the room.
+        NOTE: every waiter awaits the same future, a new message resolves it and the next waiter makes a new one.
+                This is the same as an asyncio.Condition without the lock, so waking any number of waiters is one set_result()
+                and a parked waiter costs no CPU and no reads.
+        NOTE: there is one future per event loop, a future can only be awaited on the loop it was made on
+    """
+    def __init__(self, room_name: str) -> None:
+        self.__room_name = room_name
+        self.__new_message_futures = dict()
+        self.__num_waiters = 0
+        self.__subscriptions = set()
+
+    # property to get the number of requests parked on this room
+    @property
+    def num_waiters(self):
+        return self.__num_waiters
+
+    # property to get the number of push connections to this room
+    @property
+    def num_subscriptions(self):
+        return len(self.__subscriptions)
+
+    # property to check if anyone is waiting on or subscribed to this room, a room in use should not be dropped from memory
+    @property
+    def in_use(self):
+        return self.__num_waiters > 0 or len(self.__subscriptions) > 0
+
+    def publish(self, message) -> None:
+        ''' This method will wake every waiter and queue the message for every subscription that accepts it
+            NOTE: this is safe to call from any thread and never blocks on a subscriber
+        '''
+        if not self.__new_message_futures and not self.__subscriptions:
+            return
+        accepting_subscriptions = dict()
+        for subscription in list(self.__subscriptions):
+            if subscription.accepts(message):
+                accepting_subscriptions.setdefault(subscription.loop, list()).append(subscription)
+        for loop in set(self.__new_message_futures) | set(accepting_subscriptions):
+            self.__run_on_loop(loop, self.__deliver, loop, accepting_subscriptions.get(loop, list()), message)
+        logging.debug(f'New message {message.sequence_num} was published in {self.__room_name}.')
+
+    def subscribe(self, subscriber_alias: str, message_filter = None, queue_size: int = ROOM_SUBSCRIPTION_QUEUE_SIZE) -> RoomSubscription:
+        ''' This method will open a subscription to the room on the running event loop
+            NOTE: message_filter is called with every new message and should return True for the messages the subscriber can see
+        '''
+        subscription = RoomSubscription(subscriber_alias = subscriber_alias, loop = asyncio.get_running_loop(),
+                                        message_filter = message_filter, queue_size = queue_size)
+        self.__subscriptions.add(subscription)
+        logging.debug(f'{subscriber_alias} subscribed to {self.__room_name}.')
+        return subscription
+
+    def unsubscribe(self, subscription: RoomSubscription) -> None:
+        ''' This method will remove the subscription from the room, called when the connection goes away
+        '''
+        self.__subscriptions.discard(subscription)
+        self.__run_on_loop(subscription.loop, subscription.close)
+        logging.debug(f'{subscription.subscriber_alias} unsubscribed from {self.__room_name}.')
+
+    def close_subscriptions(self, subscriber_alias: str) -> int:
+        ''' This method will close every subscription of a user, used when the user is no longer allowed to read the room
+            NOTE: returns the number of subscriptions that were closed
+        '''
+        closed_subscriptions = [subscription for subscription in list(self.__subscriptions) if subscription.subscriber_alias == subscriber_alias]
+        for subscription in closed_subscriptions:
+            self.unsubscribe(subscription)
+        return len(closed_subscriptions)
+
+    async def wait(self, ready, timeout: float) -> bool:
+        ''' This method will wait until ready() returns True or the timeout runs out
+            NOTE: returns True if ready() is True, False if the wait timed out
+        '''
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        self.__num_waiters += 1
+        try:
+            while True:
+                # NOTE: the future is registered before ready() is checked, a message sent from another thread in between still wakes it
+                new_message_future = self.__new_message_futures.get(loop)
+                if new_message_future is None:
+                    new_message_future = self.__new_message_futures[loop] = loop.create_future()
+                if ready() is True:
+                    return True
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return False
+                try:
+                    await asyncio.wait_for(asyncio.shield(new_message_future), remaining)
+                except asyncio.TimeoutError:
+                    return ready()
+        finally:
+            self.__num_waiters -= 1
+
+    def __run_on_loop(self, loop, callback, *args) -> None:
+        ''' This is a helper method to run the callback on the loop, right away if we are already on it
+        '''
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if loop is running_loop:
+            callback(*args)
+        elif not loop.is_closed():
+            loop.call_soon_threadsafe(callback, *args)
+        else:
+            self.__new_message_futures.pop(loop, None)
+
+    def __deliver(self, loop, subscriptions: list, message) -> None:
+        ''' This is a helper method that wakes the waiters of a loop and feeds its subscriptions, it only runs on that loop
+        '''
+        self.__wake(loop)
+        for subscription in subscriptions:
+            if subscription.offer(message) is False:
+                self.__subscriptions.discard(subscription)
+
+    def __wake(self, loop) -> None:
+        ''' This is a helper method that resolves the future the waiters of a loop are parked on, it only runs on that loop
+        '''
+        new_message_future = self.__new_message_futures.pop(loop, None)
+        if new_message_future is not None and not new_message_future.done():
+            new_message_future.set_result(None)
@@ -0,0 +1,58 @@
+import asyncio
+import threading
+import time
+import unittest
+from collections import namedtuple
+from constants import *
+from room_events import RoomEvents
+
+EventMessage = namedtuple('EventMessage', ['sequence_num', 'message'])
+
+class RoomEventsTest(unittest.TestCase):
+    """ This test environment will test the long poll waiters and the push subscriptions of a room
+    """
+    def setUp(self) -> None:
+        self.__events = RoomEvents(room_name = 'general')
+
+    def test_message_between_register_and_check(self):
+        ''' A message sent from another thread right after ready() said no still wakes the waiter, it does not wait for the timeout
+        '''
+        sent_messages = list()
+        def ready() -> bool:
+            if not sent_messages:
+                sent_messages.append(EventMessage(1, 'hello'))
+                sender = threading.Thread(target = self.__events.publish, args = (sent_messages[0],))
+                sender.start()
+                sender.join()
+                return False
+            return True
+        async def wait_for_message():
+            start_time = time.monotonic()
+            ready_in_time = await self.__events.wait(ready = ready, timeout = 5)
+            return ready_in_time, time.monotonic() - start_time
+        ready_in_time, waited_seconds = asyncio.run(wait_for_message())
+        self.assertTrue(ready_in_time)
+        self.assertLess(waited_seconds, 1)
+        self.assertEqual(self.__events.num_waiters, 0)
+
+    def test_timeout(self):
+        ''' A waiter that gets no message gives up after the timeout
+        '''
+        self.assertFalse(asyncio.run(self.__events.wait(ready = lambda: False, timeout = 0.05)))
+        self.assertFalse(self.__events.in_use)
+
+    def test_subscriptions(self):
+        ''' A subscription only gets the messages its filter lets through, and is dropped once it falls queue_size messages behind
+        '''
+        async def publish_messages():
+            even_subscription = self.__events.subscribe('bob', message_filter = lambda message: message.sequence_num % 2 == 0)
+            slow_subscription = self.__events.subscribe('kevin', queue_size = 2)
+            for sequence_num in range(4):
+                self.__events.publish(EventMessage(sequence_num, ''))
+            received = [(await even_subscription.get(timeout = 1)).sequence_num for _ in range(2)]
+            return received, await slow_subscription.get(timeout = 1), slow_subscription.dropped
+        received, slow_message, dropped = asyncio.run(publish_messages())
+        self.assertEqual(received, [0, 2])
+        self.assertIsNone(slow_message)
+        self.assertTrue(dropped)
+        self.assertEqual(self.__events.num_subscriptions, 1)
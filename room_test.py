@@ -1,6 +1,7 @@
 import unittest
 from datetime import datetime
 from unittest import TestCase
+from unittest.mock import patch
 from constants import *
 from room import ChatRoom, MessageProperties, RoomList
 from users import *
@@ -14,7 +15,7 @@ class RoomTest(unittest.TestCase):
             TODO: set up the room list class here
         '''
         self.users = UserList()
-        self.room_list = RoomList()
+        self.room_list = RoomList(user_list = self.users)
         self.room_public = self.room_list.get(DEFAULT_PUBLIC_ROOM)
         if self.room_public is None:
             self.room_public = self.room_list.create(room_name = DEFAULT_PUBLIC_ROOM, owner_alias = 'testing', room_type = ROOM_TYPE_PUBLIC)
@@ -65,4 +66,24 @@ class RoomTest(unittest.TestCase):
                                                                 mess_type = PRIVATE_MESSAGE)))
         tuple_of_messages = self.__chat_room.get_messages(user_alias = TEST_OWNER_ALIAS)
         self.assertEqual(tuple_of_messages[2], self.__chat_room.num_messages)
-        self.assertIn(DEFAULT_FULL_CASE_TEST_MESSAGE, tuple_of_messages[0])
\ No newline at end of file
+        self.assertIn(DEFAULT_FULL_CASE_TEST_MESSAGE, tuple_of_messages[0])
+
+class RoomListEvictTest(unittest.TestCase):
+    """ This test environment will test that the room list only drops a room from memory once its messages are flushed
+        NOTE: only one room is kept loaded, so loading the second room tries to evict the first
+    """
+    def setUp(self) -> None:
+        self.room_list = RoomList(user_list = UserList(), max_loaded_rooms = 1)
+        for room_name in [DEFAULT_PUBLIC_ROOM, DEFAULT_PRIVATE_ROOM]:
+            if self.room_list.get(room_name) is None:
+                self.room_list.add(self.room_list.create(room_name = room_name, owner_alias = 'testing', room_type = ROOM_TYPE_PUBLIC))
+
+    def test_failed_flush_keeps_room(self):
+        ''' A room whose flush fails stays loaded instead of being dropped with its queued messages
+        '''
+        with patch.object(ChatRoom, 'persist', return_value = False):
+            public_room = self.room_list.get(DEFAULT_PUBLIC_ROOM)
+            private_room = self.room_list.get(DEFAULT_PRIVATE_ROOM)
+        self.assertEqual(self.room_list.num_loaded_rooms, 2)
+        self.assertIs(self.room_list.get(DEFAULT_PUBLIC_ROOM), public_room)
+        self.assertIs(self.room_list.get(DEFAULT_PRIVATE_ROOM), private_room)
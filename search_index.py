@@ -0,0 +1,281 @@
+import heapq
+import logging
+import math
+import re
+import threading
+from collections import Counter
+from constants import *
+from mongo_connection import CONNECTION_MANAGER
+from metrics import FLUSH_METRICS
+from bson.errors import InvalidDocument
+from pymongo import ReplaceOne, DeleteOne
+from pymongo.errors import PyMongoError
+
+''' This file holds the full-text search index of the messages of every room.
+    NOTE: the index maps every token to the rooms it shows up in and, per room, to the sequence numbers of the messages that have it
+            (with how many times they have it). A search only touches the postings of the tokens in the query and of the rooms
+            the user can read, never the messages themselves.
+    NOTE: the postings of a (token, room) are split in buckets of SEARCH_POSTING_BUCKET_SIZE sequence numbers, and each bucket is
+            one document in mongo, so no document can grow past the size limit of mongo however big the room gets. Only the buckets
+            that changed since the last flush are written. The WRITE_BEHIND_SCHEDULER flushes the index the same way it flushes the
+            write-behind buffers of the rooms.
+    NOTE: a search scores one bucket at a time and lets go of the lock between buckets, so a search for a common token never holds
+            up the writers for longer than one bucket.
+'''
+
+logging.basicConfig(filename='message_chat.log', level=logging.DEBUG, format = LOG_FORMAT)
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+def tokenize(text: str) -> Counter:
+    ''' This function will split a text into casefolded word tokens and count them
+    '''
+    return Counter(TOKEN_PATTERN.findall(text.casefold())) if text else Counter()
+
+class SearchIndex():
+    """ Inverted index from tokens to (room name, sequence number).
+        NOTE: a message is only in the index while it is not removed, removing and restoring a message takes it out and puts it back
+        NOTE: adding a message that is already in the index with the same text changes nothing, so reloading a room does not
+                make the index dirty
+        NOTE: the postings are token -> room name -> bucket -> sequence number -> count, the bucket is sequence number // bucket_size
+        NOTE: the tokens of a message are not kept apart from the postings, they are worked out again from the text of the message
+                when it is taken out, so the caller hands in the text that was indexed (the text before an edit)
+    """
+    def __init__(self, collection = None, bucket_size: int = SEARCH_POSTING_BUCKET_SIZE) -> None:
+        self.__collection = collection
+        self.__bucket_size = bucket_size
+        self.__lock = threading.RLock()
+        self.__flush_lock = threading.Lock()
+        self.__postings = dict()
+        self.__token_frequencies = Counter()
+        self.__documents = dict()
+        self.__num_documents = 0
+        self.__dirty_postings = set()
+        self.__restore_changes = None
+
+    # property to get the number of messages in the index
+    @property
+    def num_documents(self):
+        return self.__num_documents
+
+    # property to get the number of distinct tokens in the index
+    @property
+    def num_tokens(self):
+        return len(self.__postings)
+
+    # property to get the number of (token, room, bucket) postings waiting to be written
+    @property
+    def num_dirty(self):
+        return len(self.__dirty_postings)
+
+    def add_message(self, room_name: str, message) -> bool:
+        ''' This method will put a message in the index
+            NOTE: returns False if the message was already in the index with the same tokens
+            NOTE: to change the text of a message that is in the index, take it out with remove_message() and its old text first
+        '''
+        token_counts = tokenize(message.message)
+        sequence_num = message.sequence_num
+        bucket = sequence_num // self.__bucket_size
+        with self.__lock:
+            if self.__restore_changes is not None:
+                self.__restore_changes.add((room_name, sequence_num))
+            room_documents = self.__documents.setdefault(room_name, set())
+            if sequence_num in room_documents and all([self.__postings.get(token, dict()).get(room_name, dict()).get(bucket, dict()).get(sequence_num) == token_count
+                                                    for token, token_count in token_counts.items()]):
+                return False
+            if sequence_num not in room_documents:
+                room_documents.add(sequence_num)
+                self.__num_documents += 1
+            for token, token_count in token_counts.items():
+                bucket_postings = self.__postings.setdefault(token, dict()).setdefault(room_name, dict()).setdefault(bucket, dict())
+                if sequence_num not in bucket_postings:
+                    self.__token_frequencies[token] += 1
+                bucket_postings[sequence_num] = token_count
+                self.__dirty_postings.add((token, room_name, bucket))
+            return True
+
+    def remove_message(self, room_name: str, message, message_text: str = None) -> bool:
+        ''' This method will take a message out of the index
+            NOTE: message_text is the text the message was indexed with, it defaults to the text the message has now
+            NOTE: returns False if the message was not in the index
+        '''
+        token_counts = tokenize(message.message if message_text is None else message_text)
+        sequence_num = message.sequence_num
+        bucket = sequence_num // self.__bucket_size
+        with self.__lock:
+            if self.__restore_changes is not None:
+                self.__restore_changes.add((room_name, sequence_num))
+            room_documents = self.__documents.get(room_name)
+            if room_documents is None or sequence_num not in room_documents:
+                return False
+            room_documents.discard(sequence_num)
+            if not room_documents:
+                del self.__documents[room_name]
+            self.__num_documents -= 1
+            for token in token_counts:
+                token_postings = self.__postings.get(token, dict())
+                room_postings = token_postings.get(room_name, dict())
+                bucket_postings = room_postings.get(bucket, dict())
+                if bucket_postings.pop(sequence_num, None) is None:
+                    continue
+                if not bucket_postings:
+                    del room_postings[bucket]
+                    if not room_postings:
+                        del token_postings[room_name]
+                        if not token_postings:
+                            del self.__postings[token]
+                self.__token_frequencies[token] -= 1
+                if self.__token_frequencies[token] <= 0:
+                    del self.__token_frequencies[token]
+                self.__dirty_postings.add((token, room_name, bucket))
+            return True
+
+    def search(self, query: str, room_names = None, limit: int = SEARCH_DEFAULT_LIMIT, offset: int = 0) -> list:
+        ''' This method will return a page of the best matches for the query as (score, room name, sequence number), best first
+            NOTE: room_names limits the search to those rooms (the rooms the user can read), None searches every room
+            NOTE: the score is the sum of tf * idf of the query tokens in the message, ties go to the newest message
+            NOTE: only offset + limit matches are kept while scoring (heap), so a page costs O(matches * log(offset + limit))
+            NOTE: the lock is only held to find the buckets to score and then for one bucket at a time, a message that is added or
+                    removed while the search runs may or may not be in the results
+        '''
+        query_tokens = set(tokenize(query))
+        if not query_tokens or limit <= 0:
+            return []
+        matching_buckets = list()
+        with self.__lock:
+            for token in query_tokens:
+                if (token_postings := self.__postings.get(token)) is None:
+                    continue
+                inverse_document_frequency = math.log(1 + self.__num_documents / self.__token_frequencies[token])
+                if room_names is None:
+                    matching_rooms = token_postings.items()
+                elif len(room_names) < len(token_postings):
+                    matching_rooms = [(room_name, token_postings[room_name]) for room_name in room_names if room_name in token_postings]
+                else:
+                    matching_rooms = [(room_name, room_postings) for room_name, room_postings in token_postings.items() if room_name in room_names]
+                for room_name, room_postings in matching_rooms:
+                    matching_buckets.extend([(room_name, bucket_postings, inverse_document_frequency) for bucket_postings in room_postings.values()])
+        scores = dict()
+        for room_name, bucket_postings, inverse_document_frequency in matching_buckets:
+            with self.__lock:
+                for sequence_num, token_count in bucket_postings.items():
+                    scores[(room_name, sequence_num)] = scores.get((room_name, sequence_num), 0.0) + token_count * inverse_document_frequency
+        best_matches = heapq.nlargest(offset + limit, scores.items(), key = lambda match: (match[1], match[0][1]))
+        return [(score, room_name, sequence_num) for (room_name, sequence_num), score in best_matches[offset:]]
+
+    def due(self) -> bool:
+        ''' This method will check if there is anything to write, the scheduler calls it every flush interval
+            NOTE: nothing is written while restore() runs, see flush()
+        '''
+        return self.__restore_changes is None and len(self.__dirty_postings) > 0
+
+    def flush(self) -> bool:
+        ''' This method will write the buckets that changed since the last flush with one bulk_write
+            NOTE: a bucket that has no messages left is deleted
+            NOTE: if the write fails (mongo errors and documents mongo refuses), the buckets stay dirty for the next flush
+            NOTE: only one flush runs at a time, so an older copy of a posting can never be written after a newer one
+            NOTE: while restore() runs the flush is put off (returns False), a bucket written before restore() has read it
+                    from mongo would lose the postings that are not loaded yet
+        '''
+        with self.__flush_lock:
+            return self.__flush()
+
+    def __flush(self) -> bool:
+        ''' This is a helper method that does the flush, the flush lock must be held
+        '''
+        with self.__lock:
+            if not self.__dirty_postings:
+                return True
+            if self.__restore_changes is not None:
+                logging.debug('Search index flush put off until the restore is done.')
+                return False
+            dirty_postings = self.__dirty_postings
+            self.__dirty_postings = set()
+            write_requests = list()
+            for token, room_name, bucket in dirty_postings:
+                if bucket is None:
+                    # a (token, room) document from before the buckets, its postings were loaded into buckets by restore()
+                    write_requests.append(DeleteOne({'_id': {'token': token, 'room_name': room_name}}))
+                    continue
+                posting_id = {'token': token, 'room_name': room_name, 'bucket': bucket}
+                bucket_postings = self.__postings.get(token, dict()).get(room_name, dict()).get(bucket)
+                if not bucket_postings:
+                    write_requests.append(DeleteOne({'_id': posting_id}))
+                else:
+                    write_requests.append(ReplaceOne({'_id': posting_id},
+                                                    {'token': token, 'room_name': room_name, 'bucket': bucket,
+                                                    'postings': [[sequence_num, token_count] for sequence_num, token_count in bucket_postings.items()]},
+                                                    upsert = True))
+        try:
+            self.__get_collection().bulk_write(write_requests, ordered = False)
+            FLUSH_METRICS.record('search_index', len(write_requests))
+            logging.debug(f'Flushed {len(write_requests)} search index postings.')
+            return True
+        except (PyMongoError, InvalidDocument) as error:
+            logging.error(f'Failed to flush {len(write_requests)} search index postings: {error}')
+            with self.__lock:
+                self.__dirty_postings |= dirty_postings
+            return False
+
+    def restore(self) -> bool:
+        ''' This method will load the index from mongo, so that it does not have to be rebuilt from the messages after a restart
+            NOTE: the documents are read from the cursor without the lock and loaded SEARCH_RESTORE_BATCH_SIZE at a time, the lock
+                    is only held for one batch so rooms can be loaded and messages indexed while the index is restored
+            NOTE: a message that is added or removed while the index is restored is already up to date, its postings in mongo
+                    are skipped and the buckets they were in are written again on the next flush
+            NOTE: a document from before the buckets (one per (token, room)) or from another bucket size is loaded into the buckets
+                    of this index, those buckets are written and the old document is rewritten or deleted on the next flush
+        '''
+        with self.__lock:
+            self.__postings = dict()
+            self.__token_frequencies = Counter()
+            self.__documents = dict()
+            self.__num_documents = 0
+            self.__dirty_postings = set()
+            self.__restore_changes = set()
+        try:
+            posting_documents = list()
+            for posting_document in self.__get_collection().find(batch_size = SEARCH_RESTORE_BATCH_SIZE):
+                posting_documents.append(posting_document)
+                if len(posting_documents) >= SEARCH_RESTORE_BATCH_SIZE:
+                    self.__restore_batch(posting_documents)
+                    posting_documents = list()
+            self.__restore_batch(posting_documents)
+        finally:
+            with self.__lock:
+                self.__restore_changes = None
+        logging.info(f'Search index restored with {self.__num_documents} messages and {len(self.__postings)} tokens.')
+        return self.__num_documents > 0
+
+    def __restore_batch(self, posting_documents: list) -> None:
+        ''' This is a helper method to load a batch of posting documents into the index, it takes the lock for the whole batch
+        '''
+        with self.__lock:
+            for posting_document in posting_documents:
+                token = posting_document['token']
+                room_name = posting_document['room_name']
+                stored_bucket = posting_document.get('bucket')
+                for sequence_num, token_count in posting_document['postings']:
+                    bucket = sequence_num // self.__bucket_size
+                    if (room_name, sequence_num) in self.__restore_changes:
+                        self.__dirty_postings.update([(token, room_name, bucket), (token, room_name, stored_bucket)])
+                        continue
+                    room_documents = self.__documents.setdefault(room_name, set())
+                    if sequence_num not in room_documents:
+                        room_documents.add(sequence_num)
+                        self.__num_documents += 1
+                    bucket_postings = self.__postings.setdefault(token, dict()).setdefault(room_name, dict()).setdefault(bucket, dict())
+                    if sequence_num not in bucket_postings:
+                        self.__token_frequencies[token] += 1
+                    bucket_postings[sequence_num] = token_count
+                    if bucket != stored_bucket:
+                        self.__dirty_postings.update([(token, room_name, bucket), (token, room_name, stored_bucket)])
+
+    def __get_collection(self):
+        ''' This is a helper method to get the search index collection, it is only looked up the first time it is needed
+        '''
+        if self.__collection is None:
+            self.__collection = CONNECTION_MANAGER.get_collection(MONGO_DB_CLASS_SEARCH_INDEX)
+        return self.__collection
+
+SEARCH_INDEX = SearchIndex()
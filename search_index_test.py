@@ -0,0 +1,150 @@
+import unittest
+from collections import namedtuple
+from constants import *
+from pymongo import DeleteOne
+from pymongo.errors import DocumentTooLarge
+from search_index import SearchIndex, tokenize
+
+IndexedMessage = namedtuple('IndexedMessage', ['sequence_num', 'message'])
+
+class PostingCollection():
+    """ Just the parts of a mongo collection that the search index uses, the documents are kept in a dictionary by _id
+        NOTE: set error to make the next bulk_write raise it, set on_find to have it called once after find() returned the first document
+    """
+    def __init__(self, documents: list = None) -> None:
+        self.documents = {str(document['_id']): document for document in documents or []}
+        self.error = None
+        self.on_find = None
+
+    def find(self, batch_size: int = None):
+        for document in list(self.documents.values()):
+            yield document
+            if self.on_find is not None:
+                self.on_find()
+                self.on_find = None
+
+    def bulk_write(self, write_requests: list, ordered: bool = True) -> None:
+        if self.error is not None:
+            raise self.error
+        for write_request in write_requests:
+            document_id = str(write_request._filter['_id'])
+            if isinstance(write_request, DeleteOne):
+                self.documents.pop(document_id, None)
+            else:
+                self.documents[document_id] = dict(write_request._doc, _id = write_request._filter['_id'])
+
+class SearchIndexTest(unittest.TestCase):
+    """ This test environment will test ranking, room filtering and paging of the search index
+        NOTE: nothing is flushed, so no collection is needed
+    """
+    def setUp(self) -> None:
+        self.__search_index = SearchIndex()
+        self.__search_index.add_message('general', IndexedMessage(1, 'Hello world'))
+        self.__search_index.add_message('general', IndexedMessage(2, 'hello, hello there'))
+        self.__search_index.add_message('general', IndexedMessage(3, 'goodbye world'))
+        self.__search_index.add_message('private', IndexedMessage(1, 'hello from the private room'))
+
+    def test_tokenize(self):
+        ''' Tokens are casefolded words without punctuation
+        '''
+        self.assertEqual(tokenize('Hello, hello WORLD!'), {'hello': 2, 'world': 1})
+        self.assertEqual(len(tokenize('')), 0)
+
+    def test_ranking_and_rooms(self):
+        ''' More of the query tokens rank higher, and only the given rooms are searched
+        '''
+        matches = self.__search_index.search('hello world')
+        self.assertEqual([(room_name, sequence_num) for _, room_name, sequence_num in matches][0], ('general', 1))
+        self.assertEqual(len(matches), 4)
+        self.assertEqual({room_name for _, room_name, _ in self.__search_index.search('hello', room_names = {'private'})}, {'private'})
+        self.assertEqual(self.__search_index.search('missing'), [])
+
+    def test_paging(self):
+        ''' Pages follow each other without overlapping
+        '''
+        first_page = self.__search_index.search('hello', limit = 2)
+        second_page = self.__search_index.search('hello', limit = 2, offset = 2)
+        self.assertEqual(len(first_page), 2)
+        self.assertEqual(len(second_page), 1)
+        self.assertEqual(first_page + second_page, self.__search_index.search('hello', limit = 10))
+
+    def test_remove_and_edit(self):
+        ''' A removed message is no longer found, an edited message is found by its new text only
+        '''
+        self.assertTrue(self.__search_index.remove_message('general', IndexedMessage(3, 'goodbye world')))
+        self.assertFalse(self.__search_index.remove_message('general', IndexedMessage(3, 'goodbye world')))
+        self.assertEqual(self.__search_index.search('goodbye'), [])
+        self.assertFalse(self.__search_index.add_message('general', IndexedMessage(1, 'hello WORLD')))
+        edited_message = IndexedMessage(1, 'edited text')
+        self.assertTrue(self.__search_index.remove_message('general', edited_message, message_text = 'Hello world'))
+        self.assertTrue(self.__search_index.add_message('general', edited_message))
+        self.assertEqual(self.__search_index.search('hello', room_names = {'general'})[0][2], 2)
+        self.assertEqual([sequence_num for _, _, sequence_num in self.__search_index.search('edited world')], [1])
+        self.assertEqual(self.__search_index.num_documents, 3)
+
+class SearchIndexFlushTest(unittest.TestCase):
+    """ This test environment will test how the postings are written to and restored from mongo
+        NOTE: the collection is a dictionary, see PostingCollection
+    """
+    def test_buckets(self):
+        ''' The postings of a token are written one bucket of sequence numbers per document, and restored the same
+        '''
+        posting_collection = PostingCollection()
+        search_index = SearchIndex(collection = posting_collection, bucket_size = 4)
+        for sequence_num in range(10):
+            search_index.add_message('general', IndexedMessage(sequence_num, 'hello'))
+        self.assertTrue(search_index.flush())
+        self.assertEqual(sorted(document['bucket'] for document in posting_collection.documents.values()), [0, 1, 2])
+        self.assertTrue(all(len(document['postings']) <= 4 for document in posting_collection.documents.values()))
+        search_index.remove_message('general', IndexedMessage(8, 'hello'))
+        search_index.remove_message('general', IndexedMessage(9, 'hello'))
+        self.assertEqual(search_index.num_dirty, 1)
+        self.assertTrue(search_index.flush())
+        self.assertEqual(len(posting_collection.documents), 2)
+        restored_index = SearchIndex(collection = posting_collection, bucket_size = 4)
+        self.assertTrue(restored_index.restore())
+        self.assertEqual(restored_index.num_dirty, 0)
+        self.assertEqual(restored_index.search('hello', limit = 20), search_index.search('hello', limit = 20))
+
+    def test_restore_without_buckets(self):
+        ''' A (token, room) document from before the buckets is split in buckets and deleted on the next flush
+        '''
+        posting_collection = PostingCollection([{'_id': {'token': 'hello', 'room_name': 'general'}, 'token': 'hello', 'room_name': 'general',
+                                                'postings': [[sequence_num, 1] for sequence_num in range(6)]}])
+        search_index = SearchIndex(collection = posting_collection, bucket_size = 4)
+        self.assertTrue(search_index.restore())
+        self.assertEqual(search_index.num_documents, 6)
+        self.assertTrue(search_index.flush())
+        self.assertEqual(sorted(document['bucket'] for document in posting_collection.documents.values()), [0, 1])
+
+    def test_removed_while_restoring(self):
+        ''' A message taken out while the index is restored stays out, and its postings are deleted from mongo on the next flush
+        '''
+        posting_collection = PostingCollection()
+        search_index = SearchIndex(collection = posting_collection)
+        search_index.add_message('general', IndexedMessage(1, 'hello world'))
+        search_index.add_message('general', IndexedMessage(2, 'hello'))
+        self.assertTrue(search_index.flush())
+        restored_index = SearchIndex(collection = posting_collection)
+        removed_while_restoring = list()
+        posting_collection.on_find = lambda: removed_while_restoring.append(restored_index.remove_message('general', IndexedMessage(1, 'hello world')))
+        self.assertTrue(restored_index.restore())
+        self.assertEqual(removed_while_restoring, [False])
+        self.assertEqual(restored_index.num_documents, 1)
+        self.assertEqual([sequence_num for _, _, sequence_num in restored_index.search('hello world')], [2])
+        self.assertTrue(restored_index.flush())
+        self.assertEqual([document['postings'] for document in posting_collection.documents.values()], [[[2, 1]]])
+
+    def test_failed_flush(self):
+        ''' A flush that mongo refuses, even with an error that is not a mongo error, keeps the postings dirty
+        '''
+        posting_collection = PostingCollection()
+        search_index = SearchIndex(collection = posting_collection)
+        search_index.add_message('general', IndexedMessage(1, 'hello world'))
+        posting_collection.error = DocumentTooLarge('document too large')
+        self.assertFalse(search_index.flush())
+        self.assertEqual(search_index.num_dirty, 2)
+        posting_collection.error = None
+        self.assertTrue(search_index.flush())
+        self.assertEqual(search_index.num_dirty, 0)
+        self.assertEqual(len(posting_collection.documents), 2)
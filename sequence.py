@@ -0,0 +1,124 @@
+import logging
+import threading
+from constants import *
+from pymongo import ReturnDocument, UpdateOne
+
+''' This file holds the allocator that hands out message sequence numbers for a ChatRoom.
+    NOTE: instead of one round trip to the sequence collection per message, a whole block of numbers is reserved with a single $inc
+            and then handed out locally. The counter in mongo is always at the end of the last reserved block, so:
+                - numbers handed out by one process only ever go up
+                - two processes (or a process before and after a restart) never get the same number since their blocks never overlap
+                - the unused end of a block is lost when the process stops, which leaves a gap in the sequence. Readers must only rely on the order.
+    NOTE: every room has its own counter document, { '_id': room name, 'sequence_num': last reserved number }, so rooms never contend
+            on the same document and every read or update of a counter is an _id lookup.
+    NOTE: the counters used to be fields of one document ({ '_id': SEQUENCE_COUNTER_ID, room name: number, ... }) in the legacy
+            collection. A counter that has no document yet is seeded from its legacy field the first time it is used, and
+            migrate_sequence_counters() seeds every counter at once.
+'''
+
+logging.basicConfig(filename='message_chat.log', level=logging.DEBUG, format = LOG_FORMAT)
+
+class SequenceBlockAllocator():
+    """ Hands out sequence numbers for one counter, reserving them from mongo block_size at a time.
+        NOTE: the counter is the sequence_num field of the document counter_name in the counter collection
+    """
+    def __init__(self, counter_collection, counter_name: str, block_size: int = SEQUENCE_BLOCK_SIZE, legacy_collection = None) -> None:
+        self.__counter_collection = counter_collection
+        self.__counter_name = counter_name
+        self.__block_size = block_size
+        self.__legacy_collection = legacy_collection
+        self.__lock = threading.Lock()
+        self.__next_sequence_num = 0
+        self.__block_end = -1
+        self.__seeded = legacy_collection is None
+
+    # property to get the size of the blocks being reserved
+    @property
+    def block_size(self):
+        return self.__block_size
+
+    # property to get how many numbers are left in the current block
+    @property
+    def remaining(self):
+        return self.__block_end - self.__next_sequence_num + 1
+
+    def next(self) -> int:
+        ''' This method will return the next sequence number, reserving a new block from mongo when the current one runs out
+        '''
+        with self.__lock:
+            if self.__next_sequence_num > self.__block_end:
+                self.__reserve_block()
+            sequence_num = self.__next_sequence_num
+            self.__next_sequence_num += 1
+            return sequence_num
+
+    def current(self) -> int:
+        ''' This method will return the last number reserved in mongo for the counter, by any process
+            NOTE: returns SEQUENCE_NUMBER_NOT_FOUND if the counter has never been used
+        '''
+        with self.__lock:
+            self.__seed()
+            counter_document = self.__counter_collection.find_one({'_id': self.__counter_name}, projection = {'sequence_num': True})
+        return counter_document['sequence_num'] if counter_document is not None else SEQUENCE_NUMBER_NOT_FOUND
+
+    def skip_past(self, sequence_num: int) -> None:
+        ''' This method will make sure that every number handed out after this call is higher than sequence_num
+            NOTE: this is called after a restore, in case the counter in mongo is behind the messages (older data)
+        '''
+        with self.__lock:
+            if sequence_num < self.__next_sequence_num:
+                return
+            if sequence_num <= self.__block_end:
+                self.__next_sequence_num = sequence_num + 1
+                return
+            self.__seed()
+            self.__counter_collection.update_one({'_id': self.__counter_name},
+                                                {'$max': {'sequence_num': sequence_num}},
+                                                upsert = True)
+            self.__block_end = -1
+            self.__next_sequence_num = 0
+            logging.debug(f'Sequence counter {self.__counter_name} was moved past {sequence_num}.')
+
+    def __reserve_block(self) -> None:
+        ''' This is a helper method to reserve the next block of numbers with a single $inc, the lock must be held
+            NOTE: the counter holds the last number of the last reserved block
+        '''
+        self.__seed()
+        counter_document = self.__counter_collection.find_one_and_update(
+                                                        {'_id': self.__counter_name},
+                                                        {'$inc': {'sequence_num': self.__block_size}},
+                                                        projection = {'sequence_num': True},
+                                                        upsert = True,
+                                                        return_document = ReturnDocument.AFTER)
+        self.__block_end = counter_document['sequence_num']
+        self.__next_sequence_num = self.__block_end - self.__block_size + 1
+        logging.debug(f'Reserved sequence numbers {self.__next_sequence_num} to {self.__block_end} for {self.__counter_name}.')
+
+    def __seed(self) -> None:
+        ''' This is a helper method to carry the legacy counter over the first time the counter is used, the lock must be held
+            NOTE: $max never moves a counter back, so seeding a counter that another process already moved changes nothing
+        '''
+        if self.__seeded is True:
+            return
+        if self.__counter_collection.find_one({'_id': self.__counter_name}, projection = {'_id': True}) is None:
+            legacy_document = self.__legacy_collection.find_one({'_id': SEQUENCE_COUNTER_ID}, projection = {self.__counter_name: True})
+            if legacy_document is not None and type(legacy_document.get(self.__counter_name)) is int:
+                self.__counter_collection.update_one({'_id': self.__counter_name},
+                                                    {'$max': {'sequence_num': legacy_document[self.__counter_name]}},
+                                                    upsert = True)
+                logging.info(f'Sequence counter {self.__counter_name} was seeded from the legacy counter at {legacy_document[self.__counter_name]}.')
+        self.__seeded = True
+
+def migrate_sequence_counters(legacy_collection, counter_collection) -> int:
+    ''' This function will seed a counter document for every field of the legacy counter document with one bulk_write
+        NOTE: returns the number of counters seeded, running it twice changes nothing
+    '''
+    legacy_document = legacy_collection.find_one({'_id': SEQUENCE_COUNTER_ID})
+    if legacy_document is None:
+        return 0
+    write_requests = [UpdateOne({'_id': counter_name}, {'$max': {'sequence_num': sequence_num}}, upsert = True)
+                    for counter_name, sequence_num in legacy_document.items() if counter_name != '_id' and type(sequence_num) is int]
+    if write_requests:
+        counter_collection.bulk_write(write_requests, ordered = False)
+    logging.info(f'{len(write_requests)} sequence counters were migrated from the legacy counter document.')
+    return len(write_requests)
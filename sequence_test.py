@@ -0,0 +1,80 @@
+import unittest
+from constants import *
+from sequence import SequenceBlockAllocator, migrate_sequence_counters
+
+class CounterCollection():
+    """ Just the parts of a mongo collection that the allocator uses, the documents are kept in a dictionary by _id
+        NOTE: only $inc and $max are understood, num_reserved counts the blocks that were reserved
+    """
+    def __init__(self, documents: list = None) -> None:
+        self.documents = {document['_id']: dict(document) for document in documents or []}
+        self.num_reserved = 0
+
+    def find_one(self, filter: dict, projection: dict = None) -> dict:
+        document = self.documents.get(filter['_id'])
+        return dict(document) if document is not None else None
+
+    def update_one(self, filter: dict, update: dict, upsert: bool = False) -> None:
+        document = self.documents.setdefault(filter['_id'], {'_id': filter['_id']})
+        for field, value in update.get('$max', {}).items():
+            document[field] = max(document.get(field, value), value)
+        for field, value in update.get('$inc', {}).items():
+            document[field] = document.get(field, 0) + value
+
+    def find_one_and_update(self, filter: dict, update: dict, projection: dict = None, upsert: bool = False, return_document = None) -> dict:
+        self.num_reserved += 1
+        self.update_one(filter, update, upsert = upsert)
+        return self.find_one(filter)
+
+    def bulk_write(self, write_requests: list, ordered: bool = True) -> None:
+        for write_request in write_requests:
+            self.update_one(write_request._filter, write_request._doc, upsert = write_request._upsert)
+
+class SequenceBlockAllocatorTest(unittest.TestCase):
+    """ This test environment will test that sequence numbers are handed out in order, from blocks that never overlap
+    """
+    def setUp(self) -> None:
+        self.__counters = CounterCollection()
+
+    def test_blocks(self):
+        ''' Numbers come one after the other and mongo is only reached once per block
+        '''
+        allocator = SequenceBlockAllocator(counter_collection = self.__counters, counter_name = 'general', block_size = 10)
+        self.assertEqual([allocator.next() for _ in range(25)], list(range(1, 26)))
+        self.assertEqual(self.__counters.num_reserved, 3)
+        self.assertEqual(allocator.remaining, 5)
+        self.assertEqual(allocator.current(), 30)
+
+    def test_processes_never_overlap(self):
+        ''' Two allocators on the same counter, like two processes, never hand out the same number
+        '''
+        first_allocator = SequenceBlockAllocator(counter_collection = self.__counters, counter_name = 'general', block_size = 10)
+        second_allocator = SequenceBlockAllocator(counter_collection = self.__counters, counter_name = 'general', block_size = 10)
+        handed_out = [allocator.next() for _ in range(15) for allocator in (first_allocator, second_allocator)]
+        self.assertEqual(len(set(handed_out)), len(handed_out))
+        self.assertEqual(SequenceBlockAllocator(counter_collection = self.__counters, counter_name = 'general').current(), 40)
+
+    def test_skip_past(self):
+        ''' Numbers handed out after skip_past() are always higher, inside the block or past it, and it never goes back
+        '''
+        allocator = SequenceBlockAllocator(counter_collection = self.__counters, counter_name = 'general', block_size = 10)
+        allocator.next()
+        allocator.skip_past(5)
+        self.assertEqual(allocator.next(), 6)
+        allocator.skip_past(2)
+        self.assertEqual(allocator.next(), 7)
+        allocator.skip_past(41)
+        self.assertEqual(allocator.next(), 42)
+        self.assertEqual(self.__counters.num_reserved, 2)
+        SequenceBlockAllocator(counter_collection = self.__counters, counter_name = 'general', block_size = 10).skip_past(20)
+        self.assertEqual(allocator.current(), 51)
+
+    def test_seed_from_legacy(self):
+        ''' A counter without a document carries on from its field in the legacy counter document
+        '''
+        legacy_counters = CounterCollection([{'_id': SEQUENCE_COUNTER_ID, 'general': 41, 'broken': 'not a number'}])
+        allocator = SequenceBlockAllocator(counter_collection = self.__counters, counter_name = 'general', block_size = 10,
+                                        legacy_collection = legacy_counters)
+        self.assertEqual(allocator.next(), 42)
+        self.assertEqual(migrate_sequence_counters(legacy_collection = legacy_counters, counter_collection = self.__counters), 1)
+        self.assertEqual(self.__counters.documents['general']['sequence_num'], 51)
@@ -0,0 +1,51 @@
+import argparse
+import random
+import time
+from collections import namedtuple
+from constants import *
+from message_store import MessageStore
+
+''' This file holds a benchmark of the writes and the snapshots of a MessageStore as the room grows.
+    NOTE: every write that is not an append copies one chunk, one segment and the list of segments (copy on write), so the cost of an
+            insert out of order and of a snapshot should stay about the same from thousands to millions of messages. The benchmark
+            loads rooms of growing sizes with bulk_load(), then times appends, inserts at random places and snapshot() on each of them.
+    NOTE: run with `python store_benchmark.py`, it does not need mongo.
+'''
+
+StoredMessage = namedtuple('StoredMessage', ['sequence_num', 'message'])
+
+def microseconds_per_call(function, arguments: list) -> float:
+    ''' This function will call the function once with every argument and return the average time of a call, in microseconds
+    '''
+    start_time = time.perf_counter()
+    for argument in arguments:
+        function(argument)
+    return (time.perf_counter() - start_time) * 1000000 / len(arguments)
+
+def measure_store(num_messages: int, num_calls: int, chunk_size: int, segment_size: int) -> tuple:
+    ''' This function will load a store of num_messages messages (every other sequence number) and time the writes and the snapshots
+        NOTE: returns the microseconds per append, per insert out of order and per snapshot
+    '''
+    message_store = MessageStore(chunk_size = chunk_size, segment_size = segment_size)
+    message_store.bulk_load(StoredMessage(sequence_num, '') for sequence_num in range(0, 2 * num_messages, 2))
+    random_generator = random.Random(num_messages)
+    insert_nums = random_generator.sample(range(1, 2 * num_messages, 2), num_calls)
+    append_nums = range(2 * num_messages, 2 * num_messages + num_calls)
+    append_time = microseconds_per_call(lambda sequence_num: message_store.insert(StoredMessage(sequence_num, '')), append_nums)
+    insert_time = microseconds_per_call(lambda sequence_num: message_store.insert(StoredMessage(sequence_num, '')), insert_nums)
+    snapshot_time = microseconds_per_call(lambda _: message_store.snapshot(), range(num_calls))
+    assert len(message_store) == num_messages + 2 * num_calls
+    return append_time, insert_time, snapshot_time
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Measure the writes and the snapshots of a message store as the room grows.')
+    parser.add_argument('--sizes', type = int, nargs = '+', default = [10000, 100000, 1000000, 4000000], help = 'the numbers of messages in the rooms')
+    parser.add_argument('--calls', type = int, default = 2000, help = 'the number of appends, inserts and snapshots timed in every room')
+    parser.add_argument('--chunk-size', type = int, default = MESSAGE_STORE_CHUNK_SIZE, help = 'the chunk size of the store')
+    parser.add_argument('--segment-size', type = int, default = MESSAGE_STORE_SEGMENT_SIZE, help = 'the segment size of the store')
+    arguments = parser.parse_args()
+    print(f'chunk size {arguments.chunk_size}, segment size {arguments.segment_size}, {arguments.calls} calls per room')
+    print(f'{"messages":>10} {"append":>12} {"insert":>12} {"snapshot":>12}')
+    for num_messages in arguments.sizes:
+        append_time, insert_time, snapshot_time = measure_store(num_messages, arguments.calls, arguments.chunk_size, arguments.segment_size)
+        print(f'{num_messages:>10} {append_time:9.2f} us {insert_time:9.2f} us {snapshot_time:9.2f} us')
@@ -1,8 +1,12 @@
-from ast import alias
 import logging
+import threading
 from constants import *
 from datetime import date, datetime
-from pymongo import MongoClient
+from mongo_connection import CONNECTION_MANAGER
+from metrics import FLUSH_METRICS
+from mongo_indexes import INDEX_MANAGER
+from bson import ObjectId
+from pymongo import InsertOne, ReplaceOne
 from constants import *
 
 ''' Task List for this class: :)
@@ -12,14 +16,16 @@ logging.basicConfig(filename='message_chat.log', level=logging.DEBUG, format = L
 class ChatUser():
     """ class for users of the chat system. Users must be registered 
     """
-    def __init__(self, alias: str, user_id = None, blacklist: list = [], removed: bool = False, create_time: datetime = datetime.now(), modify_time: datetime = datetime.now()) -> None:
+    def __init__(self, alias: str, user_id = None, blacklist: list = None, removed: bool = False, create_time: datetime = None, modify_time: datetime = None) -> None:
         self.__alias = alias
         self.__user_id = user_id
-        self.__create_time = create_time
-        self.__modify_time = modify_time
+        self.__create_time = create_time if create_time is not None else datetime.now()
+        self.__modify_time = modify_time if modify_time is not None else datetime.now()
         self.__hash_pass = ''
-        self.__blacklist = blacklist
+        self.__blacklist = blacklist if blacklist is not None else list()
+        self.__blacklist_snapshot = None
         self.__removed = removed
+        self.__dirty_listener = None
         if self.__user_id is not None:
             self.__dirty = False
         else:
@@ -51,12 +57,32 @@ class ChatUser():
     @dirty.setter
     def dirty(self, new_value: bool):
         self.__modify_time = datetime.now()
+        became_dirty = new_value is True and self.__dirty is not True
         self.__dirty = new_value
+        if became_dirty and self.__dirty_listener is not None:
+            self.__dirty_listener(self)
+
+    # setter for the function that is called when the user becomes dirty, this is how the UserList tracks its dirty users
+    @property
+    def dirty_listener(self):
+        return self.__dirty_listener
+
+    @dirty_listener.setter
+    def dirty_listener(self, new_listener):
+        self.__dirty_listener = new_listener
 
     @property
     def blacklist(self):
         return self.__blacklist
 
+    # property to get the blacklist as a frozenset, it is only rebuilt after the blacklist changes
+    #   so a reader can resolve it once per request and a room can tell if it changed with an identity check
+    @property
+    def blacklist_snapshot(self):
+        if self.__blacklist_snapshot is None:
+            self.__blacklist_snapshot = frozenset(self.__blacklist)
+        return self.__blacklist_snapshot
+
     @property
     def hash_pass(self):
         return self.__hash_pass
@@ -83,6 +109,7 @@ class ChatUser():
         '''
         if alias not in self.blacklist:
             self.blacklist.append(alias)
+            self.__blacklist_snapshot = None
             self.dirty = True
             return True
         return False
@@ -96,6 +123,7 @@ class ChatUser():
         '''
         if alias in self.blacklist:
             self.blacklist.remove(alias)
+            self.__blacklist_snapshot = None
             self.dirty = True
             return True
         return False
@@ -111,12 +139,16 @@ class ChatUser():
         
 class UserList():
     """ List of users, inheriting list class
+        NOTE: the API changes users from the threads of the database executor, every change and persist holds the lock
     """
     def __init__(self, list_name: str = DEFAULT_USER_LIST_NAME) -> None:
+        self.__lock = threading.RLock()
         self.__user_list = list()
-        self.__mongo_client = MongoClient(f'mongodb://{MONGO_DB_HOST}:{MONGO_DB_PORT}/')
-        self.__mongo_db = self.__mongo_client.get_database(MONGO_DB)
-        self.__mongo_collection = self.__mongo_db.get_collection(MONGO_DB_CLASS_USERS)
+        self.__users_by_alias = dict()
+        self.__registered_aliases = set()
+        self.__dirty_users = dict()
+        self.__mongo_collection = CONNECTION_MANAGER.get_collection(MONGO_DB_CLASS_USERS)
+        INDEX_MANAGER.ensure_user_indexes(self.__mongo_collection)
         if self.__restore() is True:
             logging.debug('UserList Document was found in the collection.')
             self.__dirty = False
@@ -140,7 +172,12 @@ class UserList():
     # This property is to get the list of user_aliases
     @property
     def user_aliases(self):
-        return self.get_all_users_aliases
+        return self.get_all_users_aliases()
+
+    # This property is to get the set of aliases that are registered and not removed
+    @property
+    def registered_aliases(self):
+        return self.__registered_aliases
 
     # property to return the name of the user list
     @property
@@ -159,6 +196,11 @@ class UserList():
     def dirty(self):
         return self.__dirty
 
+    # property to get the number of users waiting to be persisted
+    @property
+    def num_dirty_users(self):
+        return len(self.__dirty_users)
+
     # setter that sets the value of the userlist when the userlist is modified outside of userlist
     @dirty.setter
     def dirty(self, new_value):
@@ -171,20 +213,27 @@ class UserList():
         ''' This method will return the size of the userlist
         '''
         return len(self.user_list)
+
+    def __contains__(self, alias: str) -> bool:
+        ''' This method will check if the alias belongs to a registered user that has not been removed
+            NOTE: this is a set lookup, use this instead of checking the list from get_all_users_aliases()
+        '''
+        return alias in self.__registered_aliases
     
     def register(self, new_alias: str) -> ChatUser:
         """ This method will just return a new ChatUser that will need to be added to the UserList
             This only creates the user, it does not add them to the list of users yet.
             NOTE: we check if the user already exists, if so, don't make another user with that alias
         """
-        if self.get(new_alias) is not None:
-            logging.warning(f'{new_alias} is already registered.')
-            return None
-        if len(new_alias) > 2:
-            logging.debug(f'Registered new user with name {new_alias}.')
-            user = ChatUser(alias = new_alias)
-            self.append(user)
-            return user
+        with self.__lock:
+            if self.get(new_alias) is not None:
+                logging.warning(f'{new_alias} is already registered.')
+                return None
+            if len(new_alias) > 2:
+                logging.debug(f'Registered new user with name {new_alias}.')
+                user = ChatUser(alias = new_alias)
+                self.append(user)
+                return user
 
     def deregister(self, alias_to_remove: str) -> ChatUser:
         ''' This method will return the chat user that was removed from the userlist
@@ -192,29 +241,32 @@ class UserList():
             NOTE: may want to remove this user from all of the users blacklist, 
                 or handle it in the restore, making sure that the user exists when updating the blacklist
         '''
-        if (user := self.get(alias_to_remove)) is None:
+        with self.__lock:
+            if (user := self.get(alias_to_remove)) is None:
+                return user
+            user.removed = True
+            self.__registered_aliases.discard(user.alias)
+            self.__persist()
             return user
-        user.removed = True
-        self.__persist()
-        return user
 
     def restore_alias(self, alias_to_restore: str):
         ''' This method will restore a alias back to being registered
         '''
-        if (user := self.get(target_alias = alias_to_restore)) is None:
+        with self.__lock:
+            if (user := self.get(target_alias = alias_to_restore)) is None:
+                return user
+            user.removed = False
+            self.__registered_aliases.add(user.alias)
+            self.__persist()
             return user
-        user.removed = False
-        self.__persist()
-        return user
 
     def get(self, target_alias: str) -> ChatUser:
         ''' This method will return the user from the user_list
-            NOTE: this method will utilize the index to find the user
+            NOTE: this method will utilize the alias index to find the user, removed users are still returned
         '''
-        for current_user in self.user_list:
-            if target_alias == current_user.alias:
-                logging.debug(f'User {target_alias} was found in user list {self.__list_name}.')
-                return current_user
+        if (found_user := self.__users_by_alias.get(target_alias)) is not None:
+            logging.debug(f'User {target_alias} was found in user list {self.__list_name}.')
+            return found_user
         logging.debug(f'User {target_alias} was not found in user list {self.__list_name}.')
         return None
 
@@ -223,18 +275,58 @@ class UserList():
             NOTE: This list should not be empty as there should at least be an owner to the list
         '''
         logging.debug(f'Attempting to get all user aliases in {self.__list_name}.')
-        return [user.alias for user in self.__user_list]
+        return list(self.__users_by_alias)
 
     def append(self, new_user: ChatUser) -> None:
         ''' This method will add the user to the to the list of users
             NOTE: the edge case makes sure that we are not adding nothing into the list
         '''
         if new_user is not None:
-            self.__user_list.append(new_user)
-            logging.debug(f'Alias {new_user.alias} added to the list of users.')
-            self.dirty = True
+            with self.__lock:
+                self.__index_user(new_user)
+                new_user.dirty_listener = self.__mark_dirty
+                if new_user.dirty is True:
+                    self.__mark_dirty(new_user)
+                logging.debug(f'Alias {new_user.alias} added to the list of users.')
+                self.dirty = True
+                self.__persist()
+
+    def persist(self) -> None:
+        ''' This method will persist the user list, only the users that changed since the last persist are written
+            NOTE: used after changing a user outside of the UserList, like their blacklist
+        '''
+        with self.__lock:
             self.__persist()
 
+    def update_blacklist(self, alias: str, target_alias: str, blacklisted: bool) -> ChatUser:
+        ''' This method will add target_alias to the blacklist of alias (or take it out) and persist the change
+            NOTE: returns the user whose blacklist changed, or None if alias is not a user
+            NOTE: the change and the persist hold the lock together, so a persist running on another thread can not miss the change
+        '''
+        with self.__lock:
+            if (user := self.get(target_alias = alias)) is None:
+                return user
+            if blacklisted is True:
+                user.add_alias_to_blacklist(alias = target_alias)
+            else:
+                user.remove_alias_from_blacklist(alias = target_alias)
+            self.__persist()
+            return user
+
+    def __index_user(self, user: ChatUser) -> None:
+        ''' This is a helper method to add the user to the list and to the alias indexes
+        '''
+        self.__user_list.append(user)
+        self.__users_by_alias[user.alias] = user
+        if user.removed is not True:
+            self.__registered_aliases.add(user.alias)
+
+    def __mark_dirty(self, user: ChatUser) -> None:
+        ''' This is a helper method that is called by a user when they change, so the next persist writes them
+        '''
+        with self.__lock:
+            self.__dirty_users[user.alias] = user
+
     def __restore(self) -> bool:
         """ First get the document for the queue itself, then get all documents that are not the queue metadata
             NOTE: we should have a list of aliases of the for the members that belong in a certain group chat.
@@ -257,37 +349,60 @@ class UserList():
                                     modify_time = current_user_metadata['modify_time'],
                                     blacklist = current_user_metadata['blacklist'],
                                     removed = current_user_metadata['removed'])
+            new_chat_user.dirty_listener = self.__mark_dirty
             logging.debug(current_user_metadata['alias'] + ' was added to the user list.')
-            self.__user_list.append(new_chat_user)
+            self.__index_user(new_chat_user)
         logging.info(f'All users in {self.__list_name} added to the user list.')
         return True
 
     def __persist(self):
         """ First save a document that describes the user list (name of list, create and modify times)
-            Second, for each user in the list create and save a document for that user
-            NOTE: persisting metadata first then persisting all users in user_list        
+            Second, for each user that changed since the last persist, save a document for that user
+            NOTE: persisting metadata first then persisting the dirty users in one bulk write
         """
         logging.info(f'Attemping to persist user list {self.__list_name}.')
-        if self.__mongo_collection.find_one({ 'list_name': self.__list_name}) is None:
-            self.__mongo_collection.insert_one({ 'list_name': self.__list_name,
-                                                'create_time': self.__create_time,
-                                                'modify_time': self.__modify_time})
+        if self.__id is None and (existing_metadata := self.__mongo_collection.find_one({ 'list_name': self.__list_name})) is not None:
+            self.__id = existing_metadata['_id']
+        if self.__id is None:
+            self.__id = self.__mongo_collection.insert_one({ 'list_name': self.__list_name,
+                                                            'create_time': self.__create_time,
+                                                            'modify_time': self.__modify_time}).inserted_id
             logging.debug(f'New user list {self.__list_name} added to the collection.')
         else:
             if self.__dirty == True:
-                self.__mongo_collection.replace_one(filter = { 'list_name': self.id},
+                self.__mongo_collection.replace_one(filter = { '_id': self.__id},
                                                     replacement = { 'list_name': self.__list_name,
                                                                 'create_time': self.__create_time, 
                                                                 'modify_time': self.__modify_time},
                                                     upsert = True)
                 logging.debug(f'User list {self.__list_name} has been updated in the collection.')
-                self.__dirty = False
-        for current_user in self.__user_list:
-            if current_user.dirty == True:
-                if current_user.user_id is None or self.__mongo_collection.find_one({ 'alias': current_user.alias }) is None:
-                    serialized = current_user.to_dict()
-                    current_user.user_id = self.__mongo_collection.insert_one(serialized)
-                else:
-                    self.__mongo_collection.replace_one({ '_id': current_user.user_id})
-                logging.debug(f'User {current_user.alias} has been added to the collection.')
-                current_user.dirty = False
+        self.__dirty = False
+        dirty_users = self.__dirty_users
+        self.__dirty_users = dict()
+        if not dirty_users:
+            return
+        write_requests = list()
+        for current_user in dirty_users.values():
+            if current_user.user_id is None:
+                current_user.user_id = ObjectId()
+                write_requests.append(InsertOne(self.__serialize(current_user)))
+            else:
+                write_requests.append(ReplaceOne({ '_id': current_user.user_id}, self.__serialize(current_user), upsert = True))
+        try:
+            self.__mongo_collection.bulk_write(write_requests, ordered = False)
+        except:
+            logging.error(f'Unable to persist {len(dirty_users)} users in user list {self.__list_name}.')
+            dirty_users.update(self.__dirty_users)
+            self.__dirty_users = dirty_users
+            raise
+        for current_user in dirty_users.values():
+            current_user.dirty = False
+            logging.debug(f'User {current_user.alias} has been persisted to the collection.')
+        FLUSH_METRICS.record('users', len(dirty_users))
+
+    def __serialize(self, user: ChatUser) -> dict:
+        ''' This is a helper method to turn a user into the document that is written, with its _id
+        '''
+        serialized = user.to_dict()
+        serialized['_id'] = user.user_id
+        return serialized
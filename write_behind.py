@@ -0,0 +1,207 @@
+import logging
+import threading
+import time
+import weakref
+from constants import *
+from metrics import FLUSH_METRICS
+from bson import ObjectId
+from pymongo import InsertOne, ReplaceOne
+from pymongo.errors import PyMongoError
+
+''' This file holds the write-behind buffer that a ChatRoom uses to persist its messages.
+    NOTE: messages are queued in the buffer and written with one bulk_write per batch instead of one insert per message.
+    NOTE: there are two durability modes:
+            - ack after flush: the sender only gets an answer once its message is in mongo. Senders that arrive while a batch is being
+                written wait and then get written together in the next batch (group commit), so there is no added latency for a lone sender.
+            - ack on enqueue: the sender gets an answer as soon as the message is queued, the scheduler thread writes the queue
+                every flush interval or as soon as it holds max_batch messages.
+'''
+
+logging.basicConfig(filename='message_chat.log', level=logging.DEBUG, format = LOG_FORMAT)
+
+class WriteBehindBuffer():
+    """ Queue of messages waiting to be written to one collection.
+        NOTE: the messages are keyed by sequence number, so a message that changes twice before a flush is only written once
+        NOTE: every message gets its _id before it is written, so a batch that failed part way can be retried safely
+        NOTE: document_fields is called on every flush for the fields that every written document gets on top of to_dict(),
+                a room uses it to key its messages with its room id in the shared messages collection
+    """
+    def __init__(self, collection, buffer_name: str, durability: str = WRITE_BEHIND_DURABILITY,
+                flush_interval_ms: int = WRITE_BEHIND_FLUSH_INTERVAL_MS, max_batch: int = WRITE_BEHIND_MAX_BATCH, document_fields = None) -> None:
+        self.__collection = collection
+        self.__buffer_name = buffer_name
+        self.__document_fields = document_fields
+        self.__durability = durability
+        self.__flush_interval = flush_interval_ms / 1000
+        self.__max_batch = max_batch
+        self.__pending = dict()
+        self.__oldest_enqueue_time = None
+        self.__condition = threading.Condition()
+        self.__flushing = False
+        self.__enqueued_ticket = 0
+        self.__flushed_ticket = 0
+        self.__last_flush_count = 0
+
+    # property to get the durability mode of the buffer
+    @property
+    def durability(self):
+        return self.__durability
+
+    # property to get the number of messages waiting to be written
+    @property
+    def num_pending(self):
+        return len(self.__pending)
+
+    # property to get the number of messages that the last flush wrote
+    @property
+    def last_flush_count(self):
+        return self.__last_flush_count
+
+    def enqueue(self, message) -> int:
+        ''' This method will queue the message to be written and return a ticket for wait_for()
+            NOTE: in ack on enqueue mode a full buffer is flushed right away by the caller
+        '''
+        with self.__condition:
+            if not self.__pending:
+                self.__oldest_enqueue_time = time.monotonic()
+            self.__pending[message.sequence_num] = message
+            self.__enqueued_ticket += 1
+            ticket = self.__enqueued_ticket
+            buffer_full = len(self.__pending) >= self.__max_batch
+        if buffer_full and self.__durability == ACK_ON_ENQUEUE:
+            self.flush()
+        return ticket
+
+    def wait_for(self, ticket: int) -> bool:
+        ''' This method will block until everything enqueued up to the ticket is in mongo
+            NOTE: the first waiter that finds no flush running writes the batch for everyone that is waiting (group commit)
+            NOTE: returns False if the flush failed, the messages stay queued for the next flush
+        '''
+        while True:
+            with self.__condition:
+                if self.__flushed_ticket >= ticket:
+                    return True
+                if self.__flushing is True:
+                    self.__condition.wait()
+                    continue
+            if self.flush() is False:
+                return False
+
+    def due(self) -> bool:
+        ''' This method will check if the oldest queued message has waited a full flush interval or the buffer is full
+        '''
+        if not self.__pending:
+            return False
+        return len(self.__pending) >= self.__max_batch or time.monotonic() - self.__oldest_enqueue_time >= self.__flush_interval
+
+    def flush(self) -> bool:
+        ''' This method will write every queued message in one bulk_write
+            NOTE: new messages are inserted, messages that are already in mongo are replaced
+        '''
+        with self.__condition:
+            while self.__flushing is True:
+                self.__condition.wait()
+            if not self.__pending:
+                self.__flushed_ticket = self.__enqueued_ticket
+                return True
+            self.__flushing = True
+            batch = self.__pending
+            batch_ticket = self.__enqueued_ticket
+            self.__pending = dict()
+            self.__oldest_enqueue_time = None
+        flush_succeeded = False
+        try:
+            write_requests = list()
+            document_fields = self.__document_fields() if self.__document_fields is not None else None
+            for message in batch.values():
+                if message.message_id is None:
+                    message.message_id = ObjectId()
+                    write_requests.append(InsertOne(self.__serialize(message, document_fields)))
+                else:
+                    write_requests.append(ReplaceOne({'_id': message.message_id}, self.__serialize(message, document_fields), upsert = True))
+            self.__collection.bulk_write(write_requests, ordered = False)
+            for message in batch.values():
+                message.dirty = False
+            flush_succeeded = True
+            FLUSH_METRICS.record('messages', len(batch))
+            logging.debug(f'Flushed {len(batch)} messages for {self.__buffer_name}.')
+        except PyMongoError as error:
+            logging.error(f'Failed to flush {len(batch)} messages for {self.__buffer_name}: {error}')
+        finally:
+            with self.__condition:
+                if flush_succeeded is True:
+                    self.__flushed_ticket = batch_ticket
+                    self.__last_flush_count = len(batch)
+                else:
+                    batch.update(self.__pending)
+                    self.__pending = batch
+                    self.__oldest_enqueue_time = time.monotonic()
+                self.__flushing = False
+                self.__condition.notify_all()
+        return flush_succeeded
+
+    def __serialize(self, message, document_fields: dict = None) -> dict:
+        ''' This is a helper method to turn a message into the document that is written, with its _id and the document fields
+        '''
+        serialized = message.to_dict()
+        serialized['_id'] = message.message_id
+        if document_fields is not None:
+            serialized.update(document_fields)
+        return serialized
+
+class WriteBehindScheduler():
+    """ One background thread for the whole process that flushes any buffer whose messages have waited a full flush interval.
+        NOTE: buffers are held weakly, a room that is dropped from memory does not keep its buffer alive
+    """
+    def __init__(self, flush_interval_ms: int = WRITE_BEHIND_FLUSH_INTERVAL_MS) -> None:
+        self.__flush_interval = flush_interval_ms / 1000
+        self.__buffers = weakref.WeakSet()
+        self.__lock = threading.Lock()
+        self.__stop_event = threading.Event()
+        self.__thread = None
+
+    def register(self, buffer: WriteBehindBuffer) -> None:
+        ''' This method will add the buffer to the buffers that get flushed, starting the thread on the first buffer
+        '''
+        with self.__lock:
+            self.__buffers.add(buffer)
+            if self.__thread is None:
+                self.__stop_event.clear()
+                self.__thread = threading.Thread(target = self.__run, name = 'write-behind-flusher', daemon = True)
+                self.__thread.start()
+
+    def drain(self) -> bool:
+        ''' This method will flush every buffer right away
+        '''
+        with self.__lock:
+            buffers = list(self.__buffers)
+        return all([buffer.flush() for buffer in buffers])
+
+    def stop(self) -> bool:
+        ''' This method will stop the thread and then drain every buffer, used when the app is shutting down
+        '''
+        with self.__lock:
+            thread = self.__thread
+            self.__thread = None
+        if thread is not None:
+            self.__stop_event.set()
+            thread.join()
+        drained = self.drain()
+        logging.info(f'Write-behind buffers drained {"cleanly" if drained else "with errors"}.')
+        return drained
+
+    def __run(self) -> None:
+        ''' This is the loop of the scheduler thread
+            NOTE: an error from one buffer is logged and the loop goes on, so one bad buffer can not stop the flushes of the others
+        '''
+        while not self.__stop_event.wait(self.__flush_interval):
+            with self.__lock:
+                buffers = list(self.__buffers)
+            for buffer in buffers:
+                try:
+                    if buffer.due():
+                        buffer.flush()
+                except Exception as error:
+                    logging.error(f'Flushing {type(buffer).__name__} failed in the write-behind thread: {error!r}')
+
+WRITE_BEHIND_SCHEDULER = WriteBehindScheduler()
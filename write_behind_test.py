@@ -0,0 +1,132 @@
+import threading
+import time
+import unittest
+from constants import *
+from pymongo import InsertOne, ReplaceOne
+from pymongo.errors import AutoReconnect
+from write_behind import WriteBehindBuffer, WriteBehindScheduler
+
+class BufferedMessage():
+    """ Just the parts of a ChatMessage that the write-behind buffer uses
+    """
+    def __init__(self, sequence_num: int, message: str = '') -> None:
+        self.sequence_num = sequence_num
+        self.message = message
+        self.message_id = None
+        self.dirty = True
+
+    def to_dict(self) -> dict:
+        return {'message': self.message, 'sequence_num': self.sequence_num}
+
+class BatchCollection():
+    """ Just bulk_write, keeping every batch of write requests it was given
+        NOTE: set error to make the next bulk_write raise it, clear started to make the next bulk_write wait until release is set
+    """
+    def __init__(self) -> None:
+        self.batches = list()
+        self.error = None
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+
+    def bulk_write(self, write_requests: list, ordered: bool = True) -> None:
+        self.started.set()
+        self.release.wait()
+        if self.error is not None:
+            raise self.error
+        self.batches.append(write_requests)
+
+class WriteBehindBufferTest(unittest.TestCase):
+    """ This test environment will test the batching, the group commit and the retries of the write-behind buffer
+    """
+    def setUp(self) -> None:
+        self.__collection = BatchCollection()
+        self.__buffer = WriteBehindBuffer(collection = self.__collection, buffer_name = 'test', durability = ACK_AFTER_FLUSH,
+                                        document_fields = lambda: {'room_id': 'room'})
+
+    def test_one_write_per_message(self):
+        ''' A message queued twice before a flush is written once, with the fields of the buffer on top of its own
+        '''
+        first_message = BufferedMessage(1)
+        self.__buffer.enqueue(first_message)
+        self.__buffer.enqueue(BufferedMessage(2))
+        self.__buffer.enqueue(first_message)
+        self.assertTrue(self.__buffer.flush())
+        self.assertEqual(len(self.__collection.batches), 1)
+        self.assertEqual(len(self.__collection.batches[0]), 2)
+        self.assertEqual(self.__collection.batches[0][0]._doc['room_id'], 'room')
+        self.assertFalse(first_message.dirty)
+        self.assertEqual(self.__buffer.num_pending, 0)
+
+    def test_group_commit(self):
+        ''' Senders that come in while a batch is being written are written together in the next batch
+        '''
+        self.__collection.started.clear()
+        self.__collection.release.clear()
+        first_ticket = self.__buffer.enqueue(BufferedMessage(1))
+        results = list()
+        first_sender = threading.Thread(target = lambda: results.append(self.__buffer.wait_for(first_ticket)))
+        first_sender.start()
+        self.__collection.started.wait()
+        tickets = [self.__buffer.enqueue(BufferedMessage(sequence_num)) for sequence_num in range(2, 5)]
+        senders = [threading.Thread(target = lambda ticket = ticket: results.append(self.__buffer.wait_for(ticket))) for ticket in tickets]
+        for sender in senders:
+            sender.start()
+        self.__collection.release.set()
+        for sender in [first_sender] + senders:
+            sender.join()
+        self.assertEqual(results, [True] * 4)
+        self.assertEqual([len(batch) for batch in self.__collection.batches], [1, 3])
+
+    def test_retry_after_failure(self):
+        ''' A batch that fails stays queued with the messages that came after it, and is written again with the same _id
+        '''
+        failed_message = BufferedMessage(1)
+        ticket = self.__buffer.enqueue(failed_message)
+        self.__collection.error = AutoReconnect('mongo is down')
+        self.assertFalse(self.__buffer.wait_for(ticket))
+        self.assertIsNotNone(failed_message.message_id)
+        self.assertTrue(failed_message.dirty)
+        self.__buffer.enqueue(BufferedMessage(2))
+        self.assertEqual(self.__buffer.num_pending, 2)
+        self.__collection.error = None
+        self.assertTrue(self.__buffer.wait_for(ticket))
+        self.assertEqual(self.__buffer.num_pending, 0)
+        retried_request = next(write_request for write_request in self.__collection.batches[0] if isinstance(write_request, ReplaceOne))
+        self.assertEqual(retried_request._filter, {'_id': failed_message.message_id})
+        self.assertTrue(retried_request._upsert)
+        self.assertEqual(sum(isinstance(write_request, InsertOne) for write_request in self.__collection.batches[0]), 1)
+
+class BrokenBuffer():
+    """ A buffer whose due() always raises, called is set once it has raised
+    """
+    def __init__(self) -> None:
+        self.called = threading.Event()
+
+    def due(self) -> bool:
+        self.called.set()
+        raise ValueError('broken buffer')
+
+    def flush(self) -> bool:
+        return True
+
+class WriteBehindSchedulerTest(unittest.TestCase):
+    """ This test environment will test the thread that flushes the buffers
+    """
+    def test_broken_buffer(self):
+        ''' A buffer that raises does not stop the thread from flushing the other buffers
+        '''
+        scheduler = WriteBehindScheduler(flush_interval_ms = 5)
+        collection = BatchCollection()
+        write_buffer = WriteBehindBuffer(collection = collection, buffer_name = 'test', durability = ACK_ON_ENQUEUE, flush_interval_ms = 5)
+        broken_buffer = BrokenBuffer()
+        scheduler.register(broken_buffer)
+        scheduler.register(write_buffer)
+        self.assertTrue(broken_buffer.called.wait(5))
+        write_buffer.enqueue(BufferedMessage(1))
+        deadline = time.monotonic() + 5
+        while write_buffer.num_pending > 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(write_buffer.num_pending, 0)
+        self.assertTrue(scheduler.stop())
+        self.assertEqual(len(collection.batches), 1)